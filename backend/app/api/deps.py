@@ -1,64 +1,239 @@
 """
 Shared API dependencies for authentication and authorization.
 
-Uses Supabase native session tokens (supabase_admin.auth.get_user) as the
-single source of truth for identity. No self-signed JWT.
+Uses Supabase native session tokens as the single source of truth for
+identity. No self-signed JWT. Tokens are either checked remotely
+(supabase_admin_async.auth.get_user) or, with AUTH_VERIFY_MODE=local, verified
+in-process against the project's JWT secret / JWKS keys with a remote
+fallback when local verification is ambiguous.
+
+Resolved tokens are kept in a small LRU+TTL cache keyed by a hash of the
+token, so polling clients do not re-verify the same token on every call.
+Entries never outlive the token's `exp`; definitively invalid tokens are
+cached briefly as well so a misbehaving client cannot hammer the auth server.
+
+Credit-charging endpoints accept an `Idempotency-Key` header
+(`get_idempotency_key` + `run_idempotent`, see app.services.idempotency).
 """
+import hashlib
 import logging
-from fastapi import HTTPException, status, Depends
+import time
+import jwt
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from fastapi import Header, HTTPException, Query, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.db.supabase import supabase_admin
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.security import jwt_verifier, TokenAmbiguous, TokenInvalid
+from app.db.supabase import supabase_admin_async
+from app.services.idempotency import (
+    IdempotencyKeyReused,
+    IdempotencyKeyUnavailable,
+    idempotency_store,
+    request_hash,
+)
 
 logger = logging.getLogger(__name__)
+T = TypeVar("T")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
+token_cache = TTLCache(
+    maxsize=settings.AUTH_TOKEN_CACHE_SIZE,
+    default_ttl=settings.AUTH_TOKEN_CACHE_TTL_SECONDS,
+)
 
-async def get_current_user_id(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> str:
-    """Verify the Supabase session token and return the user id."""
-    token = credentials.credentials
+admin_role_cache = TTLCache(
+    maxsize=settings.ADMIN_ROLE_CACHE_SIZE,
+    default_ttl=settings.ADMIN_ROLE_CACHE_TTL_SECONDS,
+)
+
+
+class _RejectedToken:
+    """Negative cache entry for a token the auth layer refused."""
+
+    __slots__ = ("detail",)
+
+    def __init__(self, detail: str):
+        self.detail = detail
+
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _positive_ttl(token: str) -> float:
+    """Cache TTL for a valid token, capped by its `exp` claim."""
     try:
-        response = supabase_admin.auth.get_user(token)
-        if not response or not response.user:
+        claims = jwt.decode(token, options={"verify_signature": False})
+        exp = float(claims["exp"])
+    except Exception:
+        return 0
+    return min(settings.AUTH_TOKEN_CACHE_TTL_SECONDS, exp - time.time())
+
+
+async def _verify_remote(token: str) -> str:
+    """Ask the Supabase auth server who owns the token."""
+    response = await supabase_admin_async.auth.get_user(token)
+    if not response or not response.user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token: user not found",
+        )
+    return response.user.id
+
+
+async def _resolve_user_id(token: str) -> str:
+    if settings.AUTH_VERIFY_MODE == "local":
+        try:
+            return jwt_verifier.verify(token)["sub"]
+        except TokenInvalid as e:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token: user not found",
+                detail=f"Invalid token: {e}",
             )
-        return response.user.id
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error("Authentication error: %s", e)
+        except TokenAmbiguous as e:
+            logger.debug("Local token verification ambiguous, using auth server: %s", e)
+
+    return await _verify_remote(token)
+
+
+def _reject(key: str, detail: str) -> HTTPException:
+    token_cache.set(key, _RejectedToken(detail), ttl=settings.AUTH_NEGATIVE_CACHE_TTL_SECONDS)
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+
+async def get_current_user_id(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> str:
+    """Verify the Supabase session token and return the user id."""
+    return await _authenticate(credentials.credentials)
+
+
+async def get_stream_user_id(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    access_token: Optional[str] = Query(default=None),
+) -> str:
+    """
+    Like `get_current_user_id`, but also accepts `?access_token=` because
+    browser EventSource/WebSocket clients cannot send an Authorization header.
+    """
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+        )
+    return await _authenticate(token)
+
+
+async def _authenticate(token: str) -> str:
+    key = _token_cache_key(token)
+
+    cached = token_cache.get(key)
+    if isinstance(cached, _RejectedToken):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Authentication failed: {e}",
+            detail=cached.detail,
         )
+    if cached is not None:
+        return cached
+
+    try:
+        user_id = await _resolve_user_id(token)
+    except HTTPException as e:
+        raise _reject(key, e.detail)
+    except Exception as e:
+        logger.error("Authentication error: %s", e)
+        detail = f"Authentication failed: {e}"
+        # Only auth-server rejections are definitive; network errors are not.
+        if getattr(e, "status", None) in (400, 401, 403):
+            raise _reject(key, detail)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+    token_cache.set(key, user_id, ttl=_positive_ttl(token))
+    return user_id
 
 
 async def get_current_admin_id(
     user_id: str = Depends(get_current_user_id),
 ) -> str:
-    """Ensure the current user is an admin (profiles.is_admin = true)."""
-    try:
-        resp = (
-            supabase_admin.table("profiles")
-            .select("is_admin")
-            .eq("id", user_id)
-            .single()
-            .execute()
-        )
-        if not resp.data or not resp.data.get("is_admin"):
+    """
+    Ensure the current user is an admin (profiles.is_admin = true).
+
+    The flag is cached per user for ADMIN_ROLE_CACHE_TTL_SECONDS. The backend
+    never changes is_admin itself (it is set in the dashboard or SQL), so
+    the TTL alone bounds how long a grant or revocation takes to apply.
+    """
+    is_admin = admin_role_cache.get(user_id)
+    if is_admin is None:
+        try:
+            resp = (
+                await supabase_admin_async.table("profiles")
+                .select("is_admin")
+                .eq("id", user_id)
+                .single()
+                .execute()
+            )
+            is_admin = bool(resp.data and resp.data.get("is_admin"))
+        except Exception as e:
+            logger.error("Admin check error: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Admin privileges required",
             )
-        return user_id
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error("Admin check error: %s", e)
+        admin_role_cache.set(user_id, is_admin)
+
+    if not is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privileges required",
         )
+    return user_id
+
+
+def get_idempotency_key(
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+) -> Optional[str]:
+    """The optional `Idempotency-Key` header of a charging request."""
+    if idempotency_key is not None and not 1 <= len(idempotency_key) <= 255:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Idempotency-Key must be 1-255 characters",
+        )
+    return idempotency_key
+
+
+async def run_idempotent(
+    scope: str,
+    user_id: str,
+    idempotency_key: Optional[str],
+    payload: Any,
+    fn: Callable[[], Awaitable[T]],
+) -> T:
+    """
+    Run an endpoint body at most once per (user, key): a retry gets the
+    original response, a concurrent duplicate waits for it. Without a key,
+    `fn` simply runs.
+    """
+    if idempotency_key is None:
+        return await fn()
+    try:
+        return await idempotency_store.run(
+            user_id,
+            idempotency_key,
+            scope,
+            # The same key on another endpoint is a different request too.
+            request_hash({"scope": scope, "body": payload}),
+            fn,
+        )
+    except IdempotencyKeyReused as e:
+        raise HTTPException(
+            status_code=422,  # constant name differs across Starlette versions
+            detail=str(e),
+        )
+    except IdempotencyKeyUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+        )
@@ -5,8 +5,19 @@ All admin routes require the `is_admin` flag on the user's profile.
 """
 from fastapi import APIRouter, HTTPException, status, Depends
 import logging
-from app.db.supabase import supabase_admin
-from app.api.deps import get_current_admin_id
+from app.db.supabase import supabase_admin_async
+from app.api.deps import get_current_admin_id, token_cache, admin_role_cache
+from app.services.ai_service import dashscope_service, deepseek_service
+from app.services.task_poller import task_poller
+from app.services.job_queue import job_worker
+from app.services.credits_service import balance_cache
+from app.services.idempotency import idempotency_store
+from app.services.progress import progress_reporter
+from app.services.prompt_cache import prompt_cache
+from app.services.result_cache import result_cache
+from app.services.scheduler import generation_scheduler
+from app.services.task_events import task_events
+from app.services.task_read_model import task_read_model
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 logger = logging.getLogger(__name__)
@@ -17,7 +28,7 @@ async def list_users(admin_id: str = Depends(get_current_admin_id)):
     """List all users (admin only)."""
     try:
         result = (
-            supabase_admin.table("profiles")
+            await supabase_admin_async.table("profiles")
             .select("id, email, full_name, credits, subscription_tier, is_admin, created_at")
             .order("created_at", desc=True)
             .execute()
@@ -32,9 +43,9 @@ async def list_users(admin_id: str = Depends(get_current_admin_id)):
 async def platform_stats(admin_id: str = Depends(get_current_admin_id)):
     """Platform-wide statistics (admin only)."""
     try:
-        users = supabase_admin.table("profiles").select("id", count="exact").execute()
-        projects = supabase_admin.table("projects").select("id", count="exact").execute()
-        tasks = supabase_admin.table("generation_tasks").select("id", count="exact").execute()
+        users = await supabase_admin_async.table("profiles").select("id", count="exact").execute()
+        projects = await supabase_admin_async.table("projects").select("id", count="exact").execute()
+        tasks = await supabase_admin_async.table("generation_tasks").select("id", count="exact").execute()
 
         return {
             "total_users": users.count or 0,
@@ -44,3 +55,26 @@ async def platform_stats(admin_id: str = Depends(get_current_admin_id)):
     except Exception as e:
         logger.error(f"Admin stats error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/metrics")
+async def service_metrics(admin_id: str = Depends(get_current_admin_id)):
+    """In-process cache and client metrics for this worker (admin only)."""
+    return {
+        "auth_token_cache": token_cache.stats(),
+        "admin_role_cache": admin_role_cache.stats(),
+        "balance_cache": balance_cache.stats(),
+        "upstream_http": {
+            "dashscope": dashscope_service.pool_stats(),
+            "deepseek": deepseek_service.pool_stats(),
+        },
+        "task_poller": task_poller.stats(),
+        "job_worker": job_worker.stats(),
+        "scheduler": generation_scheduler.stats(),
+        "idempotency": idempotency_store.stats(),
+        "progress": progress_reporter.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "task_events": task_events.stats(),
+        "task_read_model": task_read_model.stats(),
+    }
@@ -5,7 +5,7 @@ Uses Supabase native session tokens exclusively -- no self-signed JWT.
 """
 from fastapi import APIRouter, HTTPException, status, Depends
 from app.schemas import UserCreate, UserLogin, TokenResponse, UserResponse
-from app.db.supabase import supabase, supabase_admin
+from app.db.supabase import supabase_async, supabase_admin_async
 from app.api.deps import get_current_user_id
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -15,7 +15,7 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 async def register(user_data: UserCreate):
     """Register a new user and return the Supabase session token."""
     try:
-        auth_response = supabase.auth.sign_up({
+        auth_response = await supabase_async.auth.sign_up({
             "email": user_data.email,
             "password": user_data.password,
             "options": {
@@ -33,7 +33,7 @@ async def register(user_data: UserCreate):
 
         # Fetch the profile created by trigger
         profile_response = (
-            supabase_admin.table("profiles")
+            await supabase_admin_async.table("profiles")
             .select("*")
             .eq("id", auth_response.user.id)
             .single()
@@ -63,7 +63,7 @@ async def register(user_data: UserCreate):
 async def login(credentials: UserLogin):
     """Login user and return the Supabase session token."""
     try:
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await supabase_async.auth.sign_in_with_password({
             "email": credentials.email,
             "password": credentials.password
         })
@@ -75,7 +75,7 @@ async def login(credentials: UserLogin):
             )
 
         profile_response = (
-            supabase_admin.table("profiles")
+            await supabase_admin_async.table("profiles")
             .select("*")
             .eq("id", auth_response.user.id)
             .single()
@@ -110,7 +110,7 @@ async def logout():
 async def get_current_user(user_id: str = Depends(get_current_user_id)):
     """Get current user profile."""
     profile_response = (
-        supabase_admin.table("profiles")
+        await supabase_admin_async.table("profiles")
         .select("*")
         .eq("id", user_id)
         .single()
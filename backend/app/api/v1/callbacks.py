@@ -0,0 +1,87 @@
+"""
+Upstream completion callbacks.
+
+DashScope (or the local mock server in scripts/) POSTs the final status of
+an async task here. The payload has the same shape as a task status read:
+`{"request_id": ..., "output": {"task_id": ..., "task_status": ..., ...}}`.
+
+If this process is polling the task, the callback resolves the poller's
+future and the waiting pipeline finishes the task immediately. Otherwise
+the matching `generation_tasks` row is finalized here; the pipeline that
+owns it (in another process) then finds it already final and does nothing.
+"""
+import hmac
+import logging
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, status
+
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.generation_pipeline import finalize_from_callback
+from app.services.task_poller import task_poller
+
+router = APIRouter(prefix="/callbacks", tags=["Callbacks"])
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = {"SUCCEEDED", "FAILED"}
+
+
+def _verify_token(token: Optional[str]) -> None:
+    expected = settings.DASHSCOPE_CALLBACK_TOKEN
+    if not expected:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Callbacks are not enabled"
+        )
+    if not token or not hmac.compare_digest(token, expected):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid callback token"
+        )
+
+
+@router.post("/dashscope")
+async def dashscope_callback(
+    payload: Dict[str, Any],
+    token: Optional[str] = Query(default=None),
+    x_callback_token: Optional[str] = Header(default=None),
+):
+    """Receive a DashScope task-completion notification."""
+    _verify_token(x_callback_token or token)
+
+    output = payload.get("output") or {}
+    task_id = output.get("task_id")
+    task_status = output.get("task_status")
+    if not task_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="output.task_id is required"
+        )
+    if task_status not in FINAL_STATUSES:
+        # Progress notifications; polling/the final callback handle these.
+        return {"status": "ignored"}
+
+    if task_poller.resolve(task_id, payload):
+        return {"status": "delivered"}
+
+    response = (
+        await supabase_admin_async.table("generation_tasks")
+        .select("id, project_id, user_id, status, job_type, config")
+        .eq("config->>ai_task_id", task_id)
+        .limit(1)
+        .execute()
+    )
+    if not response.data:
+        logger.warning(f"Callback for unknown upstream task {task_id}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Task not found"
+        )
+
+    job = response.data[0]
+    if job["status"] not in ("pending", "processing"):
+        return {"status": "already_final"}
+
+    await finalize_from_callback(job, payload)
+    return {"status": "finalized"}
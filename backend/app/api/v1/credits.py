@@ -11,9 +11,10 @@ from typing import Optional, List
 from datetime import datetime
 import logging
 
-from app.db.supabase import supabase_admin
+from app.db.supabase import supabase_admin_async
 from app.api.deps import get_current_user_id
 from app.core.config import settings
+from app.services import credits_service
 
 logger = logging.getLogger(__name__)
 
@@ -69,32 +70,21 @@ async def purchase_credits(
     total_credits = package["credits"] + package["bonus"]
 
     try:
-        # Add credits via RPC (reuse refund RPC which adds credits)
-        result = supabase_admin.rpc(
-            "refund_user_credits",
-            {
-                "p_user_id": user_id,
-                "p_amount": total_credits,
-                "p_description": f"购买积分套餐 - {package['credits']}积分 + {package['bonus']}赠送 (沙箱)",
-                "p_reference_id": None,
-                "p_reference_type": "purchase",
-            },
-        ).execute()
-
-        if not result.data:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="充值失败"
-            )
-
-        # RPC returns the new balance as an integer
-        balance_after = result.data if isinstance(result.data, int) else 0
+        # Add credits via the refund RPC (which adds credits); going through
+        # the service keeps the cached balance in step.
+        balance_after = await credits_service.refund_credits(
+            user_id=user_id,
+            amount=total_credits,
+            description=f"购买积分套餐 - {package['credits']}积分 + {package['bonus']}赠送 (沙箱)",
+            reference_id=None,
+            reference_type="purchase",
+        )
 
         return {
             "success": True,
             "message": "购买成功（沙箱模式）",
             "credits_added": total_credits,
-            "new_balance": balance_after,
+            "new_balance": balance_after or 0,
             "sandbox": True,
         }
 
@@ -117,7 +107,7 @@ async def get_transactions(
     """获取交易记录"""
     try:
         result = (
-            supabase_admin.table("credit_transactions")
+            await supabase_admin_async.table("credit_transactions")
             .select("*")
             .eq("user_id", user_id)
             .order("created_at", desc=True)
@@ -140,24 +130,18 @@ async def get_transactions(
 
 @router.get("/balance")
 async def get_balance(user_id: str = Depends(get_current_user_id)):
-    """获取当前积分余额"""
+    """获取当前积分余额（优先读取缓存，扣费/退款时同步更新）"""
     try:
-        result = (
-            supabase_admin.table("profiles")
-            .select("credits")
-            .eq("id", user_id)
-            .single()
-            .execute()
-        )
+        balance = await credits_service.get_balance(user_id)
 
-        if not result.data:
+        if balance is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="用户不存在"
             )
 
         return {
-            "balance": result.data.get("credits", 0)
+            "balance": balance
         }
 
     except HTTPException:
@@ -1,15 +1,16 @@
 """
 Digital humans API endpoints.
 """
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Depends
+from typing import List, Optional
 from pydantic import BaseModel, Field
 import logging
-from app.db.supabase import supabase_admin
-from app.api.deps import get_current_user_id
+from app.db.supabase import supabase_admin_async
+from app.api.deps import get_current_user_id, get_idempotency_key, run_idempotent
 from app.schemas import DigitalHumanCreate, DigitalHumanResponse
-from app.services.ai_service import dashscope_service
 from app.services.credits_service import deduct_credits, refund_credits
+from app.services.generation_pipeline import DIGITAL_HUMAN_MODEL
+from app.services.job_queue import enqueue_job
 
 router = APIRouter(prefix="/digital-humans", tags=["Digital Humans"])
 logger = logging.getLogger(__name__)
@@ -30,7 +31,7 @@ async def create_digital_human(
 ):
     """Create a new digital human."""
     try:
-        response = supabase_admin.table("digital_humans").insert({
+        response = await supabase_admin_async.table("digital_humans").insert({
             "user_id": user_id,
             "name": digital_human.name,
             "avatar_url": digital_human.avatar_url,
@@ -65,7 +66,7 @@ async def list_digital_humans(
     """Get all digital humans for the current user."""
     try:
         response = (
-            supabase_admin.table("digital_humans")
+            await supabase_admin_async.table("digital_humans")
             .select("*")
             .eq("user_id", user_id)
             .order("created_at", desc=True)
@@ -87,7 +88,7 @@ async def get_digital_human(
     """Get a specific digital human by ID."""
     try:
         response = (
-            supabase_admin.table("digital_humans")
+            await supabase_admin_async.table("digital_humans")
             .select("*")
             .eq("id", digital_human_id)
             .eq("user_id", user_id)
@@ -120,7 +121,7 @@ async def update_digital_human(
     """Update a digital human."""
     try:
         check_response = (
-            supabase_admin.table("digital_humans")
+            await supabase_admin_async.table("digital_humans")
             .select("id")
             .eq("id", digital_human_id)
             .eq("user_id", user_id)
@@ -133,7 +134,7 @@ async def update_digital_human(
                 detail="Digital human not found"
             )
 
-        response = supabase_admin.table("digital_humans").update({
+        response = await supabase_admin_async.table("digital_humans").update({
             "name": digital_human.name,
             "avatar_url": digital_human.avatar_url,
             "digital_human_type": digital_human.digital_human_type,
@@ -166,7 +167,7 @@ async def delete_digital_human(
     """Delete a digital human."""
     try:
         check_response = (
-            supabase_admin.table("digital_humans")
+            await supabase_admin_async.table("digital_humans")
             .select("id")
             .eq("id", digital_human_id)
             .eq("user_id", user_id)
@@ -179,7 +180,7 @@ async def delete_digital_human(
                 detail="Digital human not found"
             )
 
-        supabase_admin.table("digital_humans") \
+        await supabase_admin_async.table("digital_humans") \
             .delete() \
             .eq("id", digital_human_id) \
             .execute()
@@ -195,98 +196,37 @@ async def delete_digital_human(
         )
 
 
-async def process_digital_human_video(
-    digital_human_id: str,
-    user_id: str,
-    text: str,
-    duration: int
-):
-    """Background task to process digital human video generation."""
-    try:
-        logger.info(f"Starting digital human video generation for user {user_id}")
-
-        dh_response = (
-            supabase_admin.table("digital_humans")
-            .select("*")
-            .eq("id", digital_human_id)
-            .eq("user_id", user_id)
-            .execute()
-        )
-
-        if not dh_response.data or len(dh_response.data) == 0:
-            raise Exception("Digital human not found")
-
-        digital_human = dh_response.data[0]
-        avatar_url = digital_human.get("avatar_url")
-        voice_config = digital_human.get("voice_config", {})
-        voice_type = voice_config.get("voice_type", "female")
-
-        result = await dashscope_service.generate_digital_human_video(
-            avatar_url=avatar_url,
-            text=text,
-            voice_type=voice_type,
-            duration=duration
-        )
-
-        task_id = result.get("output", {}).get("task_id")
-        if not task_id:
-            raise Exception("Failed to get task_id from AI service")
-
-        final_result = await dashscope_service.wait_for_task_completion(
-            task_id=task_id,
-            max_wait_time=300,
-            poll_interval=5
-        )
-
-        video_url = final_result.get("output", {}).get("video_url")
-        if not video_url:
-            raise Exception("No video URL in result")
-
-        # Create project record (no "mode" column -- use project_type only)
-        project_response = supabase_admin.table("projects").insert({
-            "user_id": user_id,
-            "title": f"{digital_human.get('name')} - {text[:30]}...",
-            "description": text,
-            "project_type": "digital_human",
-            "status": "completed",
-            "video_url": video_url,
-            "credits_used": CREDITS_COST
-        }).execute()
-
-        return project_response.data[0] if project_response.data else None
-
-    except Exception as e:
-        logger.error(f"Error processing digital human video: {str(e)}", exc_info=True)
-
-        # Refund credits on failure via RPC
-        try:
-            logger.info(f"Refunding {CREDITS_COST} credits to user {user_id}")
-            refund_credits(
-                user_id=user_id,
-                amount=CREDITS_COST,
-                description=f"Refund for failed digital human video: {str(e)[:200]}",
-                reference_id=digital_human_id,
-                reference_type="digital_human",
-            )
-            logger.info(f"Refunded {CREDITS_COST} credits to user {user_id}")
-        except Exception as refund_error:
-            logger.error(f"Failed to refund credits: {str(refund_error)}", exc_info=True)
-
-        raise
-
-
 @router.post("/{digital_human_id}/generate-video")
 async def generate_digital_human_video(
     digital_human_id: str,
     request: VideoGenerateRequest,
-    background_tasks: BackgroundTasks,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
 ):
-    """Generate video with digital human speaking the provided text."""
+    """
+    Generate video with digital human speaking the provided text.
+
+    Send an `Idempotency-Key` header to make retries safe: a repeated
+    request returns the original response without charging again.
+    """
+    return await run_idempotent(
+        "generate_digital_human_video",
+        user_id,
+        idempotency_key,
+        {"digital_human_id": digital_human_id, **request.model_dump()},
+        lambda: _generate_digital_human_video(digital_human_id, request, user_id),
+    )
+
+
+async def _generate_digital_human_video(
+    digital_human_id: str,
+    request: VideoGenerateRequest,
+    user_id: str,
+) -> dict:
     try:
         # Verify ownership
         dh_response = (
-            supabase_admin.table("digital_humans")
+            await supabase_admin_async.table("digital_humans")
             .select("*")
             .eq("id", digital_human_id)
             .eq("user_id", user_id)
@@ -301,7 +241,7 @@ async def generate_digital_human_video(
 
         # Deduct credits via RPC (checks balance + writes transaction atomically)
         try:
-            deduct_credits(
+            await deduct_credits(
                 user_id=user_id,
                 amount=CREDITS_COST,
                 description=f"Digital human video generation: {request.text[:50]}",
@@ -314,17 +254,32 @@ async def generate_digital_human_video(
                 detail=f"Insufficient credits or deduction failed: {e}"
             )
 
-        background_tasks.add_task(
-            process_digital_human_video,
-            digital_human_id=digital_human_id,
-            user_id=user_id,
-            text=request.text,
-            duration=request.duration
-        )
+        try:
+            job = await enqueue_job(
+                job_type="digital_human",
+                user_id=user_id,
+                model_name=f"{DIGITAL_HUMAN_MODEL}-{request.duration}s",
+                config={
+                    "digital_human_id": digital_human_id,
+                    "text": request.text,
+                    "duration": request.duration,
+                    "credits_cost": CREDITS_COST
+                },
+            )
+        except Exception:
+            await refund_credits(
+                user_id=user_id,
+                amount=CREDITS_COST,
+                description="Refund: digital human video could not be queued",
+                reference_id=digital_human_id,
+                reference_type="digital_human",
+            )
+            raise
 
         return {
-            "message": "Video generation started",
-            "status": "processing"
+            "message": "Video generation queued. Check task status for progress.",
+            "status": job["status"],
+            "generation_task_id": job["id"]
         }
 
     except HTTPException:
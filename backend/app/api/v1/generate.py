@@ -1,23 +1,37 @@
 """
 Video generation API endpoints.
 """
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Header, Query, Request, status, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import AsyncIterator, List, Optional
+import asyncio
+import json
 import logging
-from app.db.supabase import supabase_admin
-from app.api.deps import get_current_user_id
-from app.services.ai_service import dashscope_service, deepseek_service
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.api.deps import get_current_user_id, get_idempotency_key, get_stream_user_id, run_idempotent
+from app.services.ai_service import deepseek_service
 from app.services.credits_service import deduct_credits, refund_credits
+from app.services.generation_pipeline import job_model
+from app.services.job_queue import enqueue_job, enqueue_jobs
+from app.services.result_cache import result_cache
+from app.services.scheduler import generation_scheduler
+from app.services.task_events import FINAL_STATUSES, task_events
+from app.services.task_read_model import task_read_model
 
 router = APIRouter(prefix="/generate", tags=["Video Generation"])
 logger = logging.getLogger(__name__)
 
 CREDITS_COST = 10
+BATCH_MAX_ITEMS = 50
 
 
-class VideoGenerateRequest(BaseModel):
-    """Request model for video generation."""
+class VideoGenerateItem(BaseModel):
+    """One video to generate."""
     project_id: str
     prompt: str = Field(..., min_length=1, max_length=500)
     model_type: str = Field(..., pattern="^(seedance|wan2.6-i2v)$")
@@ -26,104 +40,141 @@ class VideoGenerateRequest(BaseModel):
     optimize_prompt: bool = Field(default=True)
 
 
+class VideoGenerateRequest(VideoGenerateItem):
+    """Request model for video generation."""
+    # Accept an identical earlier render of this user's (same model, image,
+    # prompt and duration) at a discount instead of rendering again.
+    reuse_cached_result: bool = Field(default=False)
+
+
 class VideoGenerateResponse(BaseModel):
     """Response model for video generation."""
     task_id: str
     generation_task_id: str
     status: str
     message: str
+    video_url: Optional[str] = None
 
 
-async def process_video_generation(
-    generation_task_id: str,
-    project_id: str,
-    user_id: str,
-    prompt: str,
-    model_type: str,
-    image_url: Optional[str],
-    duration: int
-):
-    """Background task to process video generation."""
-    try:
-        supabase_admin.table("generation_tasks").update({
-            "status": "processing"
-        }).eq("id", generation_task_id).execute()
-
-        if model_type == "seedance":
-            raise ValueError(
-                "Seedance 2.0 is not yet configured. "
-                "Please provide the Seedance API key or use the wan2.6-i2v model."
-            )
-        elif model_type == "wan2.6-i2v":
-            if not image_url:
-                raise ValueError("image_url is required for wan2.6-i2v model")
-            result = await dashscope_service.generate_image_to_video_wan(
-                image_url=image_url,
-                prompt=prompt,
-                duration=duration
-            )
-        else:
-            raise ValueError(f"Unsupported model type: {model_type}")
+class VideoBatchRequest(BaseModel):
+    """Request model for batch video generation."""
+    items: List[VideoGenerateItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
 
-        task_id = result.get("output", {}).get("task_id")
-        if not task_id:
-            raise Exception("Failed to get task_id from AI service")
 
-        supabase_admin.table("generation_tasks").update({
-            "config": {"ai_task_id": task_id}
-        }).eq("id", generation_task_id).execute()
+class VideoBatchResponse(BaseModel):
+    """Response model for batch video generation."""
+    batch_id: str
+    generation_task_ids: List[str]
+    credits_charged: int
+    status: str
+    message: str
 
-        final_result = await dashscope_service.wait_for_task_completion(
-            task_id=task_id,
-            max_wait_time=300,
-            poll_interval=5
-        )
 
-        video_url = final_result.get("output", {}).get("video_url")
-        if not video_url:
-            raise Exception("No video URL in result")
+class PromptPreviewRequest(BaseModel):
+    """Request model for a streamed prompt optimization preview."""
+    prompt: str = Field(..., min_length=1, max_length=500)
 
-        supabase_admin.table("projects").update({
-            "video_url": video_url,
-            "status": "completed"
-        }).eq("id", project_id).execute()
 
-        supabase_admin.table("generation_tasks").update({
-            "status": "completed",
-            "result_url": video_url
-        }).eq("id", generation_task_id).execute()
+def _sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    except Exception as e:
-        logger.error(f"Video generation failed for task {generation_task_id}: {e}", exc_info=True)
 
-        supabase_admin.table("generation_tasks").update({
-            "status": "failed",
-            "error_message": str(e)
-        }).eq("id", generation_task_id).execute()
+@router.post("/prompt-preview")
+async def preview_optimized_prompt(
+    request: PromptPreviewRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Stream the optimized prompt as Server-Sent Events (free, no credits).
 
-        supabase_admin.table("projects").update({
-            "status": "failed"
-        }).eq("id", project_id).execute()
+    Events:
+    - `delta`: `{"text": ...}` for each generated piece
+    - `done`: `{"prompt": ...}` with the full optimized prompt
+    - `error`: `{"detail": ...}` if DeepSeek fails mid-stream
 
-        # Refund credits on failure
+    To accept the preview, submit `/generate/video` with the same prompt and
+    `optimize_prompt` on (the previewed result is reused from the prompt
+    cache), or with the previewed text as `prompt` and `optimize_prompt` off.
+    """
+    async def events() -> AsyncIterator[str]:
+        parts = []
         try:
-            refund_credits(
+            async for delta in deepseek_service.stream_optimized_prompt(request.prompt):
+                parts.append(delta)
+                yield _sse("delta", {"text": delta})
+        except Exception as e:
+            logger.warning(f"Prompt preview failed for user {user_id}: {e}")
+            yield _sse("error", {"detail": "Prompt optimization failed"})
+            return
+        yield _sse("done", {"prompt": "".join(parts)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _serve_cached_result(
+    request: VideoGenerateRequest,
+    user_id: str,
+    config: dict,
+    cached: dict,
+) -> VideoGenerateResponse:
+    """Record a completed task that reuses an earlier render's video."""
+    video_url = cached["result_url"]
+    config = {**config, "cached_from": cached["id"]}
+    # Not a cache source itself: the URL expires with the original render.
+    config.pop("result_fingerprint", None)
+    try:
+        response = await supabase_admin_async.table("generation_tasks").insert({
+            "project_id": request.project_id,
+            "user_id": user_id,
+            "model_name": f"{request.model_type}-{request.duration}s",
+            "status": "completed",
+            "job_type": "video",
+            "result_url": video_url,
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+            "config": config,
+        }).execute()
+
+        await supabase_admin_async.table("projects").update({
+            "video_url": video_url,
+            "status": "completed"
+        }).eq("id", request.project_id).execute()
+    except Exception:
+        if config["credits_cost"] > 0:
+            await refund_credits(
                 user_id=user_id,
-                amount=CREDITS_COST,
-                description=f"Refund for failed video generation: {str(e)[:200]}",
-                reference_id=generation_task_id,
-                reference_type="generation_task",
+                amount=config["credits_cost"],
+                description="Refund: cached video could not be recorded",
+                reference_id=request.project_id,
+                reference_type="project",
             )
-            logger.info(f"Refunded {CREDITS_COST} credits to user {user_id}")
-        except Exception as refund_error:
-            logger.error(f"Failed to refund credits: {refund_error}", exc_info=True)
+        raise
+
+    task_events.publish(
+        user_id,
+        response.data[0]["id"],
+        "completed",
+        project_id=request.project_id,
+        result_url=video_url,
+    )
+    return VideoGenerateResponse(
+        task_id="cached",
+        generation_task_id=response.data[0]["id"],
+        status="completed",
+        message="Identical video found; reused the earlier render.",
+        video_url=video_url,
+    )
 
 
 @router.post("/video", response_model=VideoGenerateResponse)
 async def generate_video(
     request: VideoGenerateRequest,
-    background_tasks: BackgroundTasks,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
 ):
     """
     Generate video using AI models.
@@ -131,11 +182,21 @@ async def generate_video(
     Supports:
     - Seedance 2.0: Text-to-video (not yet configured)
     - Wan2.6-I2V: Image-to-video generation
+
+    Send an `Idempotency-Key` header to make retries safe: a repeated
+    request returns the original response without charging again.
     """
+    return await run_idempotent(
+        "generate_video", user_id, idempotency_key, request.model_dump(),
+        lambda: _generate_video(request, user_id),
+    )
+
+
+async def _generate_video(request: VideoGenerateRequest, user_id: str) -> VideoGenerateResponse:
     try:
         # Verify project ownership
         project_response = (
-            supabase_admin.table("projects")
+            await supabase_admin_async.table("projects")
             .select("*")
             .eq("id", request.project_id)
             .eq("user_id", user_id)
@@ -148,57 +209,67 @@ async def generate_video(
                 detail="Project not found"
             )
 
+        config = {
+            "original_prompt": request.prompt,
+            "optimize_prompt": request.optimize_prompt,
+            "model_type": request.model_type,
+            "duration": request.duration,
+            "image_url": request.image_url,
+            "reuse_cached_result": request.reuse_cached_result,
+        }
+
+        cached = None
+        if settings.RESULT_CACHE_ENABLED and request.reuse_cached_result:
+            try:
+                fingerprint = await result_cache.fingerprint(config)
+                if fingerprint:
+                    config["result_fingerprint"] = fingerprint
+                    cached = await result_cache.lookup(fingerprint, user_id)
+            except Exception as e:
+                logger.warning(f"Result cache lookup failed, rendering instead: {e}")
+        credits_cost = settings.RESULT_CACHE_CREDITS_COST if cached else CREDITS_COST
+        config["credits_cost"] = credits_cost
+
         # Deduct credits via RPC (checks balance + writes transaction atomically)
+        if credits_cost > 0:
+            try:
+                await deduct_credits(
+                    user_id=user_id,
+                    amount=credits_cost,
+                    description=f"Video generation: {request.prompt[:50]}",
+                    reference_id=request.project_id,
+                    reference_type="project",
+                )
+            except RuntimeError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                    detail=f"Insufficient credits or deduction failed: {e}"
+                )
+
+        if cached:
+            return await _serve_cached_result(request, user_id, config, cached)
+
+        # Enqueue the render; a job worker picks it up (durable across restarts)
+        # and optimizes the prompt as the first pipeline stage.
         try:
-            deduct_credits(
+            job = await enqueue_job(
+                job_type="video",
                 user_id=user_id,
-                amount=CREDITS_COST,
-                description=f"Video generation: {request.prompt[:50]}",
+                project_id=request.project_id,
+                model_name=f"{request.model_type}-{request.duration}s",
+                config=config,
+            )
+        except Exception:
+            await refund_credits(
+                user_id=user_id,
+                amount=credits_cost,
+                description="Refund: video generation could not be queued",
                 reference_id=request.project_id,
                 reference_type="project",
             )
-        except RuntimeError as e:
-            raise HTTPException(
-                status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                detail=f"Insufficient credits or deduction failed: {e}"
-            )
+            raise
 
-        # Optimize prompt if requested
-        final_prompt = request.prompt
-        if request.optimize_prompt:
-            try:
-                final_prompt = await deepseek_service.optimize_prompt(request.prompt)
-            except Exception as e:
-                logger.warning(f"Prompt optimization failed, using original: {e}")
-
-        # Create generation task
-        task_response = supabase_admin.table("generation_tasks").insert({
-            "project_id": request.project_id,
-            "user_id": user_id,
-            "model_name": f"{request.model_type}-{request.duration}s",
-            "status": "pending",
-            "config": {
-                "original_prompt": request.prompt,
-                "optimized_prompt": final_prompt,
-                "model_type": request.model_type,
-                "duration": request.duration,
-                "image_url": request.image_url,
-                "credits_cost": CREDITS_COST
-            }
-        }).execute()
-
-        generation_task_id = task_response.data[0]["id"]
-
-        background_tasks.add_task(
-            process_video_generation,
-            generation_task_id=generation_task_id,
-            project_id=request.project_id,
-            user_id=user_id,
-            prompt=final_prompt,
-            model_type=request.model_type,
-            image_url=request.image_url,
-            duration=request.duration
-        )
+        generation_task_id = job["id"]
 
         return VideoGenerateResponse(
             task_id="pending",
@@ -216,29 +287,286 @@ async def generate_video(
         )
 
 
+@router.post("/video/batch", response_model=VideoBatchResponse)
+async def generate_video_batch(
+    request: VideoBatchRequest,
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key),
+):
+    """
+    Queue several videos in one request.
+
+    Ownership of every project is checked in one query, the total cost is
+    deducted in one RPC and the tasks are inserted in one statement. Renders
+    then run through the job queue, where the scheduler's per-user cap
+    (SCHEDULER_USER_MAX_IN_FLIGHT) bounds how many run at once. An item that
+    fails later is refunded on its own (its task carries its cost).
+
+    Accepts an `Idempotency-Key` header like `/generate/video`.
+    """
+    return await run_idempotent(
+        "generate_video_batch", user_id, idempotency_key, request.model_dump(),
+        lambda: _generate_video_batch(request, user_id),
+    )
+
+
+async def _generate_video_batch(request: VideoBatchRequest, user_id: str) -> VideoBatchResponse:
+    items = request.items
+    project_ids = sorted({item.project_id for item in items})
+
+    owned = (
+        await supabase_admin_async.table("projects")
+        .select("id")
+        .in_("id", project_ids)
+        .eq("user_id", user_id)
+        .execute()
+    )
+    missing = set(project_ids) - {row["id"] for row in owned.data or []}
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Projects not found: {', '.join(sorted(missing))}"
+        )
+
+    batch_id = str(uuid.uuid4())
+    total_cost = CREDITS_COST * len(items)
+    try:
+        await deduct_credits(
+            user_id=user_id,
+            amount=total_cost,
+            description=f"Batch video generation: {len(items)} videos",
+            reference_id=batch_id,
+            reference_type="generation_batch",
+        )
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Insufficient credits or deduction failed: {e}"
+        )
+
+    try:
+        jobs = await enqueue_jobs([
+            {
+                "job_type": "video",
+                "user_id": user_id,
+                "project_id": item.project_id,
+                "model_name": f"{item.model_type}-{item.duration}s",
+                "config": {
+                    "original_prompt": item.prompt,
+                    "optimize_prompt": item.optimize_prompt,
+                    "model_type": item.model_type,
+                    "duration": item.duration,
+                    "image_url": item.image_url,
+                    "credits_cost": CREDITS_COST,
+                    "batch_id": batch_id,
+                },
+            }
+            for item in items
+        ])
+    except Exception as e:
+        logger.error(f"Batch {batch_id} could not be queued: {e}")
+        await refund_credits(
+            user_id=user_id,
+            amount=total_cost,
+            description="Refund: batch video generation could not be queued",
+            reference_id=batch_id,
+            reference_type="generation_batch",
+        )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Batch could not be queued; credits were refunded"
+        )
+
+    return VideoBatchResponse(
+        batch_id=batch_id,
+        generation_task_ids=[job["id"] for job in jobs],
+        credits_charged=total_cost,
+        status="pending",
+        message=f"{len(jobs)} videos queued. Check each task's status for progress."
+    )
+
+
+TASK_STREAM_FIELDS = "id, project_id, status, progress, result_url, error_message, updated_at"
+
+
+def _task_event_data(row: dict) -> dict:
+    return {
+        "task_id": row["id"],
+        "status": row["status"],
+        "project_id": row.get("project_id"),
+        "progress": row.get("progress"),
+        "result_url": row.get("result_url"),
+        "error_message": row.get("error_message"),
+    }
+
+
+async def _task_snapshot(user_id: str) -> List[dict]:
+    """The user's unfinished tasks plus those that finished in the last hour."""
+    since = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    response = (
+        await supabase_admin_async.table("generation_tasks")
+        .select(TASK_STREAM_FIELDS)
+        .eq("user_id", user_id)
+        .or_(f"status.in.(pending,processing),updated_at.gte.{since}")
+        .order("updated_at", desc=True)
+        .limit(100)
+        .execute()
+    )
+    return response.data or []
+
+
+async def _unfinished_task_ids(user_id: str) -> set:
+    """Ids of the user's pending/processing tasks, to reconcile after a resume."""
+    response = (
+        await supabase_admin_async.table("generation_tasks")
+        .select("id")
+        .eq("user_id", user_id)
+        .in_("status", ["pending", "processing"])
+        .limit(100)
+        .execute()
+    )
+    return {row["id"] for row in response.data or []}
+
+
+def _track_active(active: set, data: dict) -> None:
+    if data["status"] in FINAL_STATUSES:
+        active.discard(data["task_id"])
+    else:
+        active.add(data["task_id"])
+
+
+async def _reconcile(user_id: str, active: set) -> None:
+    """Publish transitions of `active` tasks made by other processes."""
+    # Tasks running here publish their own events; their database rows lag.
+    remote = sorted(task_id for task_id in active if not task_read_model.is_tracked(task_id))
+    if not remote:
+        return
+    response = (
+        await supabase_admin_async.table("generation_tasks")
+        .select(TASK_STREAM_FIELDS)
+        .eq("user_id", user_id)
+        .in_("id", remote)
+        .execute()
+    )
+    for row in response.data or []:
+        data = _task_event_data(row)
+        task_events.publish(user_id, data.pop("task_id"), data.pop("status"), **data)
+
+
+@router.get("/tasks/stream")
+async def stream_task_status(
+    request: Request,
+    user_id: str = Depends(get_stream_user_id),
+    last_event_id: Optional[str] = Header(default=None, alias="Last-Event-ID"),
+):
+    """
+    Push status/progress changes of the user's generation tasks over SSE.
+
+    Events:
+    - `snapshot`: `{"tasks": [...]}` -- sent on a fresh connection, or when
+      `Last-Event-ID` can no longer be resumed
+    - `task`: `{"task_id", "status", "progress", "result_url", ...}` per change
+
+    Reconnecting with `Last-Event-ID` (EventSource does this automatically)
+    replays only the events that were missed. Browsers may pass the token as
+    `?access_token=` since EventSource cannot set headers.
+    """
+    async def events() -> AsyncIterator[str]:
+        with task_events.subscribe(user_id) as queue:
+            # Subscribe first so nothing published during the replay is lost.
+            backlog = task_events.replay(user_id, last_event_id)
+            active = set()
+            sent_seq = 0
+            if backlog is None:
+                snapshot_id = task_events.last_event_id()
+                sent_seq = task_events.last_seq
+                tasks = [_task_event_data(row) for row in await _task_snapshot(user_id)]
+                active = {t["task_id"] for t in tasks if t["status"] not in FINAL_STATUSES}
+                yield _sse("snapshot", {"tasks": tasks}, event_id=snapshot_id)
+            else:
+                # Tasks run by other processes are only seen by reconciling,
+                # so the resumed stream needs the unfinished ones too.
+                try:
+                    active = await _unfinished_task_ids(user_id)
+                except Exception as e:
+                    logger.warning(f"Could not load unfinished tasks for {user_id}: {e}")
+                for event in backlog:
+                    sent_seq = event.seq
+                    _track_active(active, event.data)
+                    yield _sse("task", event.data, event_id=event.id)
+
+            next_reconcile = time.monotonic() + settings.TASK_STREAM_RECONCILE_SECONDS
+            while not await request.is_disconnected():
+                if active and time.monotonic() >= next_reconcile:
+                    try:
+                        await _reconcile(user_id, active)
+                    except Exception as e:
+                        logger.warning(f"Task stream reconcile failed for {user_id}: {e}")
+                    next_reconcile = time.monotonic() + settings.TASK_STREAM_RECONCILE_SECONDS
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=settings.TASK_STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return  # fell behind; the client reconnects and resumes
+                if event.seq <= sent_seq:
+                    continue
+                sent_seq = event.seq
+                _track_active(active, event.data)
+                yield _sse("task", event.data, event_id=event.id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/tasks/{task_id}")
 async def get_generation_task(
     task_id: str,
+    include_queue: bool = Query(False),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Get generation task status."""
-    try:
-        response = (
-            supabase_admin.table("generation_tasks")
-            .select("*")
-            .eq("id", task_id)
-            .eq("user_id", user_id)
-            .single()
-            .execute()
-        )
+    """
+    Get generation task status.
 
-        if not response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Task not found"
+    Tasks running in this process are answered from the in-memory read
+    model; finished and unknown tasks are read from the database. With
+    `include_queue=1`, unfinished tasks also carry their queue position.
+    """
+    try:
+        task = task_read_model.get(task_id, user_id)
+        if task is None:
+            response = (
+                await supabase_admin_async.table("generation_tasks")
+                .select("*")
+                .eq("id", task_id)
+                .eq("user_id", user_id)
+                .single()
+                .execute()
             )
 
-        return response.data
+            if not response.data:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Task not found"
+                )
+
+            task = response.data
+            task_read_model.refresh(task)
+        if include_queue and task.get("status") in ("pending", "processing"):
+            try:
+                queue = await generation_scheduler.position(task, job_model(task))
+            except Exception as e:
+                logger.warning(f"Could not compute queue position for {task_id}: {e}")
+                queue = None
+            if queue is not None:
+                task["queue"] = queue
+        return task
 
     except HTTPException:
         raise
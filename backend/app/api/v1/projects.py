@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List
 import logging
 from app.schemas import ProjectCreate, ProjectUpdate, ProjectResponse
-from app.db.supabase import supabase_admin
+from app.db.supabase import supabase_admin_async
 from app.api.deps import get_current_user_id
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,7 @@ async def get_projects(user_id: str = Depends(get_current_user_id)):
     """Get all projects for current user."""
     try:
         response = (
-            supabase_admin.table("projects")
+            await supabase_admin_async.table("projects")
             .select("*")
             .eq("user_id", user_id)
             .order("created_at", desc=True)
@@ -40,7 +40,7 @@ async def create_project(
 ):
     """Create a new project."""
     try:
-        response = supabase_admin.table("projects").insert({
+        response = await supabase_admin_async.table("projects").insert({
             "user_id": user_id,
             "title": project_data.title,
             "description": project_data.description,
@@ -75,7 +75,7 @@ async def get_project(
     """Get a specific project."""
     try:
         response = (
-            supabase_admin.table("projects")
+            await supabase_admin_async.table("projects")
             .select("*")
             .eq("id", project_id)
             .eq("user_id", user_id)
@@ -126,7 +126,7 @@ async def update_project(
             )
 
         response = (
-            supabase_admin.table("projects")
+            await supabase_admin_async.table("projects")
             .update(update_data)
             .eq("id", project_id)
             .eq("user_id", user_id)
@@ -159,7 +159,7 @@ async def delete_project(
     """Delete a project."""
     try:
         response = (
-            supabase_admin.table("projects")
+            await supabase_admin_async.table("projects")
             .delete()
             .eq("id", project_id)
             .eq("user_id", user_id)
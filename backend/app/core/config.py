@@ -2,7 +2,7 @@
 Configuration settings for the FastAPI application.
 """
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -22,6 +22,27 @@ class Settings(BaseSettings):
     SUPABASE_KEY: str
     SUPABASE_SERVICE_ROLE_KEY: str
 
+    # Auth: "remote" asks the auth server for every token (auth.get_user);
+    # "local" verifies the JWT signature/expiry in-process and only falls
+    # back to the auth server when local verification is ambiguous.
+    AUTH_VERIFY_MODE: str = "remote"
+    SUPABASE_JWT_SECRET: Optional[str] = None
+    SUPABASE_JWKS_URL: Optional[str] = None  # default: {SUPABASE_URL}/auth/v1/.well-known/jwks.json
+    AUTH_JWKS_REFRESH_SECONDS: int = 600
+    AUTH_JWT_AUDIENCE: str = "authenticated"
+    AUTH_JWT_LEEWAY_SECONDS: int = 10
+    # Token -> user id cache (never outlives the token's exp)
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL_SECONDS: int = 300
+    AUTH_NEGATIVE_CACHE_TTL_SECONDS: int = 10
+    # profiles.is_admin cache; upper bound for an admin flag change to apply
+    ADMIN_ROLE_CACHE_SIZE: int = 1000
+    ADMIN_ROLE_CACHE_TTL_SECONDS: int = 10
+    # Per-process credit balance cache, written with the balance every credit
+    # RPC returns; bounds how long a change made by another process takes to show
+    BALANCE_CACHE_SIZE: int = 10000
+    BALANCE_CACHE_TTL_SECONDS: int = 15
+
     # CORS
     CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:3002", "http://localhost:8001"]
 
@@ -33,6 +54,99 @@ class Settings(BaseSettings):
     DEEPSEEK_API_KEY: str
     DEEPSEEK_BASE_URL: str = "https://api.deepseek.com"
 
+    # Pooled upstream HTTP clients (one per upstream, opened in the lifespan)
+    UPSTREAM_HTTP2: bool = True
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_CONNECT_TIMEOUT: float = 5.0
+    DASHSCOPE_SUBMIT_TIMEOUT: float = 30.0
+    DASHSCOPE_STATUS_TIMEOUT: float = 10.0
+    DEEPSEEK_TIMEOUT: float = 60.0
+
+    # Upstream failure handling (per upstream: dashscope, deepseek)
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD: int = 5  # consecutive failures to open
+    UPSTREAM_BREAKER_RESET_SECONDS: float = 30.0  # open -> half-open probe
+    UPSTREAM_RETRY_ATTEMPTS: int = 3
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.5
+    UPSTREAM_RETRY_MAX_DELAY: float = 8.0
+    DASHSCOPE_HEDGE_STATUS_READS: bool = False
+    DASHSCOPE_HEDGE_DELAY_SECONDS: float = 1.0  # send a second read after this
+
+    # Completion callbacks (POST /api/v1/callbacks/dashscope). When the URL is
+    # set it is sent with every async submit and polling becomes a fallback.
+    DASHSCOPE_CALLBACK_URL: Optional[str] = None  # public URL incl. ?token=...
+    DASHSCOPE_CALLBACK_TOKEN: Optional[str] = None
+    CALLBACK_FALLBACK_POLL_SECONDS: float = 60.0
+
+    # Generation task polling (one shared poller for all in-flight tasks)
+    GENERATION_MAX_WAIT_SECONDS: int = 300
+    POLLER_TICK_SECONDS: float = 1.0
+    POLLER_INTERVAL_SECONDS: float = 5.0  # fixed-interval baseline for "calls saved"
+    POLLER_DEFAULT_EXPECTED_SECONDS: float = 60.0  # until a model has history
+    POLLER_MIN_INTERVAL_SECONDS: float = 2.0
+    POLLER_MAX_INTERVAL_SECONDS: float = 30.0
+    POLLER_JITTER: float = 0.2
+    POLLER_MAX_CONCURRENCY: int = 16
+    POLLER_MAX_ERRORS: int = 3
+
+    # Durable generation job queue (generation_tasks rows leased by workers)
+    EMBEDDED_WORKER: bool = True  # run a job worker inside the API process
+    # Jobs a worker holds at once; keep above the scheduler caps so waiting
+    # jobs can be reordered by tier.
+    WORKER_CONCURRENCY: int = 32
+    JOB_VISIBILITY_TIMEOUT_SECONDS: int = 120
+    JOB_POLL_INTERVAL_SECONDS: float = 2.0
+    JOB_MAX_ATTEMPTS: int = 3
+
+    # Recovery of orphaned pending/processing tasks (startup + periodic)
+    RECOVERY_INTERVAL_SECONDS: int = 300
+    RECOVERY_GRACE_SECONDS: int = 600  # ignore rows younger than this
+    RECOVERY_BATCH_SIZE: int = 200
+    RECOVERY_CONCURRENCY: int = 5
+    # deliveries after which an orphan is refunded instead of requeued
+    RECOVERY_MAX_ATTEMPTS: int = 5
+
+    # DeepSeek prompt optimization cache (memory LRU + on-disk SQLite tier)
+    PROMPT_CACHE_ENABLED: bool = True
+    PROMPT_CACHE_MEMORY_SIZE: int = 2000
+    PROMPT_CACHE_TTL_SECONDS: int = 604800  # 7 days
+    PROMPT_CACHE_PATH: str = "cache/prompt_cache.sqlite3"  # empty disables the disk tier
+    PROMPT_CACHE_DISK_MAX_ENTRIES: int = 100000
+
+    # Reuse of identical finished renders (requests opt in per call)
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_CREDITS_COST: int = 2
+    RESULT_CACHE_TTL_SECONDS: int = 72000  # DashScope result URLs expire after ~24h
+    # Hosts besides SUPABASE_URL's storage whose images may be fetched for hashing
+    RESULT_CACHE_IMAGE_HOSTS: List[str] = []
+
+    # Admission control for upstream renders (also enforced when jobs are claimed)
+    SCHEDULER_MODEL_CONCURRENCY: Dict[str, int] = {}  # e.g. {"wan2.6-i2v": 5}
+    SCHEDULER_DEFAULT_MODEL_CONCURRENCY: int = 10
+    SCHEDULER_USER_MAX_IN_FLIGHT: int = 3
+    QUEUE_POSITION_CACHE_SECONDS: int = 5  # database queue rank of a pending task
+
+    # Task status stream (GET /generate/tasks/stream)
+    TASK_STREAM_HISTORY: int = 100  # events kept per user for Last-Event-ID resume
+    TASK_STREAM_KEEPALIVE_SECONDS: float = 15.0
+    TASK_STREAM_RECONCILE_SECONDS: float = 15.0  # re-read tasks run by other processes
+    # Status reads of locally running tasks are served from memory; re-check
+    # the DB after this long in case another process finalized the task.
+    TASK_READ_MODEL_MAX_AGE_SECONDS: float = 30.0
+
+    # Task progress: how often render progress is re-estimated, and the
+    # minimum time between two progress writes for the same task
+    PROGRESS_UPDATE_INTERVAL_SECONDS: float = 2.0
+    PROGRESS_WRITE_INTERVAL_SECONDS: float = 10.0
+
+    # Idempotency-Key on credit-charging endpoints (stored in idempotency_keys;
+    # up to IDEMPOTENCY_MAX_KEYS responses are also kept in memory)
+    IDEMPOTENCY_MAX_KEYS: int = 10000
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_LOCK_SECONDS: int = 120  # a running request's key can be taken over after this
+    IDEMPOTENCY_WAIT_INTERVAL_SECONDS: float = 0.5
+
     # Storage
     MAX_UPLOAD_SIZE: int = 104857600  # 100MB
 
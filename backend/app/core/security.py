@@ -0,0 +1,175 @@
+"""
+Local verification of Supabase session tokens.
+
+Supabase access tokens are JWTs signed either with the project's shared JWT
+secret (HS256) or with an asymmetric signing key published at the project's
+JWKS endpoint (RS256 / ES256). Verifying them locally avoids a round-trip to
+the auth server on every request. Anything we cannot decide with confidence
+(unknown key id, no key material, unexpected algorithm) is reported as
+ambiguous so the caller can fall back to `auth.get_user`.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import jwt
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SYMMETRIC_ALGORITHMS = ("HS256",)
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+# Minimum gap between two JWKS fetches triggered by an unknown `kid`, so a
+# client sending garbage key ids cannot make us hammer the JWKS endpoint.
+MIN_FORCED_REFRESH_INTERVAL = 30.0
+
+
+class TokenAmbiguous(Exception):
+    """The token could not be verified locally; ask the auth server."""
+
+
+class TokenInvalid(Exception):
+    """The token is definitely invalid (bad signature, expired, malformed)."""
+
+
+class SupabaseJWTVerifier:
+    """Verifies Supabase access tokens with a cached secret / JWKS key set."""
+
+    def __init__(
+        self,
+        jwt_secret: Optional[str],
+        jwks_url: Optional[str],
+        audience: str = "authenticated",
+        leeway: int = 10,
+        refresh_interval: int = 600,
+    ):
+        self.jwt_secret = jwt_secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.leeway = leeway
+        self.refresh_interval = refresh_interval
+        self._keys: Dict[str, Any] = {}
+        self._last_refresh = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._forced_refresh: Optional[asyncio.Task] = None
+
+    @property
+    def has_keys(self) -> bool:
+        return bool(self._keys)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Verify a token and return its claims.
+
+        Raises:
+            TokenInvalid: signature, expiry or audience check failed.
+            TokenAmbiguous: the token cannot be decided locally.
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise TokenInvalid(f"Malformed token: {e}") from e
+
+        alg = header.get("alg")
+        if alg in SYMMETRIC_ALGORITHMS:
+            if not self.jwt_secret:
+                raise TokenAmbiguous("No JWT secret configured")
+            key: Any = self.jwt_secret
+        elif alg in ASYMMETRIC_ALGORITHMS:
+            kid = header.get("kid")
+            key = self._keys.get(kid) if kid else None
+            if key is None:
+                # Possibly a freshly rotated key we have not seen yet.
+                self._schedule_forced_refresh()
+                raise TokenAmbiguous(f"Unknown signing key id: {kid}")
+        else:
+            raise TokenAmbiguous(f"Unsupported token algorithm: {alg}")
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[alg],
+                audience=self.audience,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise TokenInvalid(str(e)) from e
+
+        return claims
+
+    async def refresh_keys(self) -> None:
+        """Fetch the JWKS document and replace the cached key set."""
+        if not self.jwks_url:
+            return
+        async with self._refresh_lock:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    self.jwks_url,
+                    headers={"apikey": settings.SUPABASE_KEY},
+                    timeout=10.0,
+                )
+                response.raise_for_status()
+                document = response.json()
+
+            keys: Dict[str, Any] = {}
+            for jwk in document.get("keys", []):
+                kid = jwk.get("kid")
+                if not kid:
+                    continue
+                try:
+                    keys[kid] = jwt.PyJWK.from_dict(jwk).key
+                except jwt.PyJWTError as e:
+                    logger.warning("Skipping unusable JWK %s: %s", kid, e)
+
+            # Replace wholesale: keys removed upstream (rotated out) stop verifying.
+            self._keys = keys
+            self._last_refresh = time.monotonic()
+            logger.info("Loaded %d JWKS signing keys", len(keys))
+
+    def _schedule_forced_refresh(self) -> None:
+        if not self.jwks_url:
+            return
+        if time.monotonic() - self._last_refresh < MIN_FORCED_REFRESH_INTERVAL:
+            return
+        if self._forced_refresh and not self._forced_refresh.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._forced_refresh = loop.create_task(self._safe_refresh())
+
+    async def _safe_refresh(self) -> None:
+        try:
+            await self.refresh_keys()
+        except Exception as e:
+            # Keep serving with the previous key set.
+            self._last_refresh = time.monotonic()
+            logger.warning("JWKS refresh failed: %s", e)
+
+    async def run_refresh_loop(self) -> None:
+        """Background loop refreshing the JWKS key set periodically."""
+        while True:
+            await self._safe_refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+
+def _default_jwks_url() -> Optional[str]:
+    if settings.SUPABASE_JWKS_URL:
+        return settings.SUPABASE_JWKS_URL
+    return f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+
+
+jwt_verifier = SupabaseJWTVerifier(
+    jwt_secret=settings.SUPABASE_JWT_SECRET,
+    jwks_url=_default_jwks_url(),
+    audience=settings.AUTH_JWT_AUDIENCE,
+    leeway=settings.AUTH_JWT_LEEWAY_SECONDS,
+    refresh_interval=settings.AUTH_JWKS_REFRESH_SECONDS,
+)
@@ -1,7 +1,12 @@
 """
 Supabase client initialization.
+
+Route handlers and services use the async clients (`supabase_async`,
+`supabase_admin_async`) so a slow PostgREST or auth response only suspends
+the awaiting request instead of blocking the whole event loop. The sync
+clients remain for standalone scripts.
 """
-from supabase import create_client, Client
+from supabase import create_client, Client, AsyncClient
 from app.core.config import settings
 
 
@@ -15,6 +20,25 @@ def get_supabase_admin_client() -> Client:
     return create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
 
 
+def get_supabase_async_client() -> AsyncClient:
+    """Get async Supabase client instance."""
+    return AsyncClient(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+
+
+def get_supabase_admin_async_client() -> AsyncClient:
+    """Get async Supabase admin client with service role key."""
+    return AsyncClient(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+
+
+async def close_async_clients() -> None:
+    """Close the HTTP sessions held by the async clients (app shutdown)."""
+    for client in (supabase_async, supabase_admin_async):
+        if client._postgrest is not None:
+            await client._postgrest.aclose()
+
+
 # Global client instances
 supabase: Client = get_supabase_client()
 supabase_admin: Client = get_supabase_admin_client()
+supabase_async: AsyncClient = get_supabase_async_client()
+supabase_admin_async: AsyncClient = get_supabase_admin_async_client()
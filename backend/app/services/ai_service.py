@@ -1,26 +1,399 @@
 """
 AI Service for video and image generation using Alibaba Cloud DashScope.
+
+Each upstream gets one pooled `httpx.AsyncClient` that is opened and closed
+by the FastAPI lifespan (`start()` / `aclose()`), so submits and status polls
+reuse kept-alive connections instead of paying a TCP+TLS handshake each time.
+Identical concurrent reads (status polls, DeepSeek completions, prompt
+optimizations) are coalesced by `SingleFlight` into one upstream call.
+
+Every call goes through the upstream's circuit breaker
+(`app.services.resilience`) and is retried with exponential backoff and
+jitter where that is safe; status reads can optionally be hedged. A 429 is
+rate limiting, not an outage: it is retried after its Retry-After and does
+not count towards opening the breaker.
 """
-import httpx
 import asyncio
+import hashlib
+import httpx
+import json
 import logging
-from typing import Optional, Dict, Any
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Hashable, TypeVar
 from app.core.config import settings
+from app.services.prompt_cache import prompt_cache
+from app.services.resilience import CircuitBreaker, UpstreamUnavailable, backoff_delay
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-class DashScopeService:
-    """Alibaba Cloud DashScope AI service."""
+# Responses worth retrying for idempotent requests (429 is retried for all).
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+OPTIMIZE_SYSTEM_PROMPT = """你是一个专业的视频生成提示词优化专家。
+请将用户的简单描述转换为详细、具体的视频生成提示词。
+要求：
+1. 描述要具体、生动
+2. 包含场景、动作、氛围等细节
+3. 适合AI视频生成模型理解
+4. 保持在100字以内
+5. 只返回优化后的提示词，不要其他解释"""
+OPTIMIZE_MAX_TOKENS = 200
+# Part of every prompt cache key: changing the system prompt, model or token
+# budget starts a fresh cache namespace.
+OPTIMIZE_PROMPT_VERSION = hashlib.sha256(
+    f"deepseek-chat|{OPTIMIZE_MAX_TOKENS}|{OPTIMIZE_SYSTEM_PROMPT}".encode("utf-8")
+).hexdigest()[:16]
+
+
+class SingleFlight:
+    """
+    Share one in-flight call among identical concurrent callers.
+
+    The first caller for a key starts the call as a task; callers arriving
+    while it runs await the same task and get the same result or exception.
+    The key is forgotten as soon as the call finishes, so nothing is cached.
+    A caller that is cancelled does not cancel the shared call.
+    """
 
     def __init__(self):
-        self.api_key = settings.DASHSCOPE_API_KEY
-        self.base_url = settings.DASHSCOPE_BASE_URL
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight_keys": len(self._calls),
+        }
+
+
+def _request_key(method: str, url: str, kwargs: Dict[str, Any]) -> Hashable:
+    """Identity of a request: endpoint plus canonical JSON body and params."""
+    return (
+        method.upper(),
+        url,
+        json.dumps(kwargs.get("json"), sort_keys=True, ensure_ascii=False, separators=(",", ":")),
+        json.dumps(kwargs.get("params"), sort_keys=True, default=str),
+    )
+
+
+def _retry_after_seconds(value: str) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class PooledUpstream:
+    """Owns the shared connection pool for one upstream API."""
+
+    name = "upstream"
+
+    def __init__(self, base_url: str, api_key: str):
+        self.api_key = api_key
+        self.base_url = base_url
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests_total = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.single_flight = SingleFlight()
+        self.breaker = CircuitBreaker(
+            self.name,
+            failure_threshold=settings.UPSTREAM_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.UPSTREAM_BREAKER_RESET_SECONDS,
+        )
+        self.retries = 0
+        self.rate_limited = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers=self.headers,
+            http2=settings.UPSTREAM_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(30.0, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+        )
+
+    async def start(self) -> None:
+        """Create the pooled client (called from the app lifespan)."""
+        if self._client is None:
+            self._client = self._build_client()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Used outside the app lifespan (scripts, workers): create lazily.
+            self._client = self._build_client()
+        return self._client
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        timeout: float,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """One attempt through the shared pool, gated by the circuit breaker."""
+        self.breaker.before_call()
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self.client.request(
+                method,
+                url,
+                timeout=httpx.Timeout(timeout, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+                **kwargs,
+            )
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        finally:
+            self.in_flight -= 1
+        self._record_status(response.status_code)
+        return response
+
+    def _record_status(self, status_code: int) -> None:
+        """Feed a response to the breaker; rate limiting is not a failure."""
+        if status_code == 429:
+            self.rate_limited += 1
+            self.breaker.release()
+        elif status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        timeout: float,
+        idempotent: bool = False,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        Send a request with a per-operation timeout, retrying with backoff.
+
+        Idempotent requests are retried on transport errors, 429 and 5xx.
+        Others (submits) are only retried when the upstream certainly did not
+        act on them: connection failures and 429. The last response is
+        returned as is; callers decide what a status code means.
+
+        Raises:
+            UpstreamUnavailable: the circuit breaker is open.
+        """
+        attempts = max(1, settings.UPSTREAM_RETRY_ATTEMPTS)
+        for attempt in range(1, attempts + 1):
+            delay = backoff_delay(
+                attempt, settings.UPSTREAM_RETRY_BASE_DELAY, settings.UPSTREAM_RETRY_MAX_DELAY
+            )
+            try:
+                response = await self._send(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt == attempts:
+                    raise
+                logger.warning(f"{self.name} {method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                status_code = response.status_code
+                retryable = status_code == 429 or (idempotent and status_code in RETRYABLE_STATUS)
+                if not retryable or attempt == attempts:
+                    return response
+                retry_after = _retry_after_seconds(response.headers.get("Retry-After", ""))
+                if retry_after is not None:
+                    delay = min(retry_after, settings.UPSTREAM_RETRY_MAX_DELAY)
+                logger.warning(f"{self.name} {method} {url} returned {status_code}, retrying in {delay:.1f}s")
+            self.retries += 1
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def _hedged(
+        self,
+        call: Callable[[], Awaitable[T]],
+        delay: float,
+    ) -> T:
+        """
+        Run `call`; if it has not finished after `delay` seconds, start a
+        second copy and return whichever succeeds first.
+        """
+        first = asyncio.create_task(call())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            self.hedges_sent += 1
+            second = asyncio.create_task(call())
+            pending = {first, second}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _shared_request(
+        self,
+        method: str,
+        url: str,
+        timeout: float,
+        hedge_after: Optional[float] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        `_request` for reads: identical concurrent requests share one call.
+
+        With `hedge_after`, a duplicate request is sent if the first has not
+        answered in that many seconds. Only for requests without side
+        effects; never use it for submits.
+        """
+        key = _request_key(method, url, kwargs)
+
+        def call() -> Awaitable[httpx.Response]:
+            return self._request(method, url, timeout=timeout, idempotent=True, **kwargs)
+
+        if hedge_after is not None:
+            return await self.single_flight.do(key, lambda: self._hedged(call, hedge_after))
+        return await self.single_flight.do(key, call)
+
+    @asynccontextmanager
+    async def _stream(
+        self,
+        method: str,
+        url: str,
+        timeout: float,
+        **kwargs: Any,
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        Like `_send`, but the body is read incrementally by the caller.
+
+        Not retried: part of the body may already have reached the caller.
+        """
+        self.breaker.before_call()
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            async with self.client.stream(
+                method,
+                url,
+                timeout=httpx.Timeout(timeout, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+                **kwargs,
+            ) as response:
+                self._record_status(response.status_code)
+                yield response
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection-pool utilization for the metrics endpoint."""
+        stats: Dict[str, Any] = {
+            "started": self._client is not None,
+            "http2": settings.UPSTREAM_HTTP2,
+            "max_connections": settings.UPSTREAM_MAX_CONNECTIONS,
+            "requests_total": self.requests_total,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "single_flight": self.single_flight.stats(),
+            "circuit_breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "hedges_sent": self.hedges_sent,
+            "hedge_wins": self.hedge_wins,
+        }
+        if self._client is None:
+            connections = []
+        else:
+            # httpx does not expose pool state publicly. If its internals
+            # change, say so instead of reporting an empty pool
+            # (tests/test_ai_service.py checks this against real httpx).
+            pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", None)
+            if connections is None:
+                stats["pool_introspection"] = False
+                return stats
+            connections = list(connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+        stats.update({
+            "connections": len(connections),
+            "connections_idle": idle,
+            "connections_active": len(connections) - idle,
+            "utilization": round(
+                (len(connections) - idle) / settings.UPSTREAM_MAX_CONNECTIONS, 4
+            ),
+        })
+        return stats
+
+
+class DashScopeService(PooledUpstream):
+    """Alibaba Cloud DashScope AI service."""
+
+    name = "dashscope"
+
+    def __init__(self):
+        super().__init__(settings.DASHSCOPE_BASE_URL, settings.DASHSCOPE_API_KEY)
+
+    def _async_headers(self) -> Dict[str, str]:
+        """Headers for async task submission, with the completion callback if configured."""
+        headers = {"X-DashScope-Async": "enable"}
+        if settings.DASHSCOPE_CALLBACK_URL:
+            headers["X-DashScope-Callback"] = settings.DASHSCOPE_CALLBACK_URL
+        return headers
 
     async def generate_video_seedance(
         self,
@@ -53,15 +426,15 @@ class DashScopeService:
             }
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json=payload,
-                headers={**self.headers, "X-DashScope-Async": "enable"},
-                timeout=30.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "POST",
+            url,
+            timeout=settings.DASHSCOPE_SUBMIT_TIMEOUT,
+            json=payload,
+            headers=self._async_headers(),
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def generate_image_to_video_wan(
         self,
@@ -93,15 +466,15 @@ class DashScopeService:
         if prompt:
             payload["input"]["prompt"] = prompt
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json=payload,
-                headers={**self.headers, "X-DashScope-Async": "enable"},
-                timeout=30.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "POST",
+            url,
+            timeout=settings.DASHSCOPE_SUBMIT_TIMEOUT,
+            json=payload,
+            headers=self._async_headers(),
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """
@@ -115,66 +488,17 @@ class DashScopeService:
         """
         url = f"{self.base_url}/api/v1/tasks/{task_id}"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers=self.headers,
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
-
-    async def wait_for_task_completion(
-        self,
-        task_id: str,
-        max_wait_time: int = 300,
-        poll_interval: int = 5
-    ) -> Dict[str, Any]:
-        """
-        Wait for task completion with polling and retry mechanism.
-
-        Args:
-            task_id: The task ID to wait for
-            max_wait_time: Maximum wait time in seconds (default: 300)
-            poll_interval: Polling interval in seconds (default: 5)
-
-        Returns:
-            Dict containing final task result
-        """
-        elapsed_time = 0
-        max_retries = 3
-
-        while elapsed_time < max_wait_time:
-            retry_count = 0
-            last_error = None
-
-            # Retry mechanism for network errors
-            while retry_count < max_retries:
-                try:
-                    result = await self.get_task_status(task_id)
-                    status = result.get("output", {}).get("task_status")
-
-                    if status == "SUCCEEDED":
-                        return result
-                    elif status == "FAILED":
-                        error_msg = result.get('output', {}).get('message', 'Unknown error')
-                        raise Exception(f"Task failed: {error_msg}")
-
-                    # Successfully got status, break retry loop
-                    break
-
-                except httpx.HTTPError as e:
-                    retry_count += 1
-                    last_error = e
-                    if retry_count < max_retries:
-                        await asyncio.sleep(2)  # Wait 2 seconds before retry
-                    else:
-                        raise Exception(f"Failed to get task status after {max_retries} retries: {str(e)}")
-
-            await asyncio.sleep(poll_interval)
-            elapsed_time += poll_interval
-
-        raise TimeoutError(f"Task {task_id} did not complete within {max_wait_time} seconds")
+        response = await self._shared_request(
+            "GET",
+            url,
+            timeout=settings.DASHSCOPE_STATUS_TIMEOUT,
+            hedge_after=(
+                settings.DASHSCOPE_HEDGE_DELAY_SECONDS
+                if settings.DASHSCOPE_HEDGE_STATUS_READS else None
+            ),
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def generate_digital_human_video(
         self,
@@ -219,29 +543,31 @@ class DashScopeService:
             logger.info(f"Prompt: {prompt[:100]}...")
             logger.debug(f"Full payload: {payload}")
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers={**self.headers, "X-DashScope-Async": "enable"},
-                    timeout=30.0
-                )
+            response = await self._request(
+                "POST",
+                url,
+                timeout=settings.DASHSCOPE_SUBMIT_TIMEOUT,
+                json=payload,
+                headers=self._async_headers(),
+            )
 
-                # Log response for debugging
-                logger.info(f"Response status: {response.status_code}")
-                logger.debug(f"Response body: {response.text}")
+            # Log response for debugging
+            logger.info(f"Response status: {response.status_code}")
+            logger.debug(f"Response body: {response.text}")
 
-                response.raise_for_status()
-                result = response.json()
+            response.raise_for_status()
+            result = response.json()
 
-                task_id = result.get('output', {}).get('task_id')
-                if task_id:
-                    logger.info(f"Successfully initiated video generation. Task ID: {task_id}")
-                else:
-                    logger.warning(f"No task_id in response: {result}")
+            task_id = result.get('output', {}).get('task_id')
+            if task_id:
+                logger.info(f"Successfully initiated video generation. Task ID: {task_id}")
+            else:
+                logger.warning(f"No task_id in response: {result}")
 
-                return result
+            return result
 
+        except UpstreamUnavailable:
+            raise
         except httpx.HTTPStatusError as e:
             error_detail = e.response.text
             logger.error(f"HTTP error {e.response.status_code}: {error_detail}")
@@ -251,16 +577,13 @@ class DashScopeService:
             raise Exception(f"Failed to generate video: {str(e)}")
 
 
-class DeepSeekService:
+class DeepSeekService(PooledUpstream):
     """DeepSeek AI service for text generation."""
 
+    name = "deepseek"
+
     def __init__(self):
-        self.api_key = settings.DEEPSEEK_API_KEY
-        self.base_url = settings.DEEPSEEK_BASE_URL
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        super().__init__(settings.DEEPSEEK_BASE_URL, settings.DEEPSEEK_API_KEY)
 
     async def generate_text(
         self,
@@ -290,39 +613,126 @@ class DeepSeekService:
             "temperature": temperature
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json=payload,
-                headers=self.headers,
-                timeout=60.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+        response = await self._shared_request(
+            "POST",
+            url,
+            timeout=settings.DEEPSEEK_TIMEOUT,
+            json=payload,
+        )
+        response.raise_for_status()
+        result = response.json()
+        return result["choices"][0]["message"]["content"]
+
+    async def stream_text(
+        self,
+        prompt: str,
+        max_tokens: int = 2000,
+        temperature: float = 0.7
+    ) -> AsyncIterator[str]:
+        """
+        Stream text from DeepSeek as it is generated.
+
+        Uses the streaming chat API (`"stream": true`), whose body is a
+        Server-Sent Events stream of `chat.completion.chunk` objects.
+
+        Yields:
+            Content deltas, in order
+        """
+        url = f"{self.base_url}/v1/chat/completions"
+
+        payload = {
+            "model": "deepseek-chat",
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+
+        async with self._stream(
+            "POST",
+            url,
+            timeout=settings.DEEPSEEK_TIMEOUT,
+            json=payload,
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue  # blank separators and ": keep-alive" comments
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                choices = json.loads(data).get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
+
+    @staticmethod
+    def _optimize_request(user_input: str) -> str:
+        return f"{OPTIMIZE_SYSTEM_PROMPT}\n\n用户输入：{user_input}\n\n优化后的提示词："
 
     async def optimize_prompt(self, user_input: str) -> str:
         """
         Optimize user input into a better prompt for video generation.
 
+        Results are cached by normalized input and OPTIMIZE_PROMPT_VERSION
+        (see `app.services.prompt_cache`).
+
         Args:
             user_input: Raw user input
 
         Returns:
             Optimized prompt
         """
-        system_prompt = """你是一个专业的视频生成提示词优化专家。
-请将用户的简单描述转换为详细、具体的视频生成提示词。
-要求：
-1. 描述要具体、生动
-2. 包含场景、动作、氛围等细节
-3. 适合AI视频生成模型理解
-4. 保持在100字以内
-5. 只返回优化后的提示词，不要其他解释"""
+        key = prompt_cache.key(OPTIMIZE_PROMPT_VERSION, user_input)
+        if settings.PROMPT_CACHE_ENABLED:
+            cached = await prompt_cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def optimize() -> str:
+            optimized = await self.generate_text(
+                self._optimize_request(user_input),
+                max_tokens=OPTIMIZE_MAX_TOKENS,
+                temperature=0.7,
+            )
+            if settings.PROMPT_CACHE_ENABLED and optimized.strip():
+                await prompt_cache.set(key, optimized)
+            return optimized
+
+        # Keyed by the cache key, so inputs that normalize the same share a call.
+        return await self.single_flight.do(("optimize_prompt", key), optimize)
 
-        full_prompt = f"{system_prompt}\n\n用户输入：{user_input}\n\n优化后的提示词："
+    async def stream_optimized_prompt(self, user_input: str) -> AsyncIterator[str]:
+        """
+        Streaming variant of `optimize_prompt` for previews.
 
-        return await self.generate_text(full_prompt, max_tokens=200, temperature=0.7)
+        A cached result is yielded in one piece. A completed stream is cached,
+        so submitting the same input with optimization on reuses the
+        previewed prompt instead of calling DeepSeek again.
+        """
+        key = prompt_cache.key(OPTIMIZE_PROMPT_VERSION, user_input)
+        if settings.PROMPT_CACHE_ENABLED:
+            cached = await prompt_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        async for delta in self.stream_text(
+            self._optimize_request(user_input),
+            max_tokens=OPTIMIZE_MAX_TOKENS,
+            temperature=0.7,
+        ):
+            parts.append(delta)
+            yield delta
+
+        optimized = "".join(parts)
+        if settings.PROMPT_CACHE_ENABLED and optimized.strip():
+            await prompt_cache.set(key, optimized)
 
 
 # Global service instances
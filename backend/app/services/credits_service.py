@@ -5,29 +5,85 @@ All credit mutations go through the Supabase RPC functions
 (`deduct_user_credits` / `refund_user_credits`) which are SECURITY DEFINER
 stored procedures executable only with the service_role key. This keeps the
 balance-update + transaction-log atomic and prevents browser-side tampering.
+
+The balance is cached per process in `balance_cache`. Every credit RPC this
+process makes returns the resulting balance (`deduct_user_credits`,
+`refund_user_credits`, and the refund inside `fail_generation_task`), and
+that value is written through with `record_balance`. The cache is not shared:
+a deduction handled by another API process, a refund applied by a separate
+worker process or a change from `scripts/add_credits.py` is only seen here
+once the entry expires, so `get_balance` can lag by up to
+BALANCE_CACHE_TTL_SECONDS. Deductions themselves are always checked against
+the database, so a stale cached balance never lets a user overspend.
 """
 import logging
-from app.db.supabase import supabase_admin
+from typing import Any, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
 
 logger = logging.getLogger(__name__)
 
+balance_cache = TTLCache(
+    maxsize=settings.BALANCE_CACHE_SIZE,
+    default_ttl=settings.BALANCE_CACHE_TTL_SECONDS,
+)
+
+
+def record_balance(user_id: str, data: Any) -> Optional[int]:
+    """
+    Cache the balance an RPC returned: an integer, or a dict with
+    `balance_after`. Anything else (e.g. no refund happened) drops the entry.
+    """
+    balance = data.get("balance_after") if isinstance(data, dict) else data
+    if isinstance(balance, int):
+        balance_cache.set(user_id, balance)
+        return balance
+    balance_cache.pop(user_id)
+    return None
+
+
+def invalidate_balance(user_id: str) -> None:
+    """Drop the cached balance; call after changing credits outside this service."""
+    balance_cache.pop(user_id)
+
+
+async def get_balance(user_id: str) -> Optional[int]:
+    """Current balance (cached), or None if the user has no profile."""
+    balance = balance_cache.get(user_id)
+    if balance is not None:
+        return balance
+    result = (
+        await supabase_admin_async.table("profiles")
+        .select("credits")
+        .eq("id", user_id)
+        .limit(1)
+        .execute()
+    )
+    if not result.data:
+        return None
+    balance = result.data[0].get("credits") or 0
+    balance_cache.set(user_id, balance)
+    return balance
+
 
-def deduct_credits(
+async def deduct_credits(
     user_id: str,
     amount: int,
     description: str,
     reference_id: str | None = None,
     reference_type: str | None = None,
-) -> dict:
+) -> Optional[int]:
     """
     Deduct credits via RPC. Raises RuntimeError on failure.
 
-    Returns the RPC result dict containing `balance_after`.
+    Returns the balance after the deduction.
     """
     if amount <= 0:
         raise ValueError("amount must be positive")
     try:
-        result = supabase_admin.rpc(
+        result = await supabase_admin_async.rpc(
             "deduct_user_credits",
             {
                 "p_user_id": user_id,
@@ -37,30 +93,33 @@ def deduct_credits(
                 "p_reference_type": reference_type,
             },
         ).execute()
-        if not result.data:
+        # A balance of 0 is a valid result; only a missing one is an error.
+        if result.data is None:
             raise RuntimeError("deduct_user_credits returned no data")
-        return result.data
+        return record_balance(user_id, result.data)
     except Exception as e:
+        # The outcome may be unknown (e.g. a timeout): re-read next time.
+        invalidate_balance(user_id)
         logger.error("deduct_credits failed for %s: %s", user_id, e)
         raise RuntimeError(f"Failed to deduct credits: {e}") from e
 
 
-def refund_credits(
+async def refund_credits(
     user_id: str,
     amount: int,
     description: str,
     reference_id: str | None = None,
     reference_type: str | None = None,
-) -> dict:
+) -> Optional[int]:
     """
-    Refund credits via RPC. Raises RuntimeError on failure.
+    Refund (add) credits via RPC. Raises RuntimeError on failure.
 
-    Returns the RPC result dict containing `balance_after`.
+    Returns the balance after the refund.
     """
     if amount <= 0:
         raise ValueError("amount must be positive")
     try:
-        result = supabase_admin.rpc(
+        result = await supabase_admin_async.rpc(
             "refund_user_credits",
             {
                 "p_user_id": user_id,
@@ -70,9 +129,10 @@ def refund_credits(
                 "p_reference_type": reference_type,
             },
         ).execute()
-        if not result.data:
+        if result.data is None:
             raise RuntimeError("refund_user_credits returned no data")
-        return result.data
+        return record_balance(user_id, result.data)
     except Exception as e:
+        invalidate_balance(user_id)
         logger.error("refund_credits failed for %s: %s", user_id, e)
         raise RuntimeError(f"Failed to refund credits: {e}") from e
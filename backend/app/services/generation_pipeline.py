@@ -0,0 +1,330 @@
+"""
+Generation pipelines executed by the job worker.
+
+Each function takes a claimed `generation_tasks` row (see
+`app.services.job_queue`) and drives it to `completed` or `failed`. A job can
+be delivered more than once (its lease expired while a worker was still
+busy, or the worker died), so pipelines are resumable: once the upstream
+task id is stored in `config.ai_task_id` a redelivered job resumes polling
+instead of submitting a second render.
+
+Video jobs start by optimizing the prompt with DeepSeek (when requested), so
+the submit endpoint never waits on it; the result is stored in
+`config.optimized_prompt`. Submission and rendering happen inside a
+`generation_scheduler` slot, which enforces per-model and per-user
+concurrency and tier priority.
+
+A finished upstream task is applied by `_complete` / `_fail`. Each is one
+lifecycle RPC (`complete_generation_task` / `fail_generation_task`) that
+updates the task, its project and (on failure) the user's credits in a
+single transaction, and only acts if it moves the row out of
+`pending`/`processing`. The same functions finalize tasks from DashScope
+completion callbacks (`finalize_from_callback`), so whichever of the
+callback and the pipeline sees the result first wins and the other is a
+no-op: no double project insert, no double refund.
+"""
+import logging
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.ai_service import dashscope_service, deepseek_service
+from app.services.credits_service import record_balance
+from app.services.progress import PROMPT_READY, progress_reporter
+from app.services.result_cache import result_cache
+from app.services.scheduler import generation_scheduler
+from app.services.task_events import task_events
+from app.services.task_read_model import task_read_model
+from app.services.task_poller import task_poller
+
+logger = logging.getLogger(__name__)
+
+DIGITAL_HUMAN_MODEL = "wanx-v1"  # also in generation_job_model() in the database
+
+
+def job_model(job: Dict[str, Any]) -> Optional[str]:
+    """The model a job renders with, i.e. its scheduler lane."""
+    if job.get("job_type") == "digital_human":
+        return DIGITAL_HUMAN_MODEL
+    return (job.get("config") or {}).get("model_type")
+
+
+async def _save_config(generation_task_id: str, config: Dict[str, Any]) -> None:
+    await supabase_admin_async.table("generation_tasks").update({
+        "config": config
+    }).eq("id", generation_task_id).execute()
+    task_read_model.update(generation_task_id, config=dict(config))
+
+
+async def _optimize_prompt(generation_task_id: str, config: Dict[str, Any]) -> bool:
+    """First pipeline stage: fill `config.optimized_prompt` (once per task)."""
+    if "optimized_prompt" in config or config.get("ai_task_id"):
+        return False
+    original = config.get("original_prompt") or ""
+    optimized = original
+    if config.get("optimize_prompt"):
+        try:
+            optimized = await deepseek_service.optimize_prompt(original)
+        except Exception as e:
+            logger.warning(f"Prompt optimization failed for task {generation_task_id}, using original: {e}")
+    config["optimized_prompt"] = optimized
+    return True
+
+
+async def _fingerprint(generation_task_id: str, config: Dict[str, Any]) -> bool:
+    """
+    Record `config.result_fingerprint` so the render can be reused later.
+    Only for requests that opted into reuse (the endpoint normally did it).
+    """
+    if (
+        not settings.RESULT_CACHE_ENABLED
+        or not config.get("reuse_cached_result")
+        or "result_fingerprint" in config
+    ):
+        return False
+    try:
+        fingerprint = await result_cache.fingerprint(config)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint task {generation_task_id}: {e}")
+        return False
+    if not fingerprint:
+        return False
+    config["result_fingerprint"] = fingerprint
+    return True
+
+
+async def _subscription_tier(user_id: str) -> Optional[str]:
+    """The user's tier selects the scheduler priority lane."""
+    try:
+        response = (
+            await supabase_admin_async.table("profiles")
+            .select("subscription_tier")
+            .eq("id", user_id)
+            .single()
+            .execute()
+        )
+        return (response.data or {}).get("subscription_tier")
+    except Exception as e:
+        logger.warning(f"Could not load subscription tier for {user_id}: {e}")
+        return None
+
+
+async def _finalize(job: Dict[str, Any], rpc: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Run a lifecycle RPC that finalizes the task together with its project
+    (and refund) in one transaction. Returns the RPC result, or None if the
+    task was already final.
+    """
+    response = await supabase_admin_async.rpc(rpc, {"p_task_id": job["id"], **params}).execute()
+    task_read_model.forget(job["id"])
+    progress_reporter.discard(job["id"])
+    if not response.data:
+        return None
+    task = response.data["task"]
+    task_events.publish(
+        job["user_id"],
+        job["id"],
+        task["status"],
+        project_id=task.get("project_id"),
+        progress=task.get("progress"),
+        result_url=task.get("result_url"),
+        error_message=task.get("error_message"),
+    )
+    return response.data
+
+
+async def _complete(job: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """
+    Complete the task: video jobs update their project, digital human jobs
+    get a new project (see `complete_generation_task`).
+    """
+    video_url = result.get("output", {}).get("video_url")
+    if not video_url:
+        raise Exception("No video URL in result")
+    await _finalize(job, "complete_generation_task", {"p_result_url": video_url})
+
+
+async def _fail(job: Dict[str, Any], error: Exception) -> None:
+    """Fail the task, mark its project failed and refund the credits."""
+    config = job.get("config") or {}
+    credits_cost = config.get("credits_cost", 0)
+    if job.get("job_type") == "digital_human":
+        description = f"Refund for failed digital human video: {str(error)[:200]}"
+        reference_id, reference_type = config.get("digital_human_id"), "digital_human"
+    else:
+        description = f"Refund for failed video generation: {str(error)[:200]}"
+        reference_id, reference_type = job["id"], "generation_task"
+
+    outcome = await _finalize(job, "fail_generation_task", {
+        "p_error_message": str(error),
+        "p_refund_amount": max(credits_cost, 0),
+        "p_refund_description": description,
+        "p_refund_reference_id": reference_id,
+        "p_refund_reference_type": reference_type,
+    })
+    if outcome is None or credits_cost <= 0:
+        return
+    # The refund happened inside the RPC, which returns the new balance.
+    record_balance(job["user_id"], outcome)
+    if outcome.get("refunded"):
+        logger.info(f"Refunded {credits_cost} credits to user {job['user_id']}")
+    else:
+        logger.error(f"Failed to refund {credits_cost} credits for task {job['id']}")
+
+
+async def process_video_generation(job: Dict[str, Any]) -> None:
+    """Run an image/text-to-video job."""
+    generation_task_id = job["id"]
+    user_id = job["user_id"]
+    config = dict(job.get("config") or {})
+    model_type = config.get("model_type")
+    image_url = config.get("image_url")
+    duration = config.get("duration", 4)
+
+    try:
+        # Both preparation stages are saved with one write.
+        changed = await _optimize_prompt(generation_task_id, config)
+        changed = await _fingerprint(generation_task_id, config) or changed
+        if changed:
+            await _save_config(generation_task_id, config)
+        prompt = config.get("optimized_prompt") or config.get("original_prompt")
+        progress_reporter.report(job, PROMPT_READY)
+
+        tier = await _subscription_tier(user_id)
+        async with generation_scheduler.slot(
+            generation_task_id,
+            model=model_type,
+            user_id=user_id,
+            tier=tier,
+            duration=duration,
+        ):
+            task_id = config.get("ai_task_id")
+            if task_id:
+                logger.info(f"Resuming generation task {generation_task_id} (upstream {task_id})")
+            else:
+                if model_type == "seedance":
+                    raise ValueError(
+                        "Seedance 2.0 is not yet configured. "
+                        "Please provide the Seedance API key or use the wan2.6-i2v model."
+                    )
+                elif model_type == "wan2.6-i2v":
+                    if not image_url:
+                        raise ValueError("image_url is required for wan2.6-i2v model")
+                    result = await dashscope_service.generate_image_to_video_wan(
+                        image_url=image_url,
+                        prompt=prompt,
+                        duration=duration
+                    )
+                else:
+                    raise ValueError(f"Unsupported model type: {model_type}")
+
+                task_id = result.get("output", {}).get("task_id")
+                if not task_id:
+                    raise Exception("Failed to get task_id from AI service")
+
+                config["ai_task_id"] = task_id
+                await _save_config(generation_task_id, config)
+
+            progress_reporter.track_render(job, task_id)
+            final_result = await task_poller.wait_for(
+                task_id,
+                max_wait_time=settings.GENERATION_MAX_WAIT_SECONDS,
+                model=model_type,
+                duration=duration,
+            )
+
+        await _complete({**job, "config": config}, final_result)
+
+    except Exception as e:
+        logger.error(f"Video generation failed for task {generation_task_id}: {e}", exc_info=True)
+        await _fail({**job, "config": config}, e)
+
+
+async def process_digital_human_video(job: Dict[str, Any]) -> None:
+    """Run a digital human video job; creates the project on success."""
+    generation_task_id = job["id"]
+    user_id = job["user_id"]
+    config = dict(job.get("config") or {})
+    digital_human_id = config.get("digital_human_id")
+    text = config.get("text", "")
+    duration = config.get("duration")
+
+    try:
+        logger.info(f"Starting digital human video generation for user {user_id}")
+
+        dh_response = (
+            await supabase_admin_async.table("digital_humans")
+            .select("*")
+            .eq("id", digital_human_id)
+            .eq("user_id", user_id)
+            .execute()
+        )
+
+        if not dh_response.data or len(dh_response.data) == 0:
+            raise Exception("Digital human not found")
+
+        digital_human = dh_response.data[0]
+        progress_reporter.report(job, PROMPT_READY)
+
+        tier = await _subscription_tier(user_id)
+        async with generation_scheduler.slot(
+            generation_task_id,
+            model=DIGITAL_HUMAN_MODEL,
+            user_id=user_id,
+            tier=tier,
+            duration=duration,
+        ):
+            task_id = config.get("ai_task_id")
+            if not task_id:
+                avatar_url = digital_human.get("avatar_url")
+                voice_config = digital_human.get("voice_config") or {}
+                voice_type = voice_config.get("voice_type", "female")
+
+                result = await dashscope_service.generate_digital_human_video(
+                    avatar_url=avatar_url,
+                    text=text,
+                    voice_type=voice_type,
+                    duration=duration
+                )
+
+                task_id = result.get("output", {}).get("task_id")
+                if not task_id:
+                    raise Exception("Failed to get task_id from AI service")
+
+                config["ai_task_id"] = task_id
+                await _save_config(generation_task_id, config)
+
+            progress_reporter.track_render(job, task_id)
+            final_result = await task_poller.wait_for(
+                task_id,
+                max_wait_time=settings.GENERATION_MAX_WAIT_SECONDS,
+                model=DIGITAL_HUMAN_MODEL,
+                duration=duration,
+            )
+
+        await _complete({**job, "config": config}, final_result)
+
+    except Exception as e:
+        logger.error(f"Error processing digital human video: {str(e)}", exc_info=True)
+        await _fail({**job, "config": config}, e)
+
+
+JOB_HANDLERS = {
+    "video": process_video_generation,
+    "digital_human": process_digital_human_video,
+}
+
+
+async def finalize_from_callback(job: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """
+    Apply a final upstream status (SUCCEEDED/FAILED) delivered by callback
+    for a task no local pipeline is waiting on.
+    """
+    output = result.get("output", {})
+    if output.get("task_status") == "FAILED":
+        await _fail(job, Exception(f"Task failed: {output.get('message', 'Unknown error')}"))
+        return
+    try:
+        await _complete(job, result)
+    except Exception as e:
+        await _fail(job, e)
@@ -0,0 +1,212 @@
+"""
+Idempotency keys for credit-charging endpoints.
+
+A client that retries `POST /generate/video` (or another charging endpoint)
+with the same `Idempotency-Key` header gets the original response back;
+credits are not deducted again and nothing new is queued. Duplicates that
+arrive while the first request is still running wait for it and share its
+outcome.
+
+Keys live in the `idempotency_keys` table (unique per user), claimed through
+the `claim_idempotency_key` RPC, so a retry is recognised by any API process
+and across restarts. A duplicate running in another process polls the row
+until the first request finishes, or takes the key over once its lock
+(IDEMPOTENCY_LOCK_SECONDS) expires. Completed responses are also kept in
+process memory (at most IDEMPOTENCY_MAX_KEYS) as a fast path.
+
+Only successful responses are remembered (for IDEMPOTENCY_TTL_SECONDS). A
+request that failed -- insufficient credits, a validation error, an outage --
+can be retried with the same key and runs again. Reusing a key for a
+different request body or endpoint is rejected.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+KEY_REUSED_MESSAGE = "Idempotency-Key was already used for a different request"
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+class IdempotencyKeyUnavailable(Exception):
+    """The key could not be claimed in the database."""
+
+
+def request_hash(payload: Any) -> str:
+    """Stable hash of a request body, to detect a key reused for another request."""
+    canonical = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _to_json(result: Any) -> Any:
+    """The response as stored in the database (what a replay returns)."""
+    if hasattr(result, "model_dump"):
+        return result.model_dump(mode="json")
+    return json.loads(json.dumps(result, default=str))
+
+
+class IdempotencyStore:
+    """Keys claimed in the database, with completed and in-flight calls cached locally."""
+
+    def __init__(self, maxsize: int, ttl: int, lock_seconds: int, wait_interval: float):
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self.wait_interval = wait_interval
+        self._completed = TTLCache(maxsize=maxsize, default_ttl=ttl)
+        self._in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Task]] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.joined = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.save_errors = 0
+
+    async def run(
+        self,
+        user_id: str,
+        key: str,
+        scope: str,
+        body_hash: str,
+        fn: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Run `fn` once per (user, key); replays and duplicates get its result."""
+        local_key = (user_id, key)
+        completed = self._completed.get(local_key)
+        if completed is not None:
+            self._check(completed[0], body_hash)
+            self.replayed += 1
+            return completed[1]
+
+        in_flight = self._in_flight.get(local_key)
+        if in_flight is not None:
+            self._check(in_flight[0], body_hash)
+            self.joined += 1
+            task = in_flight[1]
+        else:
+            # A task, so the charge completes and is remembered even if the
+            # client that started it disconnects.
+            task = asyncio.create_task(self._run_once(user_id, key, scope, body_hash, fn))
+            self._in_flight[local_key] = (body_hash, task)
+            task.add_done_callback(lambda done: self._finish(local_key, body_hash, done))
+        return await asyncio.shield(task)
+
+    async def _run_once(
+        self,
+        user_id: str,
+        key: str,
+        scope: str,
+        body_hash: str,
+        fn: Callable[[], Awaitable[T]],
+    ) -> Any:
+        while True:
+            claim = await self._claim(user_id, key, scope, body_hash)
+            state = claim.get("state")
+            if state == "claimed":
+                break
+            if state == "completed":
+                self.replayed += 1
+                return claim.get("response")
+            if state == "conflict":
+                self.conflicts += 1
+                raise IdempotencyKeyReused(KEY_REUSED_MESSAGE)
+            # Running in another process: wait for its response (or its lock to lapse).
+            self.waited += 1
+            await asyncio.sleep(self.wait_interval)
+
+        self.executed += 1
+        try:
+            result = await fn()
+        except Exception:
+            await self._release(user_id, key)
+            raise
+        await self._save(user_id, key, _to_json(result))
+        return result
+
+    async def _claim(self, user_id: str, key: str, scope: str, body_hash: str) -> Dict[str, Any]:
+        try:
+            response = await supabase_admin_async.rpc(
+                "claim_idempotency_key",
+                {
+                    "p_user_id": user_id,
+                    "p_key": key,
+                    "p_scope": scope,
+                    "p_request_hash": body_hash,
+                    "p_lock_seconds": self.lock_seconds,
+                    "p_ttl_seconds": self.ttl,
+                },
+            ).execute()
+        except Exception as e:
+            logger.error(f"Could not claim Idempotency-Key for {user_id}: {e}")
+            raise IdempotencyKeyUnavailable("Idempotency-Key could not be recorded, retry later") from e
+        return response.data or {}
+
+    async def _save(self, user_id: str, key: str, response: Any) -> None:
+        try:
+            await (
+                supabase_admin_async.table("idempotency_keys")
+                .update({"status": "completed", "response": response, "locked_until": None})
+                .eq("user_id", user_id)
+                .eq("idempotency_key", key)
+                .execute()
+            )
+        except Exception as e:
+            # The request succeeded; only a retry in another process (after
+            # the lock expires) could run it again.
+            self.save_errors += 1
+            logger.error(f"Could not save Idempotency-Key response for {user_id}: {e}")
+
+    async def _release(self, user_id: str, key: str) -> None:
+        """Forget a failed request's key so it can be retried."""
+        try:
+            await (
+                supabase_admin_async.table("idempotency_keys")
+                .delete()
+                .eq("user_id", user_id)
+                .eq("idempotency_key", key)
+                .eq("status", "in_progress")
+                .execute()
+            )
+        except Exception as e:
+            logger.warning(f"Could not release Idempotency-Key for {user_id}: {e}")
+
+    def _check(self, stored_hash: str, body_hash: str) -> None:
+        if stored_hash != body_hash:
+            self.conflicts += 1
+            raise IdempotencyKeyReused(KEY_REUSED_MESSAGE)
+
+    def _finish(self, key: Tuple[str, str], body_hash: str, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._completed.set(key, (body_hash, task.result()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "joined": self.joined,
+            "waited": self.waited,
+            "conflicts": self.conflicts,
+            "save_errors": self.save_errors,
+            "in_flight": len(self._in_flight),
+            "keys": len(self._completed),
+        }
+
+
+idempotency_store = IdempotencyStore(
+    maxsize=settings.IDEMPOTENCY_MAX_KEYS,
+    ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+    lock_seconds=settings.IDEMPOTENCY_LOCK_SECONDS,
+    wait_interval=settings.IDEMPOTENCY_WAIT_INTERVAL_SECONDS,
+)
@@ -0,0 +1,248 @@
+"""
+Durable generation job queue backed by the `generation_tasks` table.
+
+Endpoints enqueue a job by inserting a `pending` row with a `job_type`.
+Workers (embedded in the API process and/or started with `python worker.py`)
+claim jobs through the `claim_generation_jobs` RPC, which leases them with
+`FOR UPDATE SKIP LOCKED` so any number of processes can share the queue. A
+running job renews its lease with a heartbeat; if a worker dies the lease
+expires after JOB_VISIBILITY_TIMEOUT_SECONDS and another worker picks the job
+up again (up to JOB_MAX_ATTEMPTS deliveries).
+
+The RPC also decides who goes first: jobs are claimed by subscription tier,
+oldest first within a tier, and a user's jobs are skipped while they already
+have SCHEDULER_USER_MAX_IN_FLIGHT leased jobs, so one large batch cannot
+fill every worker slot. Likewise a model's jobs stay queued while it already
+has SCHEDULER_MODEL_CONCURRENCY leased jobs across all workers.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.generation_pipeline import JOB_HANDLERS
+from app.services.progress import progress_reporter
+from app.services.task_events import task_events
+from app.services.task_read_model import task_read_model
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_job(
+    job_type: str,
+    user_id: str,
+    model_name: str,
+    config: Dict[str, Any],
+    project_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Insert a pending generation task and wake the local worker."""
+    response = await supabase_admin_async.table("generation_tasks").insert({
+        "project_id": project_id,
+        "user_id": user_id,
+        "model_name": model_name,
+        "status": "pending",
+        "job_type": job_type,
+        "max_attempts": settings.JOB_MAX_ATTEMPTS,
+        "config": config,
+    }).execute()
+    if not response.data:
+        raise RuntimeError("Failed to enqueue generation task")
+    task = response.data[0]
+    task_events.publish(user_id, task["id"], "pending", project_id=project_id)
+    job_worker.wake()
+    return task
+
+
+async def enqueue_jobs(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert several pending generation tasks in one request.
+
+    Each item takes the keyword arguments of `enqueue_job`. The insert is a
+    single statement, so either every task is queued or none is.
+    """
+    rows = [
+        {
+            "project_id": job.get("project_id"),
+            "user_id": job["user_id"],
+            "model_name": job["model_name"],
+            "status": "pending",
+            "job_type": job["job_type"],
+            "max_attempts": settings.JOB_MAX_ATTEMPTS,
+            "config": job["config"],
+        }
+        for job in jobs
+    ]
+    response = await supabase_admin_async.table("generation_tasks").insert(rows).execute()
+    if not response.data or len(response.data) != len(rows):
+        raise RuntimeError("Failed to enqueue generation tasks")
+    for task in response.data:
+        task_events.publish(task["user_id"], task["id"], "pending", project_id=task.get("project_id"))
+    job_worker.wake()
+    return response.data
+
+
+class JobWorker:
+    """Claims queued generation jobs and runs them with bounded concurrency."""
+
+    def __init__(
+        self,
+        concurrency: int,
+        visibility_timeout: int,
+        poll_interval: float,
+        user_max_in_flight: int,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        default_model_concurrency: Optional[int] = None,
+    ):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.user_max_in_flight = user_max_in_flight
+        self.model_concurrency = model_concurrency
+        self.default_model_concurrency = default_model_concurrency
+        self._running: Set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.claimed = 0
+        self.finished = 0
+        self.crashed = 0
+        self.leases_lost = 0
+
+    def wake(self) -> None:
+        """Claim new work now instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            logger.info(f"Job worker {self.worker_id} starting (concurrency={self.concurrency})")
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop claiming; in-flight jobs are cancelled and their leases expire."""
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    jobs = await self._claim(free)
+                except Exception as e:
+                    logger.error(f"Claiming generation jobs failed: {e}")
+                    jobs = []
+                for job in jobs:
+                    task = asyncio.create_task(self._execute(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._on_done)
+                if len(jobs) == free:
+                    # Probably more waiting; claim again once a slot frees up.
+                    continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        self._wakeup.set()
+
+    async def _claim(self, limit: int) -> list:
+        response = await supabase_admin_async.rpc(
+            "claim_generation_jobs",
+            {
+                "p_worker_id": self.worker_id,
+                "p_limit": limit,
+                "p_visibility_timeout_seconds": self.visibility_timeout,
+                "p_user_max_in_flight": self.user_max_in_flight,
+                "p_model_concurrency": self.model_concurrency,
+                "p_default_model_concurrency": self.default_model_concurrency,
+            },
+        ).execute()
+        jobs = response.data or []
+        self.claimed += len(jobs)
+        return jobs
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            try:
+                response = await supabase_admin_async.rpc(
+                    "extend_generation_job_lease",
+                    {
+                        "p_task_id": job_id,
+                        "p_worker_id": self.worker_id,
+                        "p_visibility_timeout_seconds": self.visibility_timeout,
+                    },
+                ).execute()
+                if response.data is False:
+                    self.leases_lost += 1
+                    logger.warning(f"Lost lease on generation task {job_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Lease heartbeat failed for {job_id}: {e}")
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        handler = JOB_HANDLERS.get(job.get("job_type"))
+        if handler is None:
+            logger.error(f"No handler for job type {job.get('job_type')!r} ({job['id']})")
+            return
+
+        task_read_model.track(job)
+        task_events.publish(job["user_id"], job["id"], "processing", project_id=job.get("project_id"))
+        work = asyncio.create_task(handler(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                # Lease lost: another worker owns the job now, stop competing.
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                return
+            await work
+            self.finished += 1
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+        except Exception as e:
+            # Pipelines handle their own failures; this is a bug. The lease
+            # expires and the job is retried up to max_attempts.
+            self.crashed += 1
+            logger.error(f"Generation job {job['id']} crashed: {e}", exc_info=True)
+        finally:
+            heartbeat.cancel()
+            task_read_model.forget(job["id"])
+            progress_reporter.discard(job["id"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._runner is not None and not self._runner.done(),
+            "concurrency": self.concurrency,
+            "in_flight": len(self._running),
+            "claimed": self.claimed,
+            "finished": self.finished,
+            "crashed": self.crashed,
+            "leases_lost": self.leases_lost,
+        }
+
+
+job_worker = JobWorker(
+    concurrency=settings.WORKER_CONCURRENCY,
+    visibility_timeout=settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    poll_interval=settings.JOB_POLL_INTERVAL_SECONDS,
+    user_max_in_flight=settings.SCHEDULER_USER_MAX_IN_FLIGHT,
+    model_concurrency=settings.SCHEDULER_MODEL_CONCURRENCY,
+    default_model_concurrency=settings.SCHEDULER_DEFAULT_MODEL_CONCURRENCY,
+)
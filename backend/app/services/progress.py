@@ -0,0 +1,167 @@
+"""
+Generation task progress (`generation_tasks.progress`, 0-100).
+
+Pipelines report stage milestones (`report`); while a task renders upstream,
+progress is estimated from the poller's view of it -- upstream status and
+elapsed time against the learned expected render time (`track_render`).
+
+Every change is applied at once to the in-memory read model and the task
+event stream, but database writes are coalesced: one loop flushes the
+latest value of each changed task, at most once per task every
+PROGRESS_WRITE_INTERVAL_SECONDS, however often it changes in between.
+Final statuses set progress in the same update that finalizes the task.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.task_events import task_events
+from app.services.task_poller import TaskPoller, task_poller
+from app.services.task_read_model import task_read_model
+
+logger = logging.getLogger(__name__)
+
+PROMPT_READY = 5
+SUBMITTED = 10
+RENDER_DONE = 95  # held until the task is finalized (100)
+
+
+def render_progress(fraction: float) -> int:
+    """Map a render fraction to SUBMITTED..RENDER_DONE (90% of it at 1.0)."""
+    if fraction <= 1:
+        share = 0.9 * max(fraction, 0.0)
+    else:
+        # Overdue: keep creeping towards RENDER_DONE without reaching it.
+        share = 0.9 + 0.1 * (1 - 1 / fraction)
+    return int(SUBMITTED + (RENDER_DONE - SUBMITTED) * share)
+
+
+@dataclass
+class _Progress:
+    user_id: str
+    project_id: Optional[str]
+    value: int = 0
+    written: int = 0
+    written_at: float = 0.0
+    upstream_task_id: Optional[str] = None
+
+
+class ProgressReporter:
+    """Latest progress per running task, flushed to the DB in batches."""
+
+    def __init__(self, poller: TaskPoller, update_interval: float, write_interval: float):
+        self.poller = poller
+        self.update_interval = update_interval
+        self.write_interval = write_interval
+        self._tasks: Dict[str, _Progress] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self.reported = 0
+        self.writes = 0
+        self.write_errors = 0
+
+    def report(self, job: Dict[str, Any], value: int) -> None:
+        """
+        Record a progress value for a running job; it never goes back, also
+        not below what an earlier delivery of the job already stored.
+        """
+        entry = self._tasks.get(job["id"])
+        if entry is None:
+            stored = min(max(job.get("progress") or 0, 0), 100)
+            entry = _Progress(
+                user_id=job["user_id"],
+                project_id=job.get("project_id"),
+                value=stored,
+                written=stored,
+            )
+            self._tasks[job["id"]] = entry
+            self._ensure_running()
+        self._set(job["id"], entry, value)
+
+    def track_render(self, job: Dict[str, Any], upstream_task_id: str) -> None:
+        """Estimate progress from the poller while `upstream_task_id` renders."""
+        self.report(job, SUBMITTED)
+        self._tasks[job["id"]].upstream_task_id = upstream_task_id
+
+    def discard(self, task_id: str) -> None:
+        """Stop reporting; pending unwritten progress is dropped."""
+        self._tasks.pop(task_id, None)
+
+    def _set(self, task_id: str, entry: _Progress, value: int) -> None:
+        value = min(max(value, 0), 100)
+        if value <= entry.value:
+            return
+        entry.value = value
+        self.reported += 1
+        task_read_model.update(task_id, progress=value)
+        task_events.publish(
+            entry.user_id, task_id, "processing", project_id=entry.project_id, progress=value
+        )
+
+    def _ensure_running(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        self._tasks.clear()
+
+    async def _run(self) -> None:
+        while self._tasks:
+            for task_id, entry in list(self._tasks.items()):
+                if entry.upstream_task_id:
+                    fraction = self.poller.render_fraction(entry.upstream_task_id)
+                    if fraction is not None:
+                        self._set(task_id, entry, render_progress(fraction))
+            await self._flush()
+            await asyncio.sleep(self.update_interval)
+
+    async def _flush(self) -> None:
+        now = time.monotonic()
+        due = [
+            (task_id, entry)
+            for task_id, entry in self._tasks.items()
+            if entry.value != entry.written and now - entry.written_at >= self.write_interval
+        ]
+        if due:
+            await asyncio.gather(*(self._write(task_id, entry, now) for task_id, entry in due))
+
+    async def _write(self, task_id: str, entry: _Progress, now: float) -> None:
+        value = entry.value
+        entry.written_at = now
+        try:
+            # Only while running: never overwrite a task finalized meanwhile.
+            await (
+                supabase_admin_async.table("generation_tasks")
+                .update({"progress": value})
+                .eq("id", task_id)
+                .in_("status", ["pending", "processing"])
+                .execute()
+            )
+            entry.written = value
+            self.writes += 1
+        except Exception as e:
+            self.write_errors += 1
+            logger.warning(f"Could not save progress of task {task_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self._tasks),
+            "reported": self.reported,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "write_interval": self.write_interval,
+        }
+
+
+progress_reporter = ProgressReporter(
+    poller=task_poller,
+    update_interval=settings.PROGRESS_UPDATE_INTERVAL_SECONDS,
+    write_interval=settings.PROGRESS_WRITE_INTERVAL_SECONDS,
+)
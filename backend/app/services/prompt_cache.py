@@ -0,0 +1,217 @@
+"""
+Two-tier cache for DeepSeek prompt optimization results.
+
+Users resubmit the same or nearly identical prompts all the time, so
+`DeepSeekService.optimize_prompt` looks results up here before calling the
+API. Keys are derived from the normalized user input and a version string
+that covers the system prompt and model, so editing the system prompt
+invalidates old entries instead of serving stale rewrites.
+
+Tiers:
+  - memory: a `TTLCache` LRU per process;
+  - disk: a SQLite file (WAL mode) shared by every process on the host and
+    kept across restarts. Size is bounded by evicting least recently used
+    rows; expired rows are purged as new ones are written.
+
+Disk operations run in a thread so they never block the event loop. Disk
+errors are logged and treated as misses: the cache must never fail a
+generation request.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Fold case, width and whitespace differences that do not change meaning."""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+class _DiskTier:
+    """LRU-evicted key/value rows in SQLite."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS prompt_cache_accessed_at"
+                " ON prompt_cache (accessed_at)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM prompt_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE prompt_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            return value
+
+    def set(self, key: str, value: str, ttl: float) -> int:
+        """Store a row; returns how many rows were evicted to make room."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            evicted = 0
+            self._writes += 1
+            # Trimming scans the table; amortize it over several writes.
+            if self._writes % 50 == 1:
+                conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (now,))
+                (count,) = conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()
+                excess = count - self.max_entries
+                if excess > 0:
+                    evicted = conn.execute(
+                        "DELETE FROM prompt_cache WHERE key IN ("
+                        " SELECT key FROM prompt_cache ORDER BY accessed_at LIMIT ?)",
+                        (excess,),
+                    ).rowcount
+            conn.commit()
+            return evicted
+
+    def size(self) -> int:
+        with self._lock:
+            (count,) = self._connect().execute("SELECT COUNT(*) FROM prompt_cache").fetchone()
+            return count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class PromptCache:
+    """Memory LRU in front of an optional SQLite tier."""
+
+    def __init__(
+        self,
+        memory_size: int,
+        ttl: float,
+        disk_path: Optional[str],
+        disk_max_entries: int,
+    ):
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=memory_size, default_ttl=ttl)
+        self.disk = _DiskTier(disk_path, disk_max_entries) if disk_path else None
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_errors = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def key(version: str, user_input: str) -> str:
+        normalized = normalize_prompt(user_input)
+        return hashlib.sha256(f"{version}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        try:
+            value = await asyncio.to_thread(self.disk.get, key)
+        except Exception as e:
+            self.disk_errors += 1
+            logger.warning(f"Prompt cache disk read failed: {e}")
+            return None
+        if value is None:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk is None:
+            return
+        try:
+            self.disk_evictions += await asyncio.to_thread(self.disk.set, key, value, self.ttl)
+        except Exception as e:
+            self.disk_errors += 1
+            logger.warning(f"Prompt cache disk write failed: {e}")
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.disk_hits
+        stats: Dict[str, Any] = {
+            "memory": memory,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.disk is not None:
+            disk_lookups = self.disk_hits + self.disk_misses
+            stats["disk"] = {
+                "path": self.disk.path,
+                "max_entries": self.disk.max_entries,
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "evictions": self.disk_evictions,
+                "errors": self.disk_errors,
+                "hit_rate": round(self.disk_hits / disk_lookups, 4) if disk_lookups else 0.0,
+            }
+        return stats
+
+
+prompt_cache = PromptCache(
+    memory_size=settings.PROMPT_CACHE_MEMORY_SIZE,
+    ttl=settings.PROMPT_CACHE_TTL_SECONDS,
+    disk_path=settings.PROMPT_CACHE_PATH or None,
+    disk_max_entries=settings.PROMPT_CACHE_DISK_MAX_ENTRIES,
+)
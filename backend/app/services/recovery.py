@@ -0,0 +1,148 @@
+"""
+Recovery of orphaned generation tasks.
+
+The job queue re-delivers jobs whose lease expired, but some rows fall
+outside it and would otherwise stay `pending`/`processing` forever with the
+user's credits deducted:
+
+  - rows created before the queue existed (no `job_type`), whose
+    BackgroundTasks coroutine died with its process;
+  - queue jobs whose lease expired after their last allowed attempt.
+
+A recovery pass (at startup and every RECOVERY_INTERVAL_SECONDS) hands the
+ones that already have an upstream `config.ai_task_id` back to the queue, so
+a worker resumes polling them, and fails and refunds the ones that do not.
+A task is only handed back while it has had fewer than RECOVERY_MAX_ATTEMPTS
+deliveries; one that keeps getting orphaned is failed and refunded too.
+Legitimately queued rows (pending with a `job_type`) and expired leases the
+queue will still re-deliver are never looked at; the
+`find_orphaned_generation_tasks` RPC selects the rest, least recently
+updated first, so a batch is never filled with rows that are not orphans.
+Each row is taken with a conditional update, so concurrent passes in several
+processes never handle the same row twice.
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.credits_service import record_balance
+from app.services.job_queue import job_worker
+from app.services.task_events import task_events
+
+logger = logging.getLogger(__name__)
+
+# Pre-queue rows did not always keep credits_cost in config.
+LEGACY_CREDITS_COST = 10
+
+INTERRUPTED_MESSAGE = "Generation was interrupted before an upstream task was recorded"
+GAVE_UP_MESSAGE = "Generation was interrupted too many times"
+
+
+def _claim_query(row: Dict[str, Any], values: Dict[str, Any]):
+    """Update `row` only if nobody else touched it since we read it."""
+    query = (
+        supabase_admin_async.table("generation_tasks")
+        .update(values)
+        .eq("id", row["id"])
+        .eq("status", row["status"])
+        .eq("attempts", row.get("attempts", 0))
+    )
+    if row.get("job_type"):
+        return query.eq("job_type", row["job_type"])
+    return query.is_("job_type", "null")
+
+
+async def _requeue(row: Dict[str, Any]) -> bool:
+    config = dict(row.get("config") or {})
+    config.setdefault("credits_cost", LEGACY_CREDITS_COST)
+    job_type = row.get("job_type") or "video"
+    response = await _claim_query(row, {
+        "status": "pending",
+        "job_type": job_type,
+        "config": config,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        # One more delivery to resume polling the upstream task.
+        "max_attempts": row.get("attempts", 0) + 1,
+    }).execute()
+    if not response.data:
+        return False
+    task_events.publish(row["user_id"], row["id"], "pending", project_id=row.get("project_id"))
+    return True
+
+
+async def _fail_and_refund(row: Dict[str, Any], message: str = INTERRUPTED_MESSAGE) -> bool:
+    config = row.get("config") or {}
+    amount = config.get("credits_cost", LEGACY_CREDITS_COST)
+    # Fails the task, its project and refunds in one transaction, but only
+    # if no other pass or worker has moved the row since we read it.
+    response = await supabase_admin_async.rpc("fail_generation_task", {
+        "p_task_id": row["id"],
+        "p_error_message": message,
+        "p_refund_amount": max(amount, 0),
+        "p_refund_description": "Refund for interrupted video generation",
+        "p_refund_reference_id": row["id"],
+        "p_refund_reference_type": "generation_task",
+        "p_expected_attempts": row.get("attempts", 0),
+    }).execute()
+    if not response.data:
+        return False
+    task_events.publish(
+        row["user_id"],
+        row["id"],
+        "failed",
+        project_id=row.get("project_id"),
+        error_message=message,
+    )
+    record_balance(row["user_id"], response.data)
+    if amount > 0 and not response.data.get("refunded"):
+        logger.error(f"Recovery refund failed for task {row['id']}")
+    return True
+
+
+async def recover_orphaned_tasks() -> Dict[str, int]:
+    """Run one recovery pass; returns counts of what was done."""
+    response = await supabase_admin_async.rpc("find_orphaned_generation_tasks", {
+        "p_grace_seconds": settings.RECOVERY_GRACE_SECONDS,
+        "p_limit": settings.RECOVERY_BATCH_SIZE,
+    }).execute()
+    orphans = response.data or []
+
+    counts = {"found": len(orphans), "requeued": 0, "refunded": 0, "skipped": 0}
+    semaphore = asyncio.Semaphore(settings.RECOVERY_CONCURRENCY)
+
+    async def recover(row: Dict[str, Any]) -> None:
+        async with semaphore:
+            try:
+                if not (row.get("config") or {}).get("ai_task_id"):
+                    handled = await _fail_and_refund(row)
+                    counts["refunded" if handled else "skipped"] += 1
+                elif row.get("attempts", 0) >= settings.RECOVERY_MAX_ATTEMPTS:
+                    handled = await _fail_and_refund(row, GAVE_UP_MESSAGE)
+                    counts["refunded" if handled else "skipped"] += 1
+                else:
+                    handled = await _requeue(row)
+                    counts["requeued" if handled else "skipped"] += 1
+            except Exception as e:
+                counts["skipped"] += 1
+                logger.error(f"Recovering generation task {row['id']} failed: {e}")
+
+    await asyncio.gather(*(recover(row) for row in orphans))
+
+    if counts["requeued"]:
+        job_worker.wake()
+    if orphans:
+        logger.info(f"Generation task recovery: {counts}")
+    return counts
+
+
+async def run_recovery_loop() -> None:
+    """Recover at startup, then every RECOVERY_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await recover_orphaned_tasks()
+        except Exception as e:
+            logger.error(f"Generation task recovery pass failed: {e}")
+        await asyncio.sleep(settings.RECOVERY_INTERVAL_SECONDS)
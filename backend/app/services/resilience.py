@@ -0,0 +1,95 @@
+"""
+Failure handling for upstream AI APIs.
+
+`CircuitBreaker` tracks consecutive upstream failures (transport errors and
+5xx responses; a 429 only means we are being rate limited). After `failure_threshold` of them it opens and
+calls fail immediately with `UpstreamUnavailable` instead of piling more
+requests onto a degraded upstream. After `reset_timeout` seconds it lets a
+single probe call through (half-open); a successful probe closes it again,
+a failed one re-opens it.
+
+`backoff_delay` is exponential backoff with full jitter, used between
+retries so that many callers retrying at once do not synchronize.
+"""
+import random
+import time
+from typing import Any, Dict, Optional
+
+
+class UpstreamUnavailable(RuntimeError):
+    """Raised without calling the upstream while its circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Delay before retry `attempt` (1-based): uniform in [0, min(cap, base * 2^(attempt-1))]."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self) -> None:
+        """Raise `UpstreamUnavailable` unless a call may go through now."""
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise UpstreamUnavailable(self.name, self.retry_after())
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise UpstreamUnavailable(self.name, self.reset_timeout)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """The call ended without a verdict (e.g. cancelled); free the probe."""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after_seconds": round(self.retry_after(), 1) if self.state == self.OPEN else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,195 @@
+"""
+Content-addressed cache of finished video renders.
+
+A render is identified by a fingerprint of everything that determines its
+output: model, the SHA-256 of the input image's bytes (not its URL, so
+re-uploads of the same file match), the normalized prompt together with the
+prompt optimizer version, and duration. Completed video tasks store their
+fingerprint in `config.result_fingerprint`; a new request that opts in
+(`reuse_cached_result`) and matches one of the same user's earlier tasks
+gets that task's `video_url` at RESULT_CACHE_CREDITS_COST instead of a new
+render. Renders are never shared between users: the fingerprint does not
+prove the caller ever had access to the other user's image or video.
+
+DashScope result URLs expire, so only tasks completed within
+RESULT_CACHE_TTL_SECONDS are reused.
+
+Hashing the image means fetching a user-supplied URL, so only Supabase
+Storage objects (plus RESULT_CACHE_IMAGE_HOSTS) are fetched, only when the
+host resolves to public addresses, and redirects are not followed.
+"""
+import asyncio
+import hashlib
+import ipaddress
+import json
+import logging
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Set
+from urllib.parse import urlparse
+
+import httpx
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.services.ai_service import OPTIMIZE_PROMPT_VERSION
+from app.services.prompt_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_VERSION = 1
+STORAGE_PATH_PREFIX = "/storage/v1/object/"
+
+
+class ImageURLRejected(ValueError):
+    """The image URL may not be fetched by the server."""
+
+
+def _storage_host() -> Optional[str]:
+    return (urlparse(settings.SUPABASE_URL).hostname or "").lower() or None
+
+
+def _extra_hosts() -> Set[str]:
+    return {host.lower() for host in settings.RESULT_CACHE_IMAGE_HOSTS}
+
+
+async def check_image_url(url: str) -> None:
+    """
+    Raise ImageURLRejected unless `url` is a Supabase Storage object (or on
+    an allowed host) whose host resolves only to public addresses.
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme not in ("https", "http") or not host:
+        raise ImageURLRejected("unsupported URL")
+    if host == _storage_host():
+        if not parsed.path.startswith(STORAGE_PATH_PREFIX):
+            raise ImageURLRejected("not a storage object")
+    elif host not in _extra_hosts():
+        raise ImageURLRejected(f"host {host} is not allowed")
+
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ImageURLRejected(f"cannot resolve {host}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise ImageURLRejected(f"{host} resolves to non-public address {address}")
+
+
+class ResultCache:
+    """Fingerprints video requests and finds reusable completed renders."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # Image bytes behind an uploaded asset URL do not change.
+        self.image_digests = TTLCache(maxsize=5000, default_ttl=24 * 3600)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.lookups = 0
+        self.hits = 0
+        self.image_fetch_errors = 0
+        self.image_urls_rejected = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+                # A redirect could lead anywhere; storage objects do not need one.
+                follow_redirects=False,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def image_digest(self, url: str) -> Optional[str]:
+        """SHA-256 of the image at `url`, or None if it cannot be read."""
+        digest = self.image_digests.get(url)
+        if digest is not None:
+            return digest
+        try:
+            await check_image_url(url)
+        except ImageURLRejected as e:
+            self.image_urls_rejected += 1
+            logger.warning(f"Not hashing image {url} for the result cache: {e}")
+            return None
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            async with self.client.stream("GET", url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > settings.MAX_UPLOAD_SIZE:
+                        raise ValueError("image exceeds MAX_UPLOAD_SIZE")
+                    sha.update(chunk)
+        except Exception as e:
+            self.image_fetch_errors += 1
+            logger.warning(f"Could not hash image {url} for the result cache: {e}")
+            return None
+        digest = sha.hexdigest()
+        self.image_digests.set(url, digest)
+        return digest
+
+    async def fingerprint(self, config: Dict[str, Any]) -> Optional[str]:
+        """Fingerprint of a video job config; None if it cannot be computed."""
+        image_url = config.get("image_url")
+        image = await self.image_digest(image_url) if image_url else None
+        if image_url and image is None:
+            return None
+        optimize = bool(config.get("optimize_prompt"))
+        canonical = json.dumps(
+            {
+                "v": FINGERPRINT_VERSION,
+                "model": config.get("model_type"),
+                "image": image,
+                "prompt": normalize_prompt(config.get("original_prompt") or ""),
+                "optimizer": OPTIMIZE_PROMPT_VERSION if optimize else None,
+                "duration": config.get("duration"),
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def lookup(self, fingerprint: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """The user's most recent reusable completed task with this fingerprint."""
+        self.lookups += 1
+        fresh_after = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        response = (
+            await supabase_admin_async.table("generation_tasks")
+            .select("id, result_url")
+            .eq("user_id", user_id)
+            .eq("config->>result_fingerprint", fingerprint)
+            .eq("status", "completed")
+            .not_.is_("result_url", "null")
+            .gte("updated_at", fresh_after.strftime("%Y-%m-%dT%H:%M:%SZ"))
+            .order("updated_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        if not response.data:
+            return None
+        self.hits += 1
+        return response.data[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.RESULT_CACHE_ENABLED,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "image_fetch_errors": self.image_fetch_errors,
+            "image_urls_rejected": self.image_urls_rejected,
+            "image_digests": self.image_digests.stats(),
+        }
+
+
+result_cache = ResultCache(ttl=settings.RESULT_CACHE_TTL_SECONDS)
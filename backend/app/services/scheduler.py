@@ -0,0 +1,196 @@
+"""
+Admission control for upstream renders.
+
+Every render holds a slot from `GenerationScheduler` while it is submitted
+to and rendered by DashScope. Slots are limited per model (so bursts do not
+run into upstream rate limits) and per user (so one account cannot occupy a
+whole model). Waiting renders are admitted in priority order by the user's
+`profiles.subscription_tier`, FIFO within a tier.
+
+The same tier order and the per-user and per-model caps are applied
+earlier, when workers claim jobs from the queue (`claim_generation_jobs`),
+so the caps hold across all worker processes; this scheduler only orders
+the jobs one process has already claimed. Queue positions of jobs that are
+not claimed yet therefore come from the database
+(`generation_queue_position`), not from this process; they are cached per
+task for QUEUE_POSITION_CACHE_SECONDS so clients polling a pending task do
+not re-rank the queue on every request.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.supabase import supabase_admin_async
+from app.schemas import SubscriptionTier
+from app.services.task_poller import task_poller
+
+logger = logging.getLogger(__name__)
+
+# Keep in step with generation_tier_rank() in the database.
+TIER_PRIORITY = {
+    SubscriptionTier.ENTERPRISE.value: 0,
+    SubscriptionTier.STARTUP.value: 1,
+    SubscriptionTier.PRO.value: 2,
+    SubscriptionTier.FREE.value: 3,
+}
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    task_id: str = field(compare=False)
+    model: str = field(compare=False)
+    user_id: str = field(compare=False)
+    duration: Optional[int] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+class GenerationScheduler:
+    """Per-model and per-user concurrency caps with tiered priority lanes."""
+
+    def __init__(
+        self,
+        model_concurrency: Dict[str, int],
+        default_model_concurrency: int,
+        user_max_in_flight: int,
+        position_cache_seconds: float = 0,
+    ):
+        self.model_concurrency = model_concurrency
+        self.default_model_concurrency = default_model_concurrency
+        self.user_max_in_flight = user_max_in_flight
+        self._waiting: List[_Waiter] = []
+        self._running_by_model: Dict[str, int] = {}
+        self._running_by_user: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._queue_positions = TTLCache(maxsize=10000, default_ttl=position_cache_seconds)
+        self.admitted = 0
+        self.total_wait_seconds = 0.0
+
+    def capacity(self, model: str) -> int:
+        return self.model_concurrency.get(model, self.default_model_concurrency)
+
+    def _eligible(self, waiter: _Waiter) -> bool:
+        return (
+            self._running_by_model.get(waiter.model, 0) < self.capacity(waiter.model)
+            and self._running_by_user.get(waiter.user_id, 0) < self.user_max_in_flight
+        )
+
+    def _dispatch(self) -> None:
+        """Admit every waiter that fits, highest priority first."""
+        for waiter in list(self._waiting):
+            if waiter.future.done():
+                self._waiting.remove(waiter)
+                continue
+            if not self._eligible(waiter):
+                continue
+            self._waiting.remove(waiter)
+            self._running_by_model[waiter.model] = self._running_by_model.get(waiter.model, 0) + 1
+            self._running_by_user[waiter.user_id] = self._running_by_user.get(waiter.user_id, 0) + 1
+            self.admitted += 1
+            self.total_wait_seconds += time.monotonic() - waiter.enqueued_at
+            waiter.future.set_result(None)
+
+    def _release(self, model: str, user_id: str) -> None:
+        self._running_by_model[model] -= 1
+        self._running_by_user[user_id] -= 1
+        if not self._running_by_user[user_id]:
+            del self._running_by_user[user_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        task_id: str,
+        model: str,
+        user_id: str,
+        tier: Optional[str],
+        duration: Optional[int] = None,
+    ) -> AsyncIterator[None]:
+        """Wait for admission, hold the slot for the duration of the block."""
+        waiter = _Waiter(
+            priority=TIER_PRIORITY.get(tier or "", TIER_PRIORITY[SubscriptionTier.FREE.value]),
+            seq=next(self._seq),
+            task_id=task_id,
+            model=model,
+            user_id=user_id,
+            duration=duration,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._waiting.append(waiter)
+        self._waiting.sort()
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                self._release(model, user_id)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(model, user_id)
+
+    async def position(self, task: Dict[str, Any], model: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Queue position and estimated wait for a task that has not started
+        rendering: pending tasks are ranked in the database queue, claimed
+        ones among this process's waiting renders.
+        """
+        if task.get("status") == "pending":
+            ranked = self._queue_positions.get(task["id"])
+            if ranked is None:
+                response = await supabase_admin_async.rpc(
+                    "generation_queue_position", {"p_task_id": task["id"]}
+                ).execute()
+                ranked = response.data or {}
+                self._queue_positions.set(task["id"], ranked)
+            if not ranked:
+                return None
+            ahead, depth = ranked["ahead"], ranked["depth"]
+        else:
+            waiter = next((w for w in self._waiting if w.task_id == task["id"]), None)
+            if waiter is None:
+                return None
+            same_model = [w for w in self._waiting if w.model == waiter.model]
+            ahead, depth = same_model.index(waiter), len(same_model)
+
+        duration = (task.get("config") or {}).get("duration")
+        expected = task_poller.schedule.expected(task_poller.schedule.key(model, duration))
+        waves = math.floor(ahead / max(1, self.capacity(model or ""))) + 1
+        return {
+            "queue_position": ahead + 1,
+            "queue_depth": depth,
+            "estimated_wait_seconds": int(waves * expected),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        depth: Dict[str, int] = {}
+        for waiter in self._waiting:
+            depth[waiter.model] = depth.get(waiter.model, 0) + 1
+        return {
+            "queue_depth": depth,
+            "running": dict(self._running_by_model),
+            "admitted": self.admitted,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.admitted, 2) if self.admitted else 0.0,
+            "queue_position_cache": self._queue_positions.stats(),
+        }
+
+
+generation_scheduler = GenerationScheduler(
+    model_concurrency=settings.SCHEDULER_MODEL_CONCURRENCY,
+    default_model_concurrency=settings.SCHEDULER_DEFAULT_MODEL_CONCURRENCY,
+    user_max_in_flight=settings.SCHEDULER_USER_MAX_IN_FLIGHT,
+    position_cache_seconds=settings.QUEUE_POSITION_CACHE_SECONDS,
+)
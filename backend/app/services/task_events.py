@@ -0,0 +1,161 @@
+"""
+In-process fan-out of generation task status changes.
+
+The pipeline, job queue and callbacks `publish()` every status/progress
+transition; `GET /generate/tasks/stream` subscribers receive them as
+Server-Sent Events instead of polling `GET /generate/tasks/{id}`.
+
+Each user has a short history so a reconnecting client can resume from its
+`Last-Event-ID`. Event ids are `<boot id>-<sequence>`: an id from another
+process or from before a restart, or one that has already fallen out of the
+history, cannot be resumed and the stream starts over with a snapshot.
+
+Events only reach subscribers in the process that published them. Streams
+therefore also re-read their user's unfinished tasks every
+TASK_STREAM_RECONCILE_SECONDS to pick up transitions made by dedicated
+workers (`python worker.py`), and publish those here; tasks this process
+runs itself are skipped, and a `processing` event never lowers the progress
+already published for a task.
+"""
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+
+@dataclass
+class TaskEvent:
+    id: str
+    seq: int
+    user_id: str
+    data: Dict[str, Any]
+
+
+@dataclass
+class _History:
+    events: Deque[TaskEvent]
+    evicted_through: int = 0
+
+
+class TaskEventBus:
+    """Per-user event history plus live subscriber queues."""
+
+    def __init__(self, history_size: int, max_users: int = 10000, queue_size: int = 256):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self._seq = itertools.count(1)
+        self.last_seq = 0
+        self._history = TTLCache(maxsize=max_users, default_ttl=3600)
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # Last published (status, progress) per task, to drop repeats.
+        self._last_state = TTLCache(maxsize=max_users * 10, default_ttl=3600)
+        self.published = 0
+        self.stale_dropped = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, user_id: str, task_id: str, status: str, **fields: Any) -> Optional[TaskEvent]:
+        """Record a task transition and push it to the user's subscribers."""
+        state: Tuple[Any, ...] = (status, fields.get("progress"))
+        last = self._last_state.get(task_id)
+        if last == state:
+            return None
+        if _progress_regresses(last, state):
+            # A lagging database read (progress writes are coalesced) must
+            # not move a running task's progress backwards.
+            self.stale_dropped += 1
+            return None
+        self._last_state.set(task_id, state)
+
+        seq = next(self._seq)
+        self.last_seq = seq
+        data = {"task_id": task_id, "status": status, "at": time.time()}
+        data.update({k: v for k, v in fields.items() if v is not None})
+        event = TaskEvent(id=f"{self.boot_id}-{seq}", seq=seq, user_id=user_id, data=data)
+
+        history: Optional[_History] = self._history.get(user_id)
+        if history is None:
+            history = _History(deque(maxlen=self.history_size))
+        if len(history.events) == history.events.maxlen:
+            history.evicted_through = history.events[0].seq
+        history.events.append(event)
+        self._history.set(user_id, history)
+        self.published += 1
+
+        for queue in list(self._subscribers.get(user_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow to keep up: end its stream; the client resumes.
+                self.dropped_subscribers += 1
+                self._subscribers[user_id].discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+        return event
+
+    def last_event_id(self) -> str:
+        return f"{self.boot_id}-{self.last_seq}"
+
+    def replay(self, user_id: str, last_event_id: Optional[str]) -> Optional[List[TaskEvent]]:
+        """
+        Events after `last_event_id`, or None if the stream cannot be resumed
+        from it (missing, foreign, or older than the retained history).
+        """
+        if not last_event_id:
+            return None
+        boot_id, _, seq_text = last_event_id.rpartition("-")
+        if boot_id != self.boot_id or not seq_text.isdigit():
+            return None
+        seq = int(seq_text)
+        history: Optional[_History] = self._history.get(user_id)
+        if history is None:
+            # Nothing retained: fine only if nothing was published since.
+            return [] if seq >= self.last_seq else None
+        if seq < history.evicted_through:
+            return None
+        return [event for event in history.events if event.seq > seq]
+
+    @contextmanager
+    def subscribe(self, user_id: str) -> Iterator[asyncio.Queue]:
+        """Queue receiving the user's events (None means: stream must end)."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "stale_dropped": self.stale_dropped,
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "users_with_history": len(self._history),
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+def _progress_regresses(last: Optional[Tuple[Any, ...]], state: Tuple[Any, ...]) -> bool:
+    if last is None or last[0] != "processing" or state[0] != "processing":
+        return False
+    return last[1] is not None and state[1] is not None and state[1] < last[1]
+
+
+task_events = TaskEventBus(history_size=settings.TASK_STREAM_HISTORY)
@@ -0,0 +1,488 @@
+"""
+Centralized poller for in-flight DashScope tasks.
+
+Instead of one sleeping coroutine per generation, every in-flight upstream
+task id is registered here. A single loop wakes on a shared tick, starts a
+status read for every task that is due (at most POLLER_MAX_CONCURRENCY in
+flight, so one slow read does not hold back the others), and resolves the
+per-task futures that generation pipelines are awaiting. A task is dropped
+once every pipeline waiting on it has gone (cancelled, lease lost).
+
+When a task is polled is decided by `AdaptiveSchedule`: it learns how long
+renders take per (model, duration), polls rarely early in a run and more
+often close to the expected finish, backs off once a task is overdue, and
+jitters every delay so polls for tasks submitted together drift apart.
+
+When DashScope completion callbacks are configured (DASHSCOPE_CALLBACK_URL),
+`resolve()` finishes tasks as soon as their callback arrives and polling
+drops to a slow fallback (CALLBACK_FALLBACK_POLL_SECONDS) for missed ones.
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from app.core.config import settings
+from app.services.ai_service import DashScopeService, dashscope_service
+from app.services.resilience import UpstreamUnavailable, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _TrackedTask:
+    task_id: str
+    future: asyncio.Future
+    started_at: float
+    deadline: float
+    next_poll_at: float
+    polls: int = 0
+    consecutive_errors: int = 0
+    last_status: Optional[str] = None
+    schedule_key: str = ""
+    overdue_polls: int = 0
+    polling: bool = False
+    waiters: int = 0
+    running_since: Optional[float] = None
+
+
+class AdaptiveSchedule:
+    """Model-aware poll timing learned from observed completion times."""
+
+    def __init__(
+        self,
+        default_expected: float,
+        min_interval: float,
+        max_interval: float,
+        jitter: float,
+        fixed_interval: float,
+        alpha: float = 0.3,
+    ):
+        self.default_expected = default_expected
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.fixed_interval = fixed_interval
+        self.alpha = alpha
+        self._expected: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+        self.polls = 0
+        self.fixed_equivalent_polls = 0
+
+    @staticmethod
+    def key(model: Optional[str], duration: Optional[int]) -> str:
+        return f"{model or 'unknown'}:{duration or 0}s"
+
+    def expected(self, key: str) -> float:
+        return self._expected.get(key, self.default_expected)
+
+    def next_delay(self, key: str, elapsed: float, overdue_polls: int) -> float:
+        """Seconds until the next status request for a task."""
+        remaining = self.expected(key) - elapsed
+        if remaining > 0:
+            # Halve the distance to the expected finish on every poll.
+            delay = remaining / 2
+        else:
+            delay = self.min_interval * (2 ** overdue_polls)
+        delay = min(max(delay, self.min_interval), self.max_interval)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def observe(self, key: str, duration: float, polls: int) -> None:
+        """Record a finished task: learn its duration and count saved polls."""
+        previous = self._expected.get(key)
+        if previous is None:
+            self._expected[key] = duration
+        else:
+            self._expected[key] = previous + self.alpha * (duration - previous)
+        self._samples[key] = self._samples.get(key, 0) + 1
+        self.polls += polls
+        self.fixed_equivalent_polls += max(1, math.ceil(duration / self.fixed_interval))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "status_calls": self.polls,
+            "fixed_interval_equivalent": self.fixed_equivalent_polls,
+            "status_calls_saved": self.fixed_equivalent_polls - self.polls,
+            "expected_seconds": {
+                key: {"expected": round(value, 1), "samples": self._samples[key]}
+                for key, value in self._expected.items()
+            },
+        }
+
+
+class TaskPoller:
+    """Polls all registered upstream tasks on one shared schedule."""
+
+    def __init__(
+        self,
+        service: DashScopeService,
+        schedule: AdaptiveSchedule,
+        tick_interval: float,
+        max_concurrency: int,
+        max_errors: int,
+        fallback_interval: Optional[float] = None,
+    ):
+        self.service = service
+        self.schedule = schedule
+        self.tick_interval = tick_interval
+        self.max_concurrency = max_concurrency
+        self.max_errors = max_errors
+        # With completion callbacks on, polling only catches missed callbacks.
+        self.fallback_interval = fallback_interval
+        self._tasks: Dict[str, _TrackedTask] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self._polls: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self.polls_total = 0
+        self.poll_errors = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.breaker_deferrals = 0
+        self.callbacks_delivered = 0
+        self.loop_errors = 0
+        self.loop_crashes = 0
+        self.abandoned = 0
+
+    async def start(self) -> None:
+        self._ensure_runner()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        for poll in list(self._polls):
+            poll.cancel()
+        await asyncio.gather(*self._polls, return_exceptions=True)
+        for tracked in self._tasks.values():
+            if not tracked.future.done():
+                tracked.future.cancel()
+        self._tasks.clear()
+
+    def track(
+        self,
+        task_id: str,
+        max_wait_time: float,
+        model: Optional[str] = None,
+        duration: Optional[int] = None,
+    ) -> asyncio.Future:
+        """
+        Register an upstream task and return a future for its final result.
+
+        `model` and `duration` select the learned completion-time profile.
+        Registering the same task id twice returns the same future.
+        """
+        tracked = self._tasks.get(task_id)
+        if tracked is not None:
+            return tracked.future
+
+        now = time.monotonic()
+        key = self.schedule.key(model, duration)
+        tracked = _TrackedTask(
+            task_id=task_id,
+            future=asyncio.get_running_loop().create_future(),
+            started_at=now,
+            deadline=now + max_wait_time,
+            next_poll_at=now + self._next_delay(key, 0.0, 0),
+            schedule_key=key,
+        )
+        self._tasks[task_id] = tracked
+        self._ensure_runner()
+        self._wakeup.set()
+        return tracked.future
+
+    def _next_delay(self, key: str, elapsed: float, overdue_polls: int) -> float:
+        delay = self.schedule.next_delay(key, elapsed, overdue_polls)
+        if self.fallback_interval is not None:
+            delay = max(delay, self.fallback_interval)
+        return delay
+
+    def resolve(self, task_id: str, result: Dict[str, Any]) -> bool:
+        """
+        Apply a status payload pushed by a completion callback.
+
+        Returns False if this process is not tracking `task_id`.
+        """
+        tracked = self._tasks.get(task_id)
+        if tracked is None or tracked.future.done():
+            return False
+        self.callbacks_delivered += 1
+        self._apply(tracked, result)
+        return True
+
+    async def wait_for(
+        self,
+        task_id: str,
+        max_wait_time: float,
+        model: Optional[str] = None,
+        duration: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Wait for an upstream task to finish.
+
+        Returns:
+            The final task status payload (task_status == SUCCEEDED).
+
+        Raises:
+            Exception: the task failed upstream or status polling kept failing.
+            TimeoutError: the task did not finish within `max_wait_time`.
+        """
+        future = self.track(task_id, max_wait_time, model=model, duration=duration)
+        tracked = self._tasks.get(task_id)
+        if tracked is not None:
+            tracked.waiters += 1
+        try:
+            # Shield so one cancelled waiter does not cancel a shared future.
+            return await asyncio.shield(future)
+        finally:
+            if tracked is not None:
+                tracked.waiters -= 1
+                if not tracked.waiters and not future.done():
+                    # Every waiter was cancelled: nobody needs this task polled.
+                    self.abandoned += 1
+                    self._finish(tracked)
+
+    def _ensure_runner(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+            self._runner.add_done_callback(self._on_runner_done)
+
+    def _on_runner_done(self, runner: asyncio.Task) -> None:
+        """The loop never returns; if it died, no waiter would ever wake up."""
+        if runner.cancelled():
+            return
+        error = runner.exception()
+        self.loop_crashes += 1
+        logger.error(f"Task poller loop died: {error!r}")
+        for poll in list(self._polls):
+            poll.cancel()
+        for tracked in list(self._tasks.values()):
+            self._finish(tracked, exc=Exception(f"Task status poller stopped: {error!r}"))
+
+    async def _run(self) -> None:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        while True:
+            now = time.monotonic()
+            for tracked in list(self._tasks.values()):
+                if tracked.polling or tracked.next_poll_at > now:
+                    continue
+                # Each read runs on its own; the loop keeps ticking meanwhile.
+                tracked.polling = True
+                poll = asyncio.create_task(self._poll(tracked, semaphore))
+                self._polls.add(poll)
+                poll.add_done_callback(partial(self._on_poll_done, tracked))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_poll_done(self, tracked: _TrackedTask, poll: asyncio.Task) -> None:
+        self._polls.discard(poll)
+        tracked.polling = False
+        if poll.cancelled():
+            return
+        error = poll.exception()
+        if error is not None and not tracked.future.done():
+            # A bug in _poll must not stop polling this task or any other.
+            self.loop_errors += 1
+            logger.error(f"Polling task {tracked.task_id} crashed: {error!r}")
+            self._poll_failed(tracked, error)
+
+    async def _poll(self, tracked: _TrackedTask, semaphore: asyncio.Semaphore) -> None:
+        if tracked.future.done():
+            self._untrack(tracked)
+            return
+
+        async with semaphore:
+            self.polls_total += 1
+            tracked.polls += 1
+            try:
+                result = await self.service.get_task_status(tracked.task_id)
+            except UpstreamUnavailable as e:
+                # Circuit open: the render itself may be fine, so do not count
+                # this against the task; check again once the breaker probes.
+                self.breaker_deferrals += 1
+                if time.monotonic() >= tracked.deadline:
+                    self.timed_out += 1
+                    self._finish(tracked, exc=TimeoutError(
+                        f"Task {tracked.task_id} status unavailable until deadline: {e}"
+                    ))
+                else:
+                    tracked.next_poll_at = time.monotonic() + max(
+                        e.retry_after, self.schedule.min_interval
+                    )
+                return
+            except Exception as e:
+                # HTTP errors, but also e.g. a 200 with a non-JSON body.
+                self._poll_failed(tracked, e)
+                return
+
+        if tracked.future.done():
+            return  # a callback finished it while the read was in flight
+        try:
+            self._apply(tracked, result)
+        except Exception as e:
+            # Malformed payload: treat like a failed read.
+            self._poll_failed(tracked, e)
+            return
+        tracked.consecutive_errors = 0
+
+    def _poll_failed(self, tracked: _TrackedTask, error: Exception) -> None:
+        self.poll_errors += 1
+        tracked.consecutive_errors += 1
+        if not isinstance(error, httpx.HTTPError):
+            logger.warning(f"Unexpected error polling task {tracked.task_id}: {error!r}")
+        if tracked.consecutive_errors >= self.max_errors:
+            self._finish(tracked, exc=Exception(
+                f"Failed to get task status after {self.max_errors} retries: {error}"
+            ))
+        elif time.monotonic() >= tracked.deadline:
+            self.timed_out += 1
+            self._finish(tracked, exc=TimeoutError(
+                f"Task {tracked.task_id} status unavailable until deadline: {error}"
+            ))
+        else:
+            tracked.next_poll_at = time.monotonic() + self.schedule.min_interval + backoff_delay(
+                tracked.consecutive_errors,
+                self.schedule.min_interval,
+                self.schedule.max_interval,
+            )
+
+    def _apply(self, tracked: _TrackedTask, result: Dict[str, Any]) -> None:
+        output = result.get("output", {})
+        status = output.get("task_status")
+        tracked.last_status = status
+        if status == "RUNNING" and tracked.running_since is None:
+            tracked.running_since = time.monotonic()
+
+        if status == "SUCCEEDED":
+            self.succeeded += 1
+            self.schedule.observe(
+                tracked.schedule_key,
+                _upstream_duration(output) or time.monotonic() - tracked.started_at,
+                tracked.polls,
+            )
+            self._finish(tracked, result=result)
+        elif status == "FAILED":
+            self.failed += 1
+            error_msg = output.get("message", "Unknown error")
+            self._finish(tracked, exc=Exception(f"Task failed: {error_msg}"))
+        elif time.monotonic() >= tracked.deadline:
+            self.timed_out += 1
+            elapsed = int(time.monotonic() - tracked.started_at)
+            self._finish(tracked, exc=TimeoutError(
+                f"Task {tracked.task_id} did not complete within {elapsed} seconds"
+            ))
+        else:
+            elapsed = time.monotonic() - tracked.started_at
+            if elapsed > self.schedule.expected(tracked.schedule_key):
+                tracked.overdue_polls += 1
+            tracked.next_poll_at = time.monotonic() + self._next_delay(
+                tracked.schedule_key, elapsed, tracked.overdue_polls
+            )
+
+    def _finish(
+        self,
+        tracked: _TrackedTask,
+        result: Optional[Dict[str, Any]] = None,
+        exc: Optional[BaseException] = None,
+    ) -> None:
+        """Untrack a task and settle its future (cancelled if no outcome is given)."""
+        self._untrack(tracked)
+        if tracked.future.done():
+            return
+        if result is None and exc is None:
+            tracked.future.cancel()
+        elif exc is not None:
+            tracked.future.set_exception(exc)
+            # Mark retrieved so an abandoned future does not log a warning.
+            tracked.future.exception()
+        else:
+            tracked.future.set_result(result)
+
+    def _untrack(self, tracked: _TrackedTask) -> None:
+        # The id may already be tracked again by a newer registration.
+        if self._tasks.get(tracked.task_id) is tracked:
+            del self._tasks[tracked.task_id]
+
+    def render_fraction(self, task_id: str) -> Optional[float]:
+        """
+        Estimated share of the render done (may exceed 1 when overdue), or
+        None if the task is not tracked.
+
+        Measured from the first poll that saw the task RUNNING, so time spent
+        in DashScope's queue does not count; until then the task is at 0.
+        With completion callbacks on, statuses are read too rarely to see
+        the start, so an unread task is measured from submission instead.
+        """
+        tracked = self._tasks.get(task_id)
+        if tracked is None:
+            return None
+        started = tracked.running_since
+        if started is None:
+            if tracked.last_status is not None or self.fallback_interval is None:
+                return 0.0
+            started = tracked.started_at
+        elapsed = time.monotonic() - started
+        return elapsed / max(self.schedule.expected(tracked.schedule_key), 1.0)
+
+    def in_flight(self) -> List[str]:
+        return list(self._tasks)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self._tasks),
+            "polls_in_flight": len(self._polls),
+            "abandoned": self.abandoned,
+            "polls_total": self.polls_total,
+            "poll_errors": self.poll_errors,
+            "loop_errors": self.loop_errors,
+            "loop_crashes": self.loop_crashes,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "breaker_deferrals": self.breaker_deferrals,
+            "callbacks_delivered": self.callbacks_delivered,
+            "fallback_interval": self.fallback_interval,
+            "max_concurrency": self.max_concurrency,
+            "schedule": self.schedule.stats(),
+        }
+
+
+def _upstream_duration(output: Dict[str, Any]) -> Optional[float]:
+    """Render time reported by DashScope (submit_time -> end_time), if present."""
+    try:
+        submitted = datetime.strptime(output["submit_time"], "%Y-%m-%d %H:%M:%S.%f")
+        ended = datetime.strptime(output["end_time"], "%Y-%m-%d %H:%M:%S.%f")
+    except (KeyError, TypeError, ValueError):
+        return None
+    seconds = (ended - submitted).total_seconds()
+    return seconds if seconds > 0 else None
+
+
+task_poller = TaskPoller(
+    service=dashscope_service,
+    schedule=AdaptiveSchedule(
+        default_expected=settings.POLLER_DEFAULT_EXPECTED_SECONDS,
+        min_interval=settings.POLLER_MIN_INTERVAL_SECONDS,
+        max_interval=settings.POLLER_MAX_INTERVAL_SECONDS,
+        jitter=settings.POLLER_JITTER,
+        fixed_interval=settings.POLLER_INTERVAL_SECONDS,
+    ),
+    tick_interval=settings.POLLER_TICK_SECONDS,
+    max_concurrency=settings.POLLER_MAX_CONCURRENCY,
+    max_errors=settings.POLLER_MAX_ERRORS,
+    fallback_interval=(
+        settings.CALLBACK_FALLBACK_POLL_SECONDS if settings.DASHSCOPE_CALLBACK_URL else None
+    ),
+)
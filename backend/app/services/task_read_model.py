@@ -0,0 +1,90 @@
+"""
+In-process read model of the generation tasks this process is running.
+
+The worker that executes a job already knows its current state, so
+`GET /generate/tasks/{id}` is answered from here instead of a
+`select("*")` on `generation_tasks` per poll. A row is tracked from the
+moment a job is claimed, kept current by the pipeline (config changes,
+progress), and dropped once the task reaches a final status or leaves the
+worker. Reads for finished or unknown tasks (including tasks run by another
+process) go to the database as before.
+
+A task can still be finalized elsewhere (an upstream callback delivered to
+another process), so an entry not confirmed against the database for
+TASK_READ_MODEL_MAX_AGE_SECONDS is treated as a miss; the caller's database
+read then refreshes it.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.services.task_events import FINAL_STATUSES
+
+
+class TaskReadModel:
+    """Current rows of locally executing tasks, keyed by task id."""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._confirmed_at: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def track(self, row: Dict[str, Any]) -> None:
+        """Start serving `row` (a full `generation_tasks` row)."""
+        self._rows[row["id"]] = dict(row)
+        self._confirmed_at[row["id"]] = time.monotonic()
+
+    def update(self, task_id: str, **fields: Any) -> None:
+        """Apply a local change to a tracked task; no-op if untracked."""
+        row = self._rows.get(task_id)
+        if row is None:
+            return
+        row.update(fields)
+        row["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    def is_tracked(self, task_id: str) -> bool:
+        """Whether this process is running the task."""
+        return task_id in self._rows
+
+    def forget(self, task_id: str) -> None:
+        self._rows.pop(task_id, None)
+        self._confirmed_at.pop(task_id, None)
+
+    def refresh(self, row: Dict[str, Any]) -> None:
+        """Re-confirm a tracked task with a row just read from the database."""
+        if row["id"] not in self._rows:
+            return
+        if row.get("status") in FINAL_STATUSES:
+            self.forget(row["id"])
+        else:
+            self.track(row)
+
+    def get(self, task_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of the task's row, or None if it must be read from the DB."""
+        row = self._rows.get(task_id)
+        if row is None or row.get("user_id") != user_id:
+            self.misses += 1
+            return None
+        if time.monotonic() - self._confirmed_at[task_id] > self.max_age:
+            self.stale += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(row)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tracked": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+task_read_model = TaskReadModel(max_age=settings.TASK_READ_MODEL_MAX_AGE_SECONDS)
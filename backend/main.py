@@ -1,8 +1,10 @@
 """
 Main FastAPI application.
 """
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -10,9 +12,17 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from app.core.config import settings
+from app.core.security import jwt_verifier
+from app.services.ai_service import dashscope_service, deepseek_service
+from app.services.task_poller import task_poller
+from app.services.progress import progress_reporter
+from app.services.job_queue import job_worker
+from app.services.prompt_cache import prompt_cache
+from app.services.result_cache import result_cache
+from app.services.recovery import run_recovery_loop
 from app.api.v1 import auth, projects, generate, digital_humans, credits
-from app.api.v1 import admin
-from app.db.supabase import supabase_admin
+from app.api.v1 import admin, callbacks
+from app.db.supabase import supabase_admin_async, close_async_clients
 
 # Logging configuration
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
@@ -31,11 +41,43 @@ logger = logging.getLogger(__name__)
 # Rate limiter
 limiter = Limiter(key_func=get_remote_address, default_limits=[f"{settings.RATE_LIMIT_PER_MINUTE}/minute"])
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background services."""
+    await dashscope_service.start()
+    await deepseek_service.start()
+    await task_poller.start()
+    if settings.EMBEDDED_WORKER:
+        await job_worker.start()
+
+    background: list[asyncio.Task] = []
+    if settings.EMBEDDED_WORKER:
+        background.append(asyncio.create_task(run_recovery_loop()))
+    if settings.AUTH_VERIFY_MODE == "local":
+        background.append(asyncio.create_task(jwt_verifier.run_refresh_loop()))
+
+    yield
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await job_worker.stop()
+    await progress_reporter.stop()
+    await task_poller.stop()
+    await close_async_clients()
+    await dashscope_service.aclose()
+    await deepseek_service.aclose()
+    await result_cache.aclose()
+    prompt_cache.close()
+
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan,
 )
 
 # Register limiter
@@ -61,6 +103,7 @@ app.include_router(generate.router, prefix="/api/v1")
 app.include_router(digital_humans.router, prefix="/api/v1")
 app.include_router(credits.router, prefix="/api/v1")
 app.include_router(admin.router, prefix="/api/v1")
+app.include_router(callbacks.router, prefix="/api/v1")
 
 
 # Global exception handler
@@ -85,16 +128,28 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint -- verifies database connectivity."""
+    """
+    Health check endpoint -- verifies database connectivity and reports the
+    upstream circuit breakers ("degraded" while one is open).
+    """
+    upstreams = {
+        service.name: service.breaker.state
+        for service in (dashscope_service, deepseek_service)
+    }
     try:
-        supabase_admin.table("profiles").select("id").limit(1).execute()
-        return {"status": "healthy", "database": "connected"}
+        await supabase_admin_async.table("profiles").select("id").limit(1).execute()
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         return JSONResponse(
             status_code=503,
-            content={"status": "unhealthy", "database": str(e)},
+            content={"status": "unhealthy", "database": str(e), "upstreams": upstreams},
         )
+    degraded = any(state != "closed" for state in upstreams.values())
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "database": "connected",
+        "upstreams": upstreams,
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""
+Benchmark auth latency: remote (auth.get_user) vs local JWT verification.
+
+Spins up a local stand-in for the Supabase auth server (`GET /auth/v1/user`)
+with a configurable artificial latency, then resolves an HS256 token
+through `get_current_user_id` in both modes and prints p50/p99 latencies:
+"cold" clears the resolved-token cache before every call (the cost of
+actually verifying a token), "warm" repeats a cached token (what a polling
+client sees).
+
+Usage (from backend/):
+    python -m scripts.bench_auth --requests 2000 --remote-latency-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+
+JWT_SECRET = "bench-secret-bench-secret-bench-secret"
+USER_ID = str(uuid.uuid4())
+
+
+def _make_handler(latency_s: float):
+    class AuthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency_s)
+            body = json.dumps({
+                "id": USER_ID,
+                "aud": "authenticated",
+                "role": "authenticated",
+                "app_metadata": {},
+                "user_metadata": {},
+                "created_at": "2026-01-01T00:00:00Z",
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return AuthHandler
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _measure(get_current_user_id, credentials, n, clear_cache=None):
+    samples = []
+    if clear_cache is None:
+        await get_current_user_id(credentials)  # warm the cache first
+    for _ in range(n):
+        if clear_cache is not None:
+            clear_cache()
+        start = time.perf_counter()
+        await get_current_user_id(credentials)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--remote-latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(args.remote_latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    dummy_key = jwt.encode({"role": "anon"}, JWT_SECRET, algorithm="HS256")
+    os.environ.update({
+        "SUPABASE_URL": base_url,
+        "SUPABASE_KEY": dummy_key,
+        "SUPABASE_SERVICE_ROLE_KEY": dummy_key,
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "DASHSCOPE_API_KEY": "bench",
+        "DEEPSEEK_API_KEY": "bench",
+    })
+
+    from fastapi.security import HTTPAuthorizationCredentials
+    from app.core.config import settings
+    from app.api.deps import get_current_user_id, token_cache
+
+    token = jwt.encode(
+        {"sub": USER_ID, "aud": "authenticated", "exp": int(time.time()) + 3600},
+        JWT_SECRET,
+        algorithm="HS256",
+    )
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    print(f"{'mode':<8} {'cache':<6} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for mode in ("remote", "local"):
+        settings.AUTH_VERIFY_MODE = mode
+        for cache, clear_cache in (("cold", token_cache.clear), ("warm", None)):
+            token_cache.clear()
+            samples = asyncio.run(
+                _measure(get_current_user_id, credentials, args.requests, clear_cache)
+            )
+            print(
+                f"{mode:<8} {cache:<6} {len(samples):>6} {_percentile(samples, 50):>9.3f} "
+                f"{_percentile(samples, 99):>9.3f} {statistics.mean(samples):>9.3f}"
+            )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Concurrency benchmark: sync vs async Supabase client inside one event loop.
+
+Starts a local PostgREST stand-in (`GET /rest/v1/<table>`) with a fixed
+artificial latency and fires `--concurrency` simultaneous handler coroutines
+at it, the way a single uvicorn worker would serve concurrent requests. The
+"sync" run calls `supabase_admin.table(...).execute()` from inside the
+coroutine (the pre-migration pattern), the "async" run awaits
+`supabase_admin_async`. Prints throughput and how long the event loop was
+stalled (i.e. how long every other request on the worker had to wait).
+
+Usage (from backend/):
+    python -m scripts.bench_postgrest --requests 400 --concurrency 50 --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROWS = [{"id": "00000000-0000-0000-0000-000000000001", "title": "bench", "status": "draft"}]
+DUMMY_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench"
+
+
+def _make_handler(latency_s: float):
+    class PostgrestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            # postgrest-py sends a (empty JSON) body even on GET; drain it so
+            # the kept-alive connection stays in sync.
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(latency_s)
+            body = json.dumps(ROWS).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return PostgrestHandler
+
+
+async def _run(handler, total, concurrency):
+    """Return (elapsed seconds, event-loop stall samples in ms)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    stalls = []
+    done = asyncio.Event()
+
+    async def one():
+        async with semaphore:
+            await handler()
+
+    async def probe():
+        # How late a 10 ms timer fires = how long other requests were starved.
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append((time.perf_counter() - start - 0.01) * 1000)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+    return elapsed, stalls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(args.latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        "SUPABASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "SUPABASE_KEY": DUMMY_KEY,
+        "SUPABASE_SERVICE_ROLE_KEY": DUMMY_KEY,
+        "DASHSCOPE_API_KEY": "bench",
+        "DEEPSEEK_API_KEY": "bench",
+    })
+
+    from app.db.supabase import supabase_admin, supabase_admin_async, close_async_clients
+
+    async def sync_handler():
+        supabase_admin.table("projects").select("*").eq("user_id", "bench").execute()
+
+    async def async_handler():
+        await supabase_admin_async.table("projects").select("*").eq("user_id", "bench").execute()
+
+    async def bench():
+        results = {}
+        for name, handler in (("sync", sync_handler), ("async", async_handler)):
+            await handler()  # warm up the connection pool
+            results[name] = await _run(handler, args.requests, args.concurrency)
+        await close_async_clients()
+        return results
+
+    results = asyncio.run(bench())
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"upstream latency {args.latency_ms:.0f} ms"
+    )
+    print(f"{'client':<7} {'req/s':>9} {'loop stall p99 ms':>18} {'max ms':>9}")
+    for name, (elapsed, stalls) in results.items():
+        ordered = sorted(stalls) or [0.0]
+        p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+        print(f"{name:<7} {args.requests / elapsed:>9.1f} {p99:>18.2f} {ordered[-1]:>9.2f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+End-to-end load test for the generation pipeline.
+
+Drives a running backend (normally pointed at `scripts.mock_upstream`) the
+way clients do: submits `/generate/video` and/or
+`/digital-humans/{id}/generate-video` requests, then follows every task
+through `GET /generate/tasks/{id}` until it completes or fails. Reports:
+
+  - throughput (finished tasks per second) and submit latency,
+  - submit-to-completion latency percentiles,
+  - memory per in-flight task: growth of the API process's RSS from idle
+    to peak, divided by the peak number of in-flight tasks (needs
+    `--api-pid` of a local uvicorn; Linux only).
+
+The test user needs enough credits (10 per video); top up with
+`python -m scripts.add_credits`.
+
+Usage (from backend/):
+    python -m scripts.mock_upstream --render-seconds 20 &
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8090 DEEPSEEK_BASE_URL=http://127.0.0.1:8090 \\
+        uvicorn main:app --port 8000 &
+    python -m scripts.load_test --token "$JWT" --videos 200 --digital-humans 50 \\
+        --digital-human-id <uuid> --concurrency 50 --api-pid $(pgrep -f "uvicorn main:app")
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
+
+
+@dataclass
+class _Result:
+    kind: str
+    submit_seconds: float = 0.0
+    total_seconds: float = 0.0
+    status: str = "unknown"
+    error: Optional[str] = None
+
+
+@dataclass
+class _Tracker:
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    rss_samples: List[int] = field(default_factory=list)
+
+    def enter(self) -> None:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _wait_for_task(
+    client: httpx.AsyncClient,
+    task_id: str,
+    poll_interval: float,
+    timeout: float,
+) -> str:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        response = await client.get(f"/api/v1/generate/tasks/{task_id}")
+        if response.status_code == 200:
+            task_status = response.json().get("status")
+            if task_status in ("completed", "failed", "cancelled"):
+                return task_status
+        await asyncio.sleep(poll_interval)
+    return "timeout"
+
+
+async def _one(
+    client: httpx.AsyncClient,
+    kind: str,
+    args: argparse.Namespace,
+    index: int,
+    tracker: _Tracker,
+) -> _Result:
+    result = _Result(kind=kind)
+    start = time.perf_counter()
+    try:
+        if kind == "video":
+            project = await client.post("/api/v1/projects", json={
+                "title": f"load-test {index}",
+                "project_type": "one_click_basic",
+            })
+            project.raise_for_status()
+            start = time.perf_counter()
+            response = await client.post("/api/v1/generate/video", json={
+                "project_id": project.json()["id"],
+                "prompt": args.prompts[index % len(args.prompts)],
+                "model_type": "wan2.6-i2v",
+                "image_url": args.image_url,
+                "duration": args.duration,
+                "optimize_prompt": not args.no_optimize,
+            })
+        else:
+            response = await client.post(
+                f"/api/v1/digital-humans/{args.digital_human_id}/generate-video",
+                json={"text": args.prompts[index % len(args.prompts)], "duration": 10},
+            )
+        result.submit_seconds = time.perf_counter() - start
+        response.raise_for_status()
+        task_id = response.json()["generation_task_id"]
+
+        tracker.enter()
+        try:
+            result.status = await _wait_for_task(client, task_id, args.poll_interval, args.timeout)
+        finally:
+            tracker.leave()
+    except Exception as e:
+        result.status = "error"
+        result.error = str(e)[:200]
+    result.total_seconds = time.perf_counter() - start
+    return result
+
+
+async def _sample_rss(pid: int, tracker: _Tracker, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        rss = _rss_bytes(pid)
+        if rss is not None:
+            tracker.rss_samples.append(rss)
+        await asyncio.sleep(0.5)
+
+
+def _report(results: List[_Result], elapsed: float, tracker: _Tracker, idle_rss: Optional[int]) -> None:
+    print(f"\nFinished {len(results)} tasks in {elapsed:.1f}s")
+    for kind in sorted({r.kind for r in results}):
+        subset = [r for r in results if r.kind == kind]
+        done = [r for r in subset if r.status == "completed"]
+        counts = {s: sum(1 for r in subset if r.status == s) for s in sorted({r.status for r in subset})}
+        submit = [r.submit_seconds * 1000 for r in subset if r.status != "error"]
+        total = [r.total_seconds for r in done]
+        print(f"\n[{kind}] {counts}")
+        print(f"  throughput       : {len(done) / elapsed:.2f} completed/s")
+        if submit:
+            print(f"  submit latency   : p50={_percentile(submit, 50):.0f}ms "
+                  f"p95={_percentile(submit, 95):.0f}ms p99={_percentile(submit, 99):.0f}ms")
+        if total:
+            print(f"  submit->complete : p50={_percentile(total, 50):.1f}s "
+                  f"p95={_percentile(total, 95):.1f}s p99={_percentile(total, 99):.1f}s "
+                  f"mean={statistics.mean(total):.1f}s")
+        errors = {r.error for r in subset if r.error}
+        for error in list(errors)[:3]:
+            print(f"  error: {error}")
+
+    print(f"\npeak in-flight tasks: {tracker.peak_in_flight}")
+    if idle_rss is not None and tracker.rss_samples and tracker.peak_in_flight:
+        peak_rss = max(tracker.rss_samples)
+        per_task = (peak_rss - idle_rss) / tracker.peak_in_flight
+        print(f"API RSS: idle={idle_rss / 2**20:.1f}MiB peak={peak_rss / 2**20:.1f}MiB "
+              f"-> {per_task / 1024:.1f}KiB per in-flight task")
+    else:
+        print("API RSS: not measured (pass --api-pid of a local API process)")
+
+
+async def _main(args: argparse.Namespace) -> None:
+    kinds = ["video"] * args.videos + ["digital_human"] * args.digital_humans
+    if args.digital_humans and not args.digital_human_id:
+        raise SystemExit("--digital-human-id is required with --digital-humans")
+
+    tracker = _Tracker()
+    idle_rss = _rss_bytes(args.api_pid) if args.api_pid else None
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(args.api_pid, tracker, stop)) if args.api_pid else None
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=args.api,
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=30,
+        limits=httpx.Limits(max_connections=args.concurrency * 2),
+    ) as client:
+        async def bounded(index: int, kind: str) -> _Result:
+            async with semaphore:
+                return await _one(client, kind, args, index, tracker)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bounded(i, kind) for i, kind in enumerate(kinds)))
+        elapsed = time.perf_counter() - start
+
+    stop.set()
+    if sampler is not None:
+        await sampler
+    _report(results, elapsed, tracker, idle_rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.environ.get("LOAD_TEST_TOKEN"), required=False,
+                        help="access token of the test user (or LOAD_TEST_TOKEN)")
+    parser.add_argument("--videos", type=int, default=100)
+    parser.add_argument("--digital-humans", type=int, default=0)
+    parser.add_argument("--digital-human-id")
+    parser.add_argument("--concurrency", type=int, default=50, help="tasks submitted/followed at once")
+    parser.add_argument("--image-url", default="http://127.0.0.1:8090/assets/input.png")
+    parser.add_argument("--duration", type=int, default=4)
+    parser.add_argument("--no-optimize", action="store_true", help="skip DeepSeek prompt optimization")
+    parser.add_argument("--prompts", nargs="+", default=["a cat running on a wet street at dawn"])
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-task timeout in seconds")
+    parser.add_argument("--api-pid", type=int, help="PID of the API process, for RSS sampling")
+    args = parser.parse_args()
+    if not args.token:
+        raise SystemExit("--token (or LOAD_TEST_TOKEN) is required")
+
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
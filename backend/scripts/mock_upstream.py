@@ -0,0 +1,216 @@
+"""
+Local stand-in for the DashScope and DeepSeek APIs.
+
+Serves the endpoints the backend calls, with configurable latency and
+failure injection, so the generation pipeline can be load-tested without
+paying for real renders:
+
+  POST /api/v1/services/aigc/video-generation/video-synthesis   (wan2.6-i2v)
+  POST /api/v1/services/aigc/text2video/wanx-text-to-video      (digital human)
+  GET  /api/v1/tasks/{task_id}
+  POST /v1/chat/completions                                     (DeepSeek, incl. stream)
+  GET  /assets/{name}                                           (dummy input image)
+  GET  /stats
+
+Render times are drawn from a log-normal distribution (median, sigma); API
+call latency likewise. `--error-rate` answers 503 and `--rate-limit-rate`
+answers 429 on any call; `--render-failure-rate` makes renders end FAILED.
+If a submit carries an `X-DashScope-Callback` header, the final status is
+POSTed there when the render finishes (see `/api/v1/callbacks/dashscope`).
+
+Point the backend at it with:
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8090
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8090
+
+Usage (from backend/):
+    python -m scripts.mock_upstream --port 8090 --render-seconds 20 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# 1x1 PNG, padded so result-cache image hashing has something to read.
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+CHAT_REPLY = "清晨的城市街道，一只橘猫沿着湿润的石板路慢跑，柔和的逆光勾勒出毛发轮廓，镜头低角度跟随，氛围温暖安静。"
+
+
+def _lognormal(median: float, sigma: float) -> float:
+    return random.lognormvariate(math.log(max(median, 1e-6)), sigma) if sigma > 0 else median
+
+
+def _dashscope_time(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Mock DashScope/DeepSeek")
+    tasks: Dict[str, Dict[str, Any]] = {}
+    stats: Counter = Counter()
+    background = set()
+
+    async def api_latency() -> None:
+        await asyncio.sleep(_lognormal(args.api_latency_ms / 1000, args.api_latency_sigma))
+
+    def injected_failure() -> Optional[Response]:
+        roll = random.random()
+        if roll < args.rate_limit_rate:
+            stats["injected_429"] += 1
+            return JSONResponse({"code": "Throttling", "message": "mock rate limit"}, status_code=429)
+        if roll < args.rate_limit_rate + args.error_rate:
+            stats["injected_503"] += 1
+            return JSONResponse({"code": "ServiceUnavailable", "message": "mock outage"}, status_code=503)
+        return None
+
+    def task_output(task: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.monotonic()
+        output = {
+            "task_id": task["task_id"],
+            "submit_time": _dashscope_time(task["submitted"]),
+        }
+        if now < task["started_at"]:
+            output["task_status"] = "PENDING"
+        elif now < task["finishes_at"]:
+            output["task_status"] = "RUNNING"
+        elif task["fails"]:
+            output.update(task_status="FAILED", code="InternalError", message="mock render failure")
+        else:
+            end = task["submitted"] + timedelta(seconds=task["finishes_at"] - task["created_at"])
+            output.update(
+                task_status="SUCCEEDED",
+                end_time=_dashscope_time(end),
+                video_url=f"http://{args.host}:{args.port}/assets/{task['task_id']}.mp4",
+            )
+        return output
+
+    async def deliver_callback(task: Dict[str, Any], url: str) -> None:
+        await asyncio.sleep(max(0.0, task["finishes_at"] - time.monotonic()))
+        if random.random() < args.callback_drop_rate:
+            stats["callbacks_dropped"] += 1
+            return
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                await client.post(url, json={"request_id": uuid.uuid4().hex, "output": task_output(task)})
+            stats["callbacks_sent"] += 1
+        except Exception:
+            stats["callbacks_failed"] += 1
+
+    async def submit(request: Request) -> Response:
+        stats["submits"] += 1
+        await api_latency()
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+        await request.body()
+        now = time.monotonic()
+        task_id = uuid.uuid4().hex
+        task = {
+            "task_id": task_id,
+            "submitted": datetime.now(),
+            "created_at": now,
+            "started_at": now + _lognormal(args.queue_seconds, 0.5) if args.queue_seconds else now,
+            "finishes_at": now + _lognormal(args.render_seconds, args.render_sigma),
+            "fails": random.random() < args.render_failure_rate,
+        }
+        task["finishes_at"] = max(task["finishes_at"], task["started_at"])
+        tasks[task_id] = task
+        callback = request.headers.get("X-DashScope-Callback")
+        if callback:
+            job = asyncio.create_task(deliver_callback(task, callback))
+            background.add(job)
+            job.add_done_callback(background.discard)
+        return JSONResponse({
+            "request_id": uuid.uuid4().hex,
+            "output": {"task_id": task_id, "task_status": "PENDING"},
+        })
+
+    app.post("/api/v1/services/aigc/video-generation/video-synthesis")(submit)
+    app.post("/api/v1/services/aigc/text2video/wanx-text-to-video")(submit)
+
+    @app.get("/api/v1/tasks/{task_id}")
+    async def task_status(task_id: str) -> Response:
+        stats["status_reads"] += 1
+        await api_latency()
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+        task = tasks.get(task_id)
+        if task is None:
+            return JSONResponse({"code": "InvalidParameter", "message": "task not found"}, status_code=404)
+        return JSONResponse({"request_id": uuid.uuid4().hex, "output": task_output(task)})
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request) -> Response:
+        stats["chat_completions"] += 1
+        body = await request.json()
+        await api_latency()
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+        think = _lognormal(args.chat_latency_ms / 1000, 0.4)
+
+        if not body.get("stream"):
+            await asyncio.sleep(think + len(CHAT_REPLY) / args.chat_tokens_per_second)
+            return JSONResponse({
+                "id": uuid.uuid4().hex,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": CHAT_REPLY}}],
+            })
+
+        async def chunks():
+            await asyncio.sleep(think)
+            for char in CHAT_REPLY:
+                await asyncio.sleep(1 / args.chat_tokens_per_second)
+                chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": char}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/assets/{name}")
+    async def asset(name: str) -> Response:
+        return Response(PNG + name.encode(), media_type="image/png")
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, Any]:
+        return {"tasks": len(tasks), **stats}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--api-latency-ms", type=float, default=40.0, help="median API call latency")
+    parser.add_argument("--api-latency-sigma", type=float, default=0.5)
+    parser.add_argument("--queue-seconds", type=float, default=0.0, help="median time PENDING before RUNNING")
+    parser.add_argument("--render-seconds", type=float, default=20.0, help="median render time")
+    parser.add_argument("--render-sigma", type=float, default=0.3)
+    parser.add_argument("--render-failure-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered 429")
+    parser.add_argument("--callback-drop-rate", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=600.0, help="median time to first token")
+    parser.add_argument("--chat-tokens-per-second", type=float, default=40.0)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
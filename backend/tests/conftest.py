@@ -0,0 +1,61 @@
+"""
+Shared fixtures.
+
+Settings are read from the environment at import time, so dummy values are
+set here before any `app` module is imported. Nothing talks to Supabase:
+tests stub the few database calls they reach.
+"""
+import argparse
+import os
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.test")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.test")
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("DEEPSEEK_API_KEY", "test")
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app.services.ai_service import DashScopeService  # noqa: E402
+from scripts.mock_upstream import create_app  # noqa: E402
+
+MOCK_BASE_URL = "http://mock-upstream"
+
+
+def _mock_args(**overrides) -> argparse.Namespace:
+    args = dict(
+        host="127.0.0.1",
+        port=8090,
+        api_latency_ms=1.0,
+        api_latency_sigma=0.0,
+        queue_seconds=0.0,
+        render_seconds=0.05,
+        render_sigma=0.0,
+        render_failure_rate=0.0,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        callback_drop_rate=0.0,
+        chat_latency_ms=1.0,
+        chat_tokens_per_second=1000.0,
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def mock_dashscope():
+    """
+    Factory for a DashScopeService served in-process by scripts/mock_upstream
+    (keyword arguments override its command-line options).
+    """
+    def make(**overrides) -> DashScopeService:
+        service = DashScopeService()
+        service.base_url = MOCK_BASE_URL
+        service._client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=create_app(_mock_args(**overrides))),
+            headers=service.headers,
+        )
+        return service
+
+    return make
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.core.config import settings
+from app.services.ai_service import DashScopeService, PooledUpstream, _retry_after_seconds
+from app.services.resilience import CircuitBreaker, UpstreamUnavailable
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        if self.path == "/limited":
+            body = b'{"code": "Throttling"}'
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+        else:
+            body = b'{"ok": true}'
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """A real HTTP/1.1 server that records the client address of every request."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.peers = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_pool_stats_before_start():
+    upstream = PooledUpstream("http://127.0.0.1:1", "key")
+    stats = upstream.pool_stats()
+    assert stats["started"] is False
+    assert stats["connections"] == 0
+    assert stats["requests_total"] == 0
+
+
+def test_calls_reuse_one_client_and_connection(http_server):
+    base_url = f"http://127.0.0.1:{http_server.server_address[1]}"
+
+    async def scenario():
+        upstream = PooledUpstream(base_url, "key")
+        await upstream.start()
+        client = upstream.client
+        try:
+            for _ in range(3):
+                response = await upstream._request("GET", f"{base_url}/status", timeout=5.0)
+                assert response.status_code == 200
+            assert upstream.client is client
+            return upstream.pool_stats()
+        finally:
+            await upstream.aclose()
+
+    stats = asyncio.run(scenario())
+    # Three requests, one kept-alive TCP connection.
+    assert len(http_server.peers) == 1
+    assert stats["started"] is True
+    assert stats["requests_total"] == 3
+    assert stats["in_flight"] == 0
+    assert "pool_introspection" not in stats  # httpx internals still readable
+    assert stats["connections"] == 1
+    assert stats["connections_idle"] == 1
+    assert stats["connections_active"] == 0
+    assert stats["utilization"] == 0.0
+    assert stats["max_connections"] == settings.UPSTREAM_MAX_CONNECTIONS
+
+
+def test_pool_stats_counts_active_connections(http_server):
+    base_url = f"http://127.0.0.1:{http_server.server_address[1]}"
+
+    async def scenario():
+        upstream = PooledUpstream(base_url, "key")
+        await upstream.start()
+        try:
+            async with upstream.client.stream("GET", f"{base_url}/status") as response:
+                assert response.status_code == 200
+                # The body is not read yet: the connection is still in use.
+                return upstream.pool_stats()
+        finally:
+            await upstream.aclose()
+
+    stats = asyncio.run(scenario())
+    assert stats["connections"] == 1
+    assert stats["connections_active"] == 1
+    assert stats["utilization"] == round(1 / settings.UPSTREAM_MAX_CONNECTIONS, 4)
+
+
+def test_pool_stats_reports_unreadable_pool():
+    async def scenario():
+        upstream = PooledUpstream("http://127.0.0.1:1", "key")
+        await upstream.start()
+        transport = upstream._client._transport
+        try:
+            upstream._client._transport = object()  # as if httpx internals changed
+            return upstream.pool_stats()
+        finally:
+            upstream._client._transport = transport
+            await upstream.aclose()
+
+    stats = asyncio.run(scenario())
+    assert stats["pool_introspection"] is False
+    assert "connections" not in stats
+
+
+def test_rate_limiting_does_not_open_the_breaker(http_server, monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_ATTEMPTS", 4)
+    base_url = f"http://127.0.0.1:{http_server.server_address[1]}"
+
+    async def scenario():
+        upstream = PooledUpstream(base_url, "key")
+        upstream.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        await upstream.start()
+        try:
+            response = await upstream._request("GET", f"{base_url}/limited", timeout=5.0)
+            assert response.status_code == 429
+            # Still closed: the next call goes through.
+            response = await upstream._request("GET", f"{base_url}/status", timeout=5.0)
+            assert response.status_code == 200
+            return upstream
+        finally:
+            await upstream.aclose()
+
+    upstream = asyncio.run(scenario())
+    assert upstream.rate_limited == 4
+    assert upstream.retries == 3
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+    assert upstream.breaker.times_opened == 0
+
+
+def test_retry_after_header_forms():
+    assert _retry_after_seconds("3") == 3.0
+    assert _retry_after_seconds("1.5") == 1.5
+    assert _retry_after_seconds("") is None
+    assert _retry_after_seconds("soon") is None
+    assert _retry_after_seconds(formatdate(0, usegmt=True)) == 0.0
+    assert 0 < _retry_after_seconds(formatdate(time.time() + 30, usegmt=True)) <= 30
+
+
+def test_digital_human_submit_passes_an_open_circuit_through():
+    async def scenario():
+        service = DashScopeService()
+        service.breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+        service.breaker.record_failure()
+        try:
+            with pytest.raises(UpstreamUnavailable):
+                await service.generate_digital_human_video("http://avatar", "hello")
+        finally:
+            await service.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import deps
+from app.services.idempotency import IdempotencyKeyReused, IdempotencyStore
+
+
+class FakeKeyTable:
+    """The `idempotency_keys` table and `claim_idempotency_key` RPC, in memory."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def attach(self, store: IdempotencyStore) -> IdempotencyStore:
+        store._claim = self.claim
+        store._save = self.save
+        store._release = self.release
+        return store
+
+    async def claim(self, user_id, key, scope, body_hash):
+        row = self.rows.get((user_id, key))
+        if row is None:
+            self.rows[(user_id, key)] = {"hash": body_hash, "status": "in_progress"}
+            return {"state": "claimed"}
+        if row["hash"] != body_hash:
+            return {"state": "conflict"}
+        if row["status"] == "completed":
+            return {"state": "completed", "response": row["response"]}
+        return {"state": "in_progress"}
+
+    async def save(self, user_id, key, response):
+        self.rows[(user_id, key)].update(status="completed", response=response)
+
+    async def release(self, user_id, key):
+        self.rows.pop((user_id, key), None)
+
+
+def _store(table: FakeKeyTable) -> IdempotencyStore:
+    return table.attach(IdempotencyStore(maxsize=100, ttl=60, lock_seconds=5, wait_interval=0.01))
+
+
+class Counter:
+    def __init__(self, fail_first: bool = False):
+        self.calls = 0
+        self.fail_first = fail_first
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail_first and self.calls == 1:
+            raise RuntimeError("insufficient credits")
+        return {"generation_task_id": f"task-{self.calls}"}
+
+
+def test_retry_replays_the_first_response():
+    async def scenario():
+        store = _store(FakeKeyTable())
+        fn = Counter()
+        first = await store.run("u1", "key", "generate_video", "h", fn)
+        again = await store.run("u1", "key", "generate_video", "h", fn)
+        assert first == again == {"generation_task_id": "task-1"}
+        assert fn.calls == 1
+        assert store.stats()["replayed"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicates_share_one_execution():
+    async def scenario():
+        store = _store(FakeKeyTable())
+        fn = Counter()
+        results = await asyncio.gather(
+            *(store.run("u1", "key", "generate_video", "h", fn) for _ in range(5))
+        )
+        assert fn.calls == 1
+        assert all(result == results[0] for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_retry_in_another_process_replays_from_the_database():
+    async def scenario():
+        table = FakeKeyTable()
+        fn = Counter()
+        first = await _store(table).run("u1", "key", "generate_video", "h", fn)
+        other_process = _store(table)
+        again = await other_process.run("u1", "key", "generate_video", "h", fn)
+        assert again == first
+        assert fn.calls == 1
+        assert other_process.stats()["executed"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_in_another_process_waits_for_the_first():
+    async def scenario():
+        table = FakeKeyTable()
+        fn = Counter()
+        results = await asyncio.gather(
+            _store(table).run("u1", "key", "generate_video", "h", fn),
+            _store(table).run("u1", "key", "generate_video", "h", fn),
+        )
+        assert fn.calls == 1
+        assert results[0] == results[1]
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_for_a_different_request_conflicts():
+    async def scenario():
+        table = FakeKeyTable()
+        store = _store(table)
+        await store.run("u1", "key", "generate_video", "h1", Counter())
+        with pytest.raises(IdempotencyKeyReused):
+            await store.run("u1", "key", "generate_video", "h2", Counter())
+        # Also when only the database knows the key.
+        with pytest.raises(IdempotencyKeyReused):
+            await _store(table).run("u1", "key", "generate_video", "h2", Counter())
+
+    asyncio.run(scenario())
+
+
+def test_keys_are_scoped_per_user():
+    async def scenario():
+        store = _store(FakeKeyTable())
+        fn = Counter()
+        await store.run("u1", "key", "generate_video", "h", fn)
+        await store.run("u2", "key", "generate_video", "h", fn)
+        assert fn.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_failed_request_can_be_retried_with_the_same_key():
+    async def scenario():
+        table = FakeKeyTable()
+        store = _store(table)
+        fn = Counter(fail_first=True)
+        with pytest.raises(RuntimeError):
+            await store.run("u1", "key", "generate_video", "h", fn)
+        assert ("u1", "key") not in table.rows
+        result = await store.run("u1", "key", "generate_video", "h", fn)
+        assert result == {"generation_task_id": "task-2"}
+
+    asyncio.run(scenario())
+
+
+def test_run_idempotent_rejects_reuse_across_endpoints(monkeypatch):
+    async def scenario():
+        store = _store(FakeKeyTable())
+        monkeypatch.setattr(deps, "idempotency_store", store)
+        payload = {"prompt": "a cat"}
+        await deps.run_idempotent("generate_video", "u1", "key", payload, Counter())
+        with pytest.raises(HTTPException) as raised:
+            await deps.run_idempotent("generate_video_batch", "u1", "key", payload, Counter())
+        assert raised.value.status_code == 422
+
+    asyncio.run(scenario())
@@ -0,0 +1,132 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import scheduler as scheduler_module
+from app.services.scheduler import GenerationScheduler
+
+
+def _scheduler(
+    model_capacity: int = 10, user_max_in_flight: int = 2, position_cache_seconds: float = 0
+) -> GenerationScheduler:
+    return GenerationScheduler(
+        model_concurrency={"wan2.6-i2v": model_capacity},
+        default_model_concurrency=model_capacity,
+        user_max_in_flight=user_max_in_flight,
+        position_cache_seconds=position_cache_seconds,
+    )
+
+
+class FakeQueueRpc:
+    """Stands in for supabase_admin_async: answers generation_queue_position."""
+
+    def __init__(self, ranked):
+        self.ranked = ranked
+        self.calls = 0
+
+    def rpc(self, name, params):
+        assert name == "generation_queue_position"
+        self.calls += 1
+
+        async def execute():
+            return SimpleNamespace(data=self.ranked.get(params["p_task_id"]))
+
+        return SimpleNamespace(execute=execute)
+
+
+async def _hold(scheduler, task_id, user_id, tier, admitted, release, model="wan2.6-i2v"):
+    async with scheduler.slot(task_id, model=model, user_id=user_id, tier=tier):
+        admitted.append(task_id)
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_user_cap_holds_back_extra_renders():
+    async def scenario():
+        scheduler = _scheduler(user_max_in_flight=2)
+        admitted, release = [], asyncio.Event()
+        tasks = [
+            asyncio.create_task(_hold(scheduler, f"a{i}", "alice", "free", admitted, release))
+            for i in range(3)
+        ]
+        tasks.append(asyncio.create_task(_hold(scheduler, "b0", "bob", "free", admitted, release)))
+        await _settle()
+        # Alice's third render waits although the model has capacity; Bob is not blocked.
+        assert sorted(admitted) == ["a0", "a1", "b0"]
+        assert scheduler.stats()["running"] == {"wan2.6-i2v": 3}
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sorted(admitted) == ["a0", "a1", "a2", "b0"]
+        assert scheduler.stats()["running"] == {"wan2.6-i2v": 0}
+
+    asyncio.run(scenario())
+
+
+def test_model_cap_admits_higher_tier_first():
+    async def scenario():
+        scheduler = _scheduler(model_capacity=1, user_max_in_flight=5)
+        admitted = []
+        first, rest = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(_hold(scheduler, "busy", "carol", "free", admitted, first))
+        await _settle()
+        waiting = [
+            asyncio.create_task(_hold(scheduler, "free-1", "dave", "free", admitted, rest)),
+            asyncio.create_task(_hold(scheduler, "pro-1", "erin", "pro", admitted, rest)),
+            asyncio.create_task(_hold(scheduler, "ent-1", "frank", "enterprise", admitted, rest)),
+        ]
+        await _settle()
+        assert admitted == ["busy"]
+
+        position = await scheduler.position({"id": "free-1", "status": "processing"}, "wan2.6-i2v")
+        assert position["queue_position"] == 3
+        assert position["queue_depth"] == 3
+
+        first.set()
+        rest.set()
+        await asyncio.gather(running, *waiting)
+        assert admitted == ["busy", "ent-1", "pro-1", "free-1"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        scheduler = _scheduler(model_capacity=1)
+        admitted, release = [], asyncio.Event()
+        running = asyncio.create_task(_hold(scheduler, "busy", "u1", "free", admitted, release))
+        await _settle()
+        waiter = asyncio.create_task(_hold(scheduler, "gone", "u2", "free", admitted, release))
+        await _settle()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        release.set()
+        await running
+        assert admitted == ["busy"]
+        assert scheduler.stats()["queue_depth"] == {}
+
+    asyncio.run(scenario())
+
+
+def test_pending_position_is_cached_per_task(monkeypatch):
+    rpc = FakeQueueRpc({"t1": {"ahead": 4, "depth": 9}})
+    monkeypatch.setattr(scheduler_module, "supabase_admin_async", rpc)
+
+    async def scenario():
+        scheduler = _scheduler(model_capacity=2, position_cache_seconds=60)
+        task = {"id": "t1", "status": "pending", "config": {"duration": 5}}
+        first = await scheduler.position(task, "wan2.6-i2v")
+        second = await scheduler.position(task, "wan2.6-i2v")
+        missing = [await scheduler.position({"id": "t2", "status": "pending"}, "wan2.6-i2v") for _ in range(2)]
+        return first, second, missing
+
+    first, second, missing = asyncio.run(scenario())
+    assert first == second
+    assert first["queue_position"] == 5
+    assert first["queue_depth"] == 9
+    assert missing == [None, None]
+    # One database call per task, including a task that is no longer queued.
+    assert rpc.calls == 2
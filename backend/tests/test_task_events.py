@@ -0,0 +1,149 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.api.v1 import generate
+from app.core.config import settings
+from app.services.task_events import TaskEventBus
+from app.services.task_read_model import TaskReadModel
+
+
+def test_replay_returns_only_events_after_last_event_id():
+    bus = TaskEventBus(history_size=10)
+    bus.publish("u1", "t1", "pending")
+    seen = bus.publish("u1", "t1", "processing", progress=5)
+    later = [
+        bus.publish("u1", "t1", "processing", progress=50),
+        bus.publish("u1", "t1", "completed", progress=100),
+    ]
+    bus.publish("u2", "t9", "pending")
+
+    replayed = bus.replay("u1", seen.id)
+    assert [event.id for event in replayed] == [event.id for event in later]
+
+
+def test_replay_is_empty_when_nothing_was_missed():
+    bus = TaskEventBus(history_size=10)
+    last = bus.publish("u1", "t1", "pending")
+    assert bus.replay("u1", last.id) == []
+
+
+def test_replay_cannot_resume_foreign_or_evicted_ids():
+    bus = TaskEventBus(history_size=2)
+    first = bus.publish("u1", "t1", "pending")
+    for progress in (10, 20, 30):
+        bus.publish("u1", "t1", "processing", progress=progress)
+
+    assert bus.replay("u1", None) is None
+    assert bus.replay("u1", "another-boot-1") is None
+    assert bus.replay("u1", f"{bus.boot_id}-x") is None
+    # Fell out of the two-event history: the client needs a snapshot.
+    assert bus.replay("u1", first.id) is None
+
+
+def test_repeated_state_is_not_published_twice():
+    bus = TaskEventBus(history_size=10)
+    assert bus.publish("u1", "t1", "processing", progress=5) is not None
+    assert bus.publish("u1", "t1", "processing", progress=5) is None
+
+
+def test_processing_progress_never_moves_backwards():
+    bus = TaskEventBus(history_size=10)
+    assert bus.publish("u1", "t1", "processing", progress=55) is not None
+    # A lagging database row for the same task.
+    assert bus.publish("u1", "t1", "processing", progress=40) is None
+    assert bus.publish("u1", "t1", "processing", progress=58) is not None
+    assert bus.publish("u1", "t1", "failed", progress=0) is not None
+    assert bus.stats()["stale_dropped"] == 1
+
+
+class FakeTaskRows:
+    """Stands in for supabase_admin_async: returns rows for the requested ids."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requested = []
+
+    def table(self, name):
+        fake = self
+
+        class Query:
+            def select(self, fields):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def in_(self, column, ids):
+                fake.requested.append(list(ids))
+                self.ids = ids
+                return self
+
+            async def execute(self):
+                return SimpleNamespace(data=[r for r in fake.rows if r["id"] in self.ids])
+
+        return Query()
+
+
+def test_reconcile_skips_tasks_running_in_this_process(monkeypatch):
+    bus = TaskEventBus(history_size=10)
+    read_model = TaskReadModel(max_age=60)
+    read_model.track({"id": "t-local", "user_id": "u1", "status": "processing", "progress": 55})
+    rows = FakeTaskRows([
+        {"id": "t-local", "status": "processing", "progress": 40},
+        {"id": "t-worker", "status": "processing", "progress": 30},
+    ])
+    monkeypatch.setattr(generate, "task_events", bus)
+    monkeypatch.setattr(generate, "task_read_model", read_model)
+    monkeypatch.setattr(generate, "supabase_admin_async", rows)
+
+    asyncio.run(generate._reconcile("u1", {"t-local", "t-worker"}))
+    assert rows.requested == [["t-worker"]]
+    assert [event.data["task_id"] for event in bus.replay("u1", f"{bus.boot_id}-0")] == ["t-worker"]
+
+    # Nothing to read when every active task runs here.
+    asyncio.run(generate._reconcile("u1", {"t-local"}))
+    assert len(rows.requested) == 1
+
+
+class _Request:
+    """Disconnects after a few loop iterations."""
+
+    def __init__(self, rounds: int):
+        self.rounds = rounds
+
+    async def is_disconnected(self) -> bool:
+        self.rounds -= 1
+        return self.rounds < 0
+
+
+def test_resumed_stream_replays_missed_events_and_reconciles(monkeypatch):
+    bus = TaskEventBus(history_size=10)
+    monkeypatch.setattr(generate, "task_events", bus)
+    monkeypatch.setattr(settings, "TASK_STREAM_RECONCILE_SECONDS", 0)
+    monkeypatch.setattr(settings, "TASK_STREAM_KEEPALIVE_SECONDS", 0.01)
+
+    reconciled = []
+
+    async def unfinished_task_ids(user_id):
+        return {"t-worker"}
+
+    async def reconcile(user_id, active):
+        reconciled.append(set(active))
+
+    monkeypatch.setattr(generate, "_unfinished_task_ids", unfinished_task_ids)
+    monkeypatch.setattr(generate, "_reconcile", reconcile)
+
+    seen = bus.publish("u1", "t1", "processing", progress=5)
+    missed = bus.publish("u1", "t1", "completed", progress=100)
+
+    async def scenario():
+        response = await generate.stream_task_status(
+            _Request(rounds=2), user_id="u1", last_event_id=seen.id
+        )
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(scenario())
+    assert chunks[0].startswith(f"id: {missed.id}\nevent: task\n")
+    assert not any("event: snapshot" in chunk for chunk in chunks)
+    # Tasks run by other processes are reconciled on a resumed stream too.
+    assert reconciled and reconciled[0] == {"t-worker"}
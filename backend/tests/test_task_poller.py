@@ -0,0 +1,237 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.task_poller import AdaptiveSchedule, TaskPoller
+
+
+def _poller(service, max_errors: int = 3, max_wait: float = 5.0) -> TaskPoller:
+    schedule = AdaptiveSchedule(
+        default_expected=0.05,
+        min_interval=0.01,
+        max_interval=0.05,
+        jitter=0.0,
+        fixed_interval=0.05,
+    )
+    return TaskPoller(
+        service=service,
+        schedule=schedule,
+        tick_interval=0.01,
+        max_concurrency=4,
+        max_errors=max_errors,
+    )
+
+
+class ScriptedService:
+    """Answers status reads from a list of results or exceptions."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def get_task_status(self, task_id: str):
+        self.calls += 1
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+
+def _status(task_status: str, **output):
+    return {"output": {"task_status": task_status, **output}}
+
+
+async def _submit(service) -> str:
+    response = await service.client.post(
+        f"{service.base_url}/api/v1/services/aigc/video-generation/video-synthesis",
+        json={"model": "wan2.6-i2v"},
+    )
+    return response.json()["output"]["task_id"]
+
+
+def test_mock_upstream_render_succeeds(mock_dashscope):
+    async def scenario():
+        service = mock_dashscope()
+        poller = _poller(service)
+        try:
+            task_id = await _submit(service)
+            result = await asyncio.wait_for(poller.wait_for(task_id, 5.0), 5.0)
+        finally:
+            await poller.stop()
+            await service.aclose()
+        assert result["output"]["task_status"] == "SUCCEEDED"
+        assert poller.stats()["succeeded"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_mock_upstream_render_failure_fails_the_waiter(mock_dashscope):
+    async def scenario():
+        service = mock_dashscope(render_failure_rate=1.0)
+        poller = _poller(service)
+        try:
+            task_id = await _submit(service)
+            with pytest.raises(Exception, match="mock render failure"):
+                await asyncio.wait_for(poller.wait_for(task_id, 5.0), 5.0)
+        finally:
+            await poller.stop()
+            await service.aclose()
+        assert poller.failed == 1
+
+    asyncio.run(scenario())
+
+
+def test_repeated_status_errors_fail_after_max_errors():
+    async def scenario():
+        service = ScriptedService(httpx.ConnectError("down"))
+        poller = _poller(service, max_errors=3)
+        try:
+            with pytest.raises(Exception, match="after 3 retries"):
+                await asyncio.wait_for(poller.wait_for("t1", 5.0), 5.0)
+        finally:
+            await poller.stop()
+        assert service.calls == 3
+        assert poller.poll_errors == 3
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_errors_and_bad_payloads_count_as_failed_reads():
+    async def scenario():
+        # A non-HTTP error, then a payload _apply cannot read, then success.
+        service = ScriptedService(
+            ValueError("not json"),
+            ["not", "a", "dict"],
+            _status("SUCCEEDED"),
+        )
+        poller = _poller(service, max_errors=3)
+        try:
+            result = await asyncio.wait_for(poller.wait_for("t1", 5.0), 5.0)
+        finally:
+            await poller.stop()
+        assert result["output"]["task_status"] == "SUCCEEDED"
+        assert poller.poll_errors == 2
+        assert poller.loop_crashes == 0
+
+    asyncio.run(scenario())
+
+
+def test_successful_read_resets_the_error_count():
+    async def scenario():
+        error = httpx.ReadTimeout("slow")
+        service = ScriptedService(
+            error, error, _status("RUNNING"), error, error, _status("SUCCEEDED")
+        )
+        poller = _poller(service, max_errors=3)
+        try:
+            result = await asyncio.wait_for(poller.wait_for("t1", 5.0), 5.0)
+        finally:
+            await poller.stop()
+        assert result["output"]["task_status"] == "SUCCEEDED"
+        assert poller.poll_errors == 4
+
+    asyncio.run(scenario())
+
+
+def test_dead_poll_loop_fails_pending_waiters():
+    async def scenario():
+        poller = _poller(ScriptedService(_status("RUNNING")))
+
+        async def broken_loop():
+            raise RuntimeError("boom")
+
+        poller._run = broken_loop
+        try:
+            with pytest.raises(Exception, match="poller stopped"):
+                await asyncio.wait_for(poller.wait_for("t1", 5.0), 5.0)
+        finally:
+            await poller.stop()
+        assert poller.loop_crashes == 1
+
+    asyncio.run(scenario())
+
+
+class GatedService:
+    """Status reads for `slow` block until `release` is set; others succeed."""
+
+    def __init__(self, slow: str):
+        self.slow = slow
+        self.release = asyncio.Event()
+
+    async def get_task_status(self, task_id: str):
+        if task_id == self.slow:
+            await self.release.wait()
+        return _status("SUCCEEDED")
+
+
+def test_slow_status_read_does_not_stall_other_tasks():
+    async def scenario():
+        service = GatedService(slow="slow")
+        poller = _poller(service)
+        try:
+            slow = asyncio.create_task(poller.wait_for("slow", 5.0))
+            await asyncio.sleep(0.1)  # the read for "slow" is now hanging
+            result = await asyncio.wait_for(poller.wait_for("fast", 5.0), 1.0)
+            assert result["output"]["task_status"] == "SUCCEEDED"
+            assert poller.stats()["polls_in_flight"] == 1
+            service.release.set()
+            await asyncio.wait_for(slow, 1.0)
+        finally:
+            await poller.stop()
+        assert poller.succeeded == 2
+
+    asyncio.run(scenario())
+
+
+def test_task_is_untracked_once_all_waiters_are_cancelled():
+    async def scenario():
+        service = ScriptedService(_status("RUNNING"))
+        poller = _poller(service)
+        try:
+            first = asyncio.create_task(poller.wait_for("t1", 5.0))
+            second = asyncio.create_task(poller.wait_for("t1", 5.0))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            # Another pipeline still waits on it.
+            assert poller.in_flight() == ["t1"]
+
+            second.cancel()
+            await asyncio.gather(second, return_exceptions=True)
+            assert poller.in_flight() == []
+            calls = service.calls
+            await asyncio.sleep(0.1)
+            assert service.calls == calls  # no longer polled
+        finally:
+            await poller.stop()
+        assert poller.abandoned == 1
+
+    asyncio.run(scenario())
+
+
+def test_render_fraction_counts_from_the_first_running_status():
+    async def scenario():
+        service = ScriptedService(_status("PENDING"))
+        poller = _poller(service)
+        poller.schedule.default_expected = 10.0
+        try:
+            waiter = asyncio.create_task(poller.wait_for("t1", 5.0))
+            await asyncio.sleep(0)
+            assert poller.render_fraction("t1") == 0.0  # not read yet
+            await asyncio.sleep(0.2)  # queued upstream for a while
+            assert poller._tasks["t1"].last_status == "PENDING"
+            assert poller.render_fraction("t1") == 0.0
+
+            service.replies = [_status("RUNNING")]
+            while poller._tasks["t1"].last_status != "RUNNING":
+                await asyncio.sleep(0.01)
+            # Only the time since RUNNING counts, not the 0.2s queued.
+            assert 0.0 <= poller.render_fraction("t1") < 0.01
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        finally:
+            await poller.stop()
+        assert poller.render_fraction("t1") is None
+
+    asyncio.run(scenario())
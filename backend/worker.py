@@ -0,0 +1,67 @@
+"""
+Standalone generation worker.
+
+Claims queued jobs from `generation_tasks` and renders them. Run as many of
+these as needed (on one or several hosts); they share the queue through
+leases, so each job is processed by one worker at a time.
+
+Usage:
+    python worker.py
+"""
+import asyncio
+import logging
+import signal
+
+from app.core.config import settings
+from app.db.supabase import close_async_clients
+from app.services.ai_service import dashscope_service, deepseek_service
+from app.services.job_queue import job_worker
+from app.services.prompt_cache import prompt_cache
+from app.services.result_cache import result_cache
+from app.services.recovery import run_recovery_loop
+from app.services.task_poller import task_poller
+from app.services.progress import progress_reporter
+
+logging.basicConfig(
+    level=logging.DEBUG if settings.DEBUG else logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger("worker")
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await dashscope_service.start()
+    await deepseek_service.start()
+    await task_poller.start()
+    await job_worker.start()
+    recovery = asyncio.create_task(run_recovery_loop())
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Shutting down; unfinished jobs will be re-claimed after their lease expires")
+        recovery.cancel()
+        await asyncio.gather(recovery, return_exceptions=True)
+        await job_worker.stop()
+        await progress_reporter.stop()
+        await task_poller.stop()
+        await close_async_clients()
+        await dashscope_service.aclose()
+        await deepseek_service.aclose()
+        await result_cache.aclose()
+        prompt_cache.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
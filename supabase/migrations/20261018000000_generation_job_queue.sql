@@ -0,0 +1,109 @@
+-- ============================================================================
+-- generation_tasks 作为持久化任务队列
+-- 日期：2026-10-18
+--
+-- 目的：
+--   此前渲染任务通过 FastAPI BackgroundTasks 运行，只存在于接收请求的那个
+--   worker 协程里：部署或崩溃会在扣费之后丢失任务，也无法跨进程分摊渲染。
+--   现在 generation_tasks 的每一行就是一个队列任务：
+--     - status = 'pending'                       → 待领取
+--     - status = 'processing' 且租约未过期       → 某个 worker 正在处理
+--     - status = 'processing' 且租约已过期       → worker 失联，可被重新领取
+--   worker 通过 claim_generation_jobs()（FOR UPDATE SKIP LOCKED）领取任务，
+--   处理期间通过 extend_generation_job_lease() 心跳续约。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 后端实际写入的列（历史上由 Dashboard 手工添加，这里补进正式迁移）
+--    model_version / credits_cost 由代码写入 model_name / config.credits_cost，
+--    因此放开 NOT NULL。
+-- ----------------------------------------------------------------------------
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS model_name text;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS config jsonb NOT NULL DEFAULT '{}'::jsonb;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS result_url text;
+ALTER TABLE generation_tasks ALTER COLUMN model_version DROP NOT NULL;
+ALTER TABLE generation_tasks ALTER COLUMN credits_cost DROP NOT NULL;
+
+-- ----------------------------------------------------------------------------
+-- 2. 队列列：任务类型、租约、重试次数
+-- ----------------------------------------------------------------------------
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS job_type text;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS lease_owner text;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;
+ALTER TABLE generation_tasks ADD COLUMN IF NOT EXISTS max_attempts integer NOT NULL DEFAULT 3;
+
+CREATE INDEX IF NOT EXISTS idx_generation_tasks_queue
+  ON generation_tasks (created_at)
+  WHERE job_type IS NOT NULL AND status IN ('pending', 'processing');
+
+-- ----------------------------------------------------------------------------
+-- 3. 领取任务：待处理任务 + 租约过期且未超过重试上限的任务
+--    SKIP LOCKED 保证多个 worker 并发领取时互不重复、互不阻塞。
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION claim_generation_jobs(
+  p_worker_id text,
+  p_limit integer,
+  p_visibility_timeout_seconds integer
+) RETURNS SETOF generation_tasks
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  RETURN QUERY
+  UPDATE generation_tasks t
+  SET status = 'processing',
+      lease_owner = p_worker_id,
+      lease_expires_at = now() + make_interval(secs => p_visibility_timeout_seconds),
+      attempts = t.attempts + 1,
+      started_at = COALESCE(t.started_at, now())
+  WHERE t.id IN (
+    SELECT q.id
+    FROM generation_tasks q
+    WHERE q.job_type IS NOT NULL
+      AND (
+        q.status = 'pending'
+        OR (q.status = 'processing'
+            AND q.lease_expires_at < now()
+            AND q.attempts < q.max_attempts)
+      )
+    ORDER BY q.created_at
+    FOR UPDATE SKIP LOCKED
+    LIMIT p_limit
+  )
+  RETURNING t.*;
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 4. 心跳续约：仅当租约仍属于该 worker 时成功，返回是否续约成功
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION extend_generation_job_lease(
+  p_task_id uuid,
+  p_worker_id text,
+  p_visibility_timeout_seconds integer
+) RETURNS boolean
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  UPDATE generation_tasks
+  SET lease_expires_at = now() + make_interval(secs => p_visibility_timeout_seconds)
+  WHERE id = p_task_id
+    AND lease_owner = p_worker_id
+    AND status = 'processing';
+  RETURN FOUND;
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 5. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer) FROM public, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION extend_generation_job_lease(uuid, text, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer) TO service_role;
+GRANT EXECUTE ON FUNCTION extend_generation_job_lease(uuid, text, integer) TO service_role;
@@ -0,0 +1,15 @@
+-- ============================================================================
+-- 上游完成回调：按 DashScope task_id 查找生成任务
+-- 日期：2026-10-18
+--
+-- 目的：
+--   POST /api/v1/callbacks/dashscope 收到的通知只带上游 task_id
+--   （保存在 generation_tasks.config->>'ai_task_id'）。为该表达式建索引，
+--   避免每次回调全表扫描。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_generation_tasks_ai_task_id
+    ON generation_tasks ((config->>'ai_task_id'))
+    WHERE config ? 'ai_task_id';
@@ -0,0 +1,15 @@
+-- ============================================================================
+-- 生成结果缓存：按内容指纹查找可复用的已完成渲染
+-- 日期：2026-10-18
+--
+-- 目的：
+--   已完成的视频任务在 config->>'result_fingerprint' 中记录输入指纹
+--   （模型、图片内容哈希、提示词、时长）。请求携带 reuse_cached_result 时，
+--   后端按指纹查找 RESULT_CACHE_TTL_SECONDS 内完成的任务并直接复用其视频。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_generation_tasks_result_fingerprint
+    ON generation_tasks ((config->>'result_fingerprint'), updated_at DESC)
+    WHERE status = 'completed' AND config ? 'result_fingerprint';
@@ -0,0 +1,148 @@
+-- ============================================================================
+-- 生成任务生命周期 RPC：每次状态转换一次往返
+-- 日期：2026-10-18
+--
+-- 目的：
+--   此前任务完成/失败时，后端依次发出多次 PostgREST 写入：
+--     完成 → 条件更新 generation_tasks、更新 projects（数字人：查名称、插入
+--            projects、回写 project_id）
+--     失败 → 条件更新 generation_tasks、更新 projects、调用 refund_user_credits
+--   每一步都是独立请求，且中途失败会留下不一致的状态（例如任务已失败但未退款）。
+--   现在每次转换只调用一个 RPC，在同一事务内完成全部写入：
+--     - complete_generation_task()：完成任务并更新/创建项目
+--     - fail_generation_task()     ：任务失败、项目标记失败并退款
+--   两者都只在任务仍处于 pending/processing 时生效（与回调并发时只有一方成功），
+--   未生效时返回 NULL，生效时返回 {"task": 更新后的任务行, ...}。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 完成任务
+--    video：更新关联项目的 video_url / status
+--    digital_human：以数字人名称和文案创建项目，并回写到任务的 project_id
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION complete_generation_task(
+  p_task_id uuid,
+  p_result_url text
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_name text;
+  v_text text;
+  v_project_id uuid;
+BEGIN
+  UPDATE generation_tasks
+  SET status = 'completed',
+      progress = 100,
+      result_url = p_result_url
+  WHERE id = p_task_id
+    AND status IN ('pending', 'processing')
+  RETURNING * INTO v_task;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF v_task.job_type = 'digital_human' THEN
+    SELECT name INTO v_name
+    FROM digital_humans
+    WHERE id = (v_task.config->>'digital_human_id')::uuid;
+
+    v_text := COALESCE(v_task.config->>'text', '');
+
+    INSERT INTO projects (user_id, title, description, project_type, status, video_url)
+    VALUES (
+      v_task.user_id,
+      format('%s - %s...', v_name, left(v_text, 30)),
+      v_text,
+      'digital_human',
+      'completed',
+      p_result_url
+    )
+    RETURNING id INTO v_project_id;
+
+    UPDATE generation_tasks
+    SET project_id = v_project_id
+    WHERE id = p_task_id
+    RETURNING * INTO v_task;
+  ELSIF v_task.project_id IS NOT NULL THEN
+    UPDATE projects
+    SET video_url = p_result_url,
+        status = 'completed'
+    WHERE id = v_task.project_id;
+  END IF;
+
+  RETURN jsonb_build_object('task', to_jsonb(v_task));
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 2. 任务失败：标记失败、项目标记失败、退款
+--    p_expected_attempts 供孤儿任务恢复使用：仅当 attempts 未变化时生效。
+--    退款失败（如用户资料不存在）不回滚失败状态，返回 refunded = false，
+--    由后端记录日志。
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION fail_generation_task(
+  p_task_id uuid,
+  p_error_message text,
+  p_refund_amount integer DEFAULT 0,
+  p_refund_description text DEFAULT NULL,
+  p_refund_reference_id uuid DEFAULT NULL,
+  p_refund_reference_type text DEFAULT NULL,
+  p_expected_attempts integer DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_refunded boolean := false;
+BEGIN
+  UPDATE generation_tasks
+  SET status = 'failed',
+      error_message = p_error_message
+  WHERE id = p_task_id
+    AND status IN ('pending', 'processing')
+    AND (p_expected_attempts IS NULL OR attempts = p_expected_attempts)
+  RETURNING * INTO v_task;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF v_task.project_id IS NOT NULL THEN
+    UPDATE projects SET status = 'failed' WHERE id = v_task.project_id;
+  END IF;
+
+  IF p_refund_amount > 0 THEN
+    BEGIN
+      PERFORM refund_user_credits(
+        v_task.user_id,
+        p_refund_amount,
+        p_refund_description,
+        p_refund_reference_id,
+        p_refund_reference_type
+      );
+      v_refunded := true;
+    EXCEPTION WHEN OTHERS THEN
+      RAISE WARNING 'Refund for generation task % failed: %', p_task_id, SQLERRM;
+    END;
+  END IF;
+
+  RETURN jsonb_build_object('task', to_jsonb(v_task), 'refunded', v_refunded);
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 3. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION complete_generation_task(uuid, text) FROM public, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION complete_generation_task(uuid, text) TO service_role;
+GRANT EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) TO service_role;
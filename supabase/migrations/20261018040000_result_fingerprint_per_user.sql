@@ -0,0 +1,17 @@
+-- ============================================================================
+-- 生成结果缓存：按用户隔离指纹查找
+-- 日期：2026-10-18
+--
+-- 目的：
+--   结果复用只在同一用户的任务之间进行（指纹不能证明请求方有权访问其他用户的
+--   图片或视频），查询条件变为 user_id + config->>'result_fingerprint'。
+--   用带 user_id 前缀的索引替换 20261018020000 创建的索引。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+DROP INDEX IF EXISTS idx_generation_tasks_result_fingerprint;
+
+CREATE INDEX IF NOT EXISTS idx_generation_tasks_user_result_fingerprint
+    ON generation_tasks (user_id, (config->>'result_fingerprint'), updated_at DESC)
+    WHERE status = 'completed' AND config ? 'result_fingerprint';
@@ -0,0 +1,104 @@
+-- ============================================================================
+-- 公平领取生成任务：按订阅等级排序，并在领取时执行每用户并发上限
+-- 日期：2026-10-18
+--
+-- 目的：
+--   claim_generation_jobs() 原先按 created_at 先进先出领取。WORKER_CONCURRENCY
+--   较大时，一个用户一次提交的 50 个批量任务会被同一次领取全部拿走，之后的其他
+--   用户只能排在后面——进程内调度器的等级优先和每用户上限只作用于已领取的任务。
+--   现在排序和上限在领取时由数据库执行：
+--     - 按订阅等级（enterprise > startup > pro > free），同等级内按 created_at；
+--     - 每个用户的在途任务（processing 且租约未过期）加上本次领取的任务
+--       不超过 p_user_max_in_flight，达到上限的用户的任务留在队列中。
+--   领取过程持有事务级 advisory lock，多个 worker 并发领取时上限依然准确。
+--   p_user_max_in_flight 为 NULL 时不限制（兼容未传该参数的旧版本后端）。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 订阅等级 → 优先级（数值越小越优先），与后端 TIER_PRIORITY 一致
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION generation_tier_rank(p_tier text)
+RETURNS integer
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE p_tier
+    WHEN 'enterprise' THEN 0
+    WHEN 'startup' THEN 1
+    WHEN 'pro' THEN 2
+    ELSE 3
+  END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 2. 领取任务（替换 20261018000000 中的三参数版本）
+-- ----------------------------------------------------------------------------
+DROP FUNCTION IF EXISTS claim_generation_jobs(text, integer, integer);
+
+CREATE OR REPLACE FUNCTION claim_generation_jobs(
+  p_worker_id text,
+  p_limit integer,
+  p_visibility_timeout_seconds integer,
+  p_user_max_in_flight integer DEFAULT NULL
+) RETURNS SETOF generation_tasks
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  -- 串行化领取：在途计数在本事务内不会被其他 worker 的领取改变
+  PERFORM pg_advisory_xact_lock(hashtext('claim_generation_jobs'));
+
+  RETURN QUERY
+  WITH in_flight AS (
+    SELECT f.user_id, count(*) AS running
+    FROM generation_tasks f
+    WHERE f.job_type IS NOT NULL
+      AND f.status = 'processing'
+      AND f.lease_expires_at >= now()
+    GROUP BY f.user_id
+  ),
+  candidates AS (
+    SELECT q.id,
+           generation_tier_rank(p.subscription_tier) AS tier_rank,
+           COALESCE(i.running, 0)
+             + row_number() OVER (PARTITION BY q.user_id ORDER BY q.created_at) AS user_slot
+    FROM generation_tasks q
+    LEFT JOIN profiles p ON p.id = q.user_id
+    LEFT JOIN in_flight i ON i.user_id = q.user_id
+    WHERE q.job_type IS NOT NULL
+      AND (
+        q.status = 'pending'
+        OR (q.status = 'processing'
+            AND q.lease_expires_at < now()
+            AND q.attempts < q.max_attempts)
+      )
+  ),
+  picked AS (
+    SELECT c.id
+    FROM generation_tasks c
+    JOIN candidates r ON r.id = c.id
+    WHERE p_user_max_in_flight IS NULL OR r.user_slot <= p_user_max_in_flight
+    ORDER BY r.tier_rank, c.created_at
+    FOR UPDATE OF c SKIP LOCKED
+    LIMIT p_limit
+  )
+  UPDATE generation_tasks t
+  SET status = 'processing',
+      lease_owner = p_worker_id,
+      lease_expires_at = now() + make_interval(secs => p_visibility_timeout_seconds),
+      attempts = t.attempts + 1,
+      started_at = COALESCE(t.started_at, now())
+  FROM picked
+  WHERE t.id = picked.id
+  RETURNING t.*;
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 3. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer, integer) TO service_role;
@@ -0,0 +1,61 @@
+-- ============================================================================
+-- 排队位置：按领取顺序统计排在任务前面的待处理任务
+-- 日期：2026-10-18
+--
+-- 目的：
+--   GET /generate/tasks/{id} 的排队位置此前只来自接收请求的进程的内存调度器，
+--   独立 worker 部署或任务尚未被领取时没有位置信息。现在待处理（pending）任务的
+--   位置由数据库计算，排序与 claim_generation_jobs() 一致：订阅等级优先，
+--   同等级按 created_at。返回 {"ahead": 前面的任务数, "depth": 队列总数}，
+--   任务不在排队时返回 NULL。
+--   已达每用户上限的用户的任务在领取时会被跳过，但这里仍计入 ahead，
+--   因此位置是上界。
+--
+-- 依赖 20261018050000 中的 generation_tier_rank()。
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION generation_queue_position(p_task_id uuid)
+RETURNS jsonb
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_rank integer;
+  v_ahead bigint;
+  v_depth bigint;
+BEGIN
+  SELECT * INTO v_task
+  FROM generation_tasks
+  WHERE id = p_task_id
+    AND job_type IS NOT NULL
+    AND status = 'pending';
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  v_rank := generation_tier_rank(
+    (SELECT subscription_tier FROM profiles WHERE id = v_task.user_id)
+  );
+
+  SELECT count(*) FILTER (
+           WHERE (generation_tier_rank(p.subscription_tier), q.created_at)
+                 < (v_rank, v_task.created_at)
+         ),
+         count(*)
+  INTO v_ahead, v_depth
+  FROM generation_tasks q
+  LEFT JOIN profiles p ON p.id = q.user_id
+  WHERE q.job_type IS NOT NULL
+    AND q.status = 'pending';
+
+  RETURN jsonb_build_object('ahead', v_ahead, 'depth', v_depth);
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION generation_queue_position(uuid) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION generation_queue_position(uuid) TO service_role;
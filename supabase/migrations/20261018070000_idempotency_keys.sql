@@ -0,0 +1,110 @@
+-- ============================================================================
+-- Idempotency-Key 持久化
+-- 日期：2026-10-18
+--
+-- 目的：
+--   扣费接口的 Idempotency-Key 此前只记在 API 进程内存中：重试落到另一个进程
+--   或进程重启后，同一个 key 会再次扣费并再次提交渲染。现在每个 key 记录在
+--   idempotency_keys 表中（每个用户的 key 唯一），保存请求体哈希和首次成功的
+--   响应；进程内存只作为快速路径。
+--     - claim_idempotency_key()：领取 key。返回
+--         {"state": "claimed"}                     → 由调用方执行请求
+--         {"state": "completed", "response": ...}  → 直接返回已保存的响应
+--         {"state": "in_progress"}                 → 另一个请求正在执行，稍后重试
+--         {"state": "conflict"}                    → key 已用于不同的请求
+--       执行中的 key 在 locked_until 之后视为执行方已失联，可被重新领取。
+--       超过 p_ttl_seconds 的 key 视为过期，领取时顺带清理该用户的过期 key。
+--   执行成功后后端写入 status = 'completed' 和响应；执行失败则删除该行，
+--   允许用同一个 key 重试。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 表：仅 service_role 访问（启用 RLS，不设策略）
+-- ----------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  user_id uuid NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+  idempotency_key text NOT NULL,
+  scope text NOT NULL,
+  request_hash text NOT NULL,
+  status text NOT NULL DEFAULT 'in_progress' CHECK (status IN ('in_progress', 'completed')),
+  response jsonb,
+  locked_until timestamptz,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  CONSTRAINT idempotency_keys_user_key UNIQUE (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_user_created
+  ON idempotency_keys (user_id, created_at);
+
+ALTER TABLE idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+-- ----------------------------------------------------------------------------
+-- 2. 领取 key（p_request_hash 已包含接口 scope，跨接口复用同一个 key 视为冲突）
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION claim_idempotency_key(
+  p_user_id uuid,
+  p_key text,
+  p_scope text,
+  p_request_hash text,
+  p_lock_seconds integer,
+  p_ttl_seconds integer
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_row idempotency_keys;
+BEGIN
+  DELETE FROM idempotency_keys
+  WHERE user_id = p_user_id
+    AND created_at < now() - make_interval(secs => p_ttl_seconds);
+
+  INSERT INTO idempotency_keys (user_id, idempotency_key, scope, request_hash, locked_until)
+  VALUES (p_user_id, p_key, p_scope, p_request_hash, now() + make_interval(secs => p_lock_seconds))
+  ON CONFLICT (user_id, idempotency_key) DO NOTHING;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object('state', 'claimed');
+  END IF;
+
+  SELECT * INTO v_row
+  FROM idempotency_keys
+  WHERE user_id = p_user_id
+    AND idempotency_key = p_key
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    -- 刚被执行失败的请求删除：让调用方重试领取
+    RETURN jsonb_build_object('state', 'in_progress');
+  END IF;
+
+  IF v_row.request_hash <> p_request_hash THEN
+    RETURN jsonb_build_object('state', 'conflict');
+  END IF;
+
+  IF v_row.status = 'completed' THEN
+    RETURN jsonb_build_object('state', 'completed', 'response', v_row.response);
+  END IF;
+
+  IF v_row.locked_until < now() THEN
+    UPDATE idempotency_keys
+    SET locked_until = now() + make_interval(secs => p_lock_seconds),
+        updated_at = now()
+    WHERE user_id = p_user_id
+      AND idempotency_key = p_key;
+    RETURN jsonb_build_object('state', 'claimed');
+  END IF;
+
+  RETURN jsonb_build_object('state', 'in_progress');
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 3. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION claim_idempotency_key(uuid, text, text, text, integer, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION claim_idempotency_key(uuid, text, text, text, integer, integer) TO service_role;
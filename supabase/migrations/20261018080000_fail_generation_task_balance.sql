@@ -0,0 +1,72 @@
+-- ============================================================================
+-- fail_generation_task 返回退款后的余额
+-- 日期：2026-10-18
+--
+-- 目的：
+--   后端在进程内缓存用户余额。失败任务的退款发生在 fail_generation_task()
+--   内部，此前后端只能让缓存失效、下次再查库。现在函数返回 refund_user_credits()
+--   的结果 balance_after（未退款或退款失败时为 NULL），后端直接写入缓存。
+--   其余行为与 20261018030000 相同。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION fail_generation_task(
+  p_task_id uuid,
+  p_error_message text,
+  p_refund_amount integer DEFAULT 0,
+  p_refund_description text DEFAULT NULL,
+  p_refund_reference_id uuid DEFAULT NULL,
+  p_refund_reference_type text DEFAULT NULL,
+  p_expected_attempts integer DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_refunded boolean := false;
+  v_balance integer;
+BEGIN
+  UPDATE generation_tasks
+  SET status = 'failed',
+      error_message = p_error_message
+  WHERE id = p_task_id
+    AND status IN ('pending', 'processing')
+    AND (p_expected_attempts IS NULL OR attempts = p_expected_attempts)
+  RETURNING * INTO v_task;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF v_task.project_id IS NOT NULL THEN
+    UPDATE projects SET status = 'failed' WHERE id = v_task.project_id;
+  END IF;
+
+  IF p_refund_amount > 0 THEN
+    BEGIN
+      v_balance := refund_user_credits(
+        v_task.user_id,
+        p_refund_amount,
+        p_refund_description,
+        p_refund_reference_id,
+        p_refund_reference_type
+      );
+      v_refunded := true;
+    EXCEPTION WHEN OTHERS THEN
+      RAISE WARNING 'Refund for generation task % failed: %', p_task_id, SQLERRM;
+    END;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'task', to_jsonb(v_task),
+    'refunded', v_refunded,
+    'balance_after', v_balance
+  );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) TO service_role;
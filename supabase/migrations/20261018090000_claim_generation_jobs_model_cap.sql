@@ -0,0 +1,128 @@
+-- ============================================================================
+-- 领取生成任务时执行每模型并发上限
+-- 日期：2026-10-18
+--
+-- 目的：
+--   SCHEDULER_MODEL_CONCURRENCY 原先只由每个进程内的调度器执行，N 个 worker
+--   进程合计会向同一模型提交 N × 上限 个渲染，超出 DashScope 的限流。
+--   现在与每用户上限一样在领取时由数据库执行：
+--     - 每个模型的在途任务（processing 且租约未过期）加上本次领取的任务不超过
+--       p_model_concurrency 中该模型的上限（未列出的模型用
+--       p_default_model_concurrency），达到上限的模型的任务留在队列中；
+--     - 任务的模型：digital_human 为 'wanx-v1'，其余为 config->>'model_type'，
+--       与后端 generation_pipeline.job_model() 一致。
+--   两个参数都为 NULL 时不限制（兼容未传这两个参数的旧版本后端）。
+--   进程内调度器仍按等级排序已领取的任务，其每模型上限作为单进程内的第二道限制。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 任务 → 模型，与后端 job_model() / DIGITAL_HUMAN_MODEL 一致
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION generation_job_model(p_job_type text, p_config jsonb)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE
+    WHEN p_job_type = 'digital_human' THEN 'wanx-v1'
+    ELSE COALESCE(p_config->>'model_type', '')
+  END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 2. 领取任务（替换 20261018050000 中的四参数版本）
+-- ----------------------------------------------------------------------------
+DROP FUNCTION IF EXISTS claim_generation_jobs(text, integer, integer, integer);
+
+CREATE OR REPLACE FUNCTION claim_generation_jobs(
+  p_worker_id text,
+  p_limit integer,
+  p_visibility_timeout_seconds integer,
+  p_user_max_in_flight integer DEFAULT NULL,
+  p_model_concurrency jsonb DEFAULT NULL,
+  p_default_model_concurrency integer DEFAULT NULL
+) RETURNS SETOF generation_tasks
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  -- 串行化领取：在途计数在本事务内不会被其他 worker 的领取改变
+  PERFORM pg_advisory_xact_lock(hashtext('claim_generation_jobs'));
+
+  RETURN QUERY
+  WITH leased AS (
+    SELECT f.user_id, generation_job_model(f.job_type, f.config) AS model
+    FROM generation_tasks f
+    WHERE f.job_type IS NOT NULL
+      AND f.status = 'processing'
+      AND f.lease_expires_at >= now()
+  ),
+  user_in_flight AS (
+    SELECT l.user_id, count(*) AS running
+    FROM leased l
+    GROUP BY l.user_id
+  ),
+  model_in_flight AS (
+    SELECT l.model, count(*) AS running
+    FROM leased l
+    GROUP BY l.model
+  ),
+  queued AS (
+    SELECT q.id,
+           q.user_id,
+           q.created_at,
+           generation_tier_rank(p.subscription_tier) AS tier_rank,
+           generation_job_model(q.job_type, q.config) AS model
+    FROM generation_tasks q
+    LEFT JOIN profiles p ON p.id = q.user_id
+    WHERE q.job_type IS NOT NULL
+      AND (
+        q.status = 'pending'
+        OR (q.status = 'processing'
+            AND q.lease_expires_at < now()
+            AND q.attempts < q.max_attempts)
+      )
+  ),
+  candidates AS (
+    SELECT q.id,
+           q.tier_rank,
+           COALESCE(u.running, 0)
+             + row_number() OVER (PARTITION BY q.user_id ORDER BY q.created_at) AS user_slot,
+           -- 模型名额按领取顺序（等级、创建时间）分配
+           COALESCE(m.running, 0)
+             + row_number() OVER (PARTITION BY q.model ORDER BY q.tier_rank, q.created_at) AS model_slot,
+           COALESCE((p_model_concurrency->>q.model)::integer, p_default_model_concurrency) AS model_cap
+    FROM queued q
+    LEFT JOIN user_in_flight u ON u.user_id = q.user_id
+    LEFT JOIN model_in_flight m ON m.model = q.model
+  ),
+  picked AS (
+    SELECT c.id
+    FROM generation_tasks c
+    JOIN candidates r ON r.id = c.id
+    WHERE (p_user_max_in_flight IS NULL OR r.user_slot <= p_user_max_in_flight)
+      AND (r.model_cap IS NULL OR r.model_slot <= r.model_cap)
+    ORDER BY r.tier_rank, c.created_at
+    FOR UPDATE OF c SKIP LOCKED
+    LIMIT p_limit
+  )
+  UPDATE generation_tasks t
+  SET status = 'processing',
+      lease_owner = p_worker_id,
+      lease_expires_at = now() + make_interval(secs => p_visibility_timeout_seconds),
+      attempts = t.attempts + 1,
+      started_at = COALESCE(t.started_at, now())
+  FROM picked
+  WHERE t.id = picked.id
+  RETURNING t.*;
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 3. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer, integer, jsonb, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION claim_generation_jobs(text, integer, integer, integer, jsonb, integer) TO service_role;
@@ -0,0 +1,152 @@
+-- ============================================================================
+-- 任务结束时记录 completed_at
+-- 日期：2026-10-18
+--
+-- 目的：
+--   complete_generation_task() / fail_generation_task()（20261018030000、
+--   20261018080000）只更新状态，从不写 completed_at，任务耗时统计和按完成时间
+--   的查询都拿不到值。现在两个函数在任务结束时写入 completed_at = now()，
+--   其余行为不变；已结束但 completed_at 为空的历史任务用 updated_at 回填。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+-- ----------------------------------------------------------------------------
+-- 1. 完成任务
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION complete_generation_task(
+  p_task_id uuid,
+  p_result_url text
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_name text;
+  v_text text;
+  v_project_id uuid;
+BEGIN
+  UPDATE generation_tasks
+  SET status = 'completed',
+      progress = 100,
+      result_url = p_result_url,
+      completed_at = now()
+  WHERE id = p_task_id
+    AND status IN ('pending', 'processing')
+  RETURNING * INTO v_task;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF v_task.job_type = 'digital_human' THEN
+    SELECT name INTO v_name
+    FROM digital_humans
+    WHERE id = (v_task.config->>'digital_human_id')::uuid;
+
+    v_text := COALESCE(v_task.config->>'text', '');
+
+    INSERT INTO projects (user_id, title, description, project_type, status, video_url)
+    VALUES (
+      v_task.user_id,
+      format('%s - %s...', v_name, left(v_text, 30)),
+      v_text,
+      'digital_human',
+      'completed',
+      p_result_url
+    )
+    RETURNING id INTO v_project_id;
+
+    UPDATE generation_tasks
+    SET project_id = v_project_id
+    WHERE id = p_task_id
+    RETURNING * INTO v_task;
+  ELSIF v_task.project_id IS NOT NULL THEN
+    UPDATE projects
+    SET video_url = p_result_url,
+        status = 'completed'
+    WHERE id = v_task.project_id;
+  END IF;
+
+  RETURN jsonb_build_object('task', to_jsonb(v_task));
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 2. 任务失败（返回值同 20261018080000）
+-- ----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION fail_generation_task(
+  p_task_id uuid,
+  p_error_message text,
+  p_refund_amount integer DEFAULT 0,
+  p_refund_description text DEFAULT NULL,
+  p_refund_reference_id uuid DEFAULT NULL,
+  p_refund_reference_type text DEFAULT NULL,
+  p_expected_attempts integer DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_task generation_tasks;
+  v_refunded boolean := false;
+  v_balance integer;
+BEGIN
+  UPDATE generation_tasks
+  SET status = 'failed',
+      error_message = p_error_message,
+      completed_at = now()
+  WHERE id = p_task_id
+    AND status IN ('pending', 'processing')
+    AND (p_expected_attempts IS NULL OR attempts = p_expected_attempts)
+  RETURNING * INTO v_task;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF v_task.project_id IS NOT NULL THEN
+    UPDATE projects SET status = 'failed' WHERE id = v_task.project_id;
+  END IF;
+
+  IF p_refund_amount > 0 THEN
+    BEGIN
+      v_balance := refund_user_credits(
+        v_task.user_id,
+        p_refund_amount,
+        p_refund_description,
+        p_refund_reference_id,
+        p_refund_reference_type
+      );
+      v_refunded := true;
+    EXCEPTION WHEN OTHERS THEN
+      RAISE WARNING 'Refund for generation task % failed: %', p_task_id, SQLERRM;
+    END;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'task', to_jsonb(v_task),
+    'refunded', v_refunded,
+    'balance_after', v_balance
+  );
+END;
+$$;
+
+-- ----------------------------------------------------------------------------
+-- 3. 回填历史任务
+-- ----------------------------------------------------------------------------
+UPDATE generation_tasks
+SET completed_at = updated_at
+WHERE status IN ('completed', 'failed', 'cancelled')
+  AND completed_at IS NULL;
+
+-- ----------------------------------------------------------------------------
+-- 4. 执行权限：仅后端 service_role
+-- ----------------------------------------------------------------------------
+REVOKE EXECUTE ON FUNCTION complete_generation_task(uuid, text) FROM public, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION complete_generation_task(uuid, text) TO service_role;
+GRANT EXECUTE ON FUNCTION fail_generation_task(uuid, text, integer, text, uuid, text, integer) TO service_role;
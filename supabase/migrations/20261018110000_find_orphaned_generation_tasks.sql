@@ -0,0 +1,44 @@
+-- ============================================================================
+-- 孤儿任务查询：在数据库中完成筛选
+-- 日期：2026-10-18
+--
+-- 目的：
+--   后端的孤儿任务恢复原先先按 created_at 取 RECOVERY_BATCH_SIZE 行，再在
+--   Python 中过滤 attempts >= max_attempts。租约过期但仍可被重新领取的任务
+--   （attempts < max_attempts）会占满这一批，真正的孤儿任务一直排不到。
+--   PostgREST 过滤无法比较两列，所以筛选改由本函数完成，只返回：
+--     - 队列之前的遗留任务（job_type 为 NULL，pending/processing）；
+--     - processing 但没有租约的队列任务；
+--     - processing、租约已过期且已用完投递次数的队列任务；
+--   并且 created_at 早于 now() - p_grace_seconds。
+--   按 updated_at 排序（最久未变化的优先），最多 p_limit 行。
+--
+-- 本迁移幂等，可重复运行。
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION find_orphaned_generation_tasks(
+  p_grace_seconds integer,
+  p_limit integer
+) RETURNS SETOF generation_tasks
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT t.*
+  FROM generation_tasks t
+  WHERE t.status IN ('pending', 'processing')
+    AND t.created_at < now() - make_interval(secs => p_grace_seconds)
+    AND (
+      t.job_type IS NULL
+      OR (t.status = 'processing' AND t.lease_expires_at IS NULL)
+      OR (t.status = 'processing'
+          AND t.lease_expires_at < now()
+          AND t.attempts >= t.max_attempts)
+    )
+  ORDER BY t.updated_at
+  LIMIT p_limit;
+$$;
+
+REVOKE EXECUTE ON FUNCTION find_orphaned_generation_tasks(integer, integer) FROM public, anon, authenticated;
+GRANT EXECUTE ON FUNCTION find_orphaned_generation_tasks(integer, integer) TO service_role;